@@ -0,0 +1,149 @@
+import numpy as np
+
+# Clockwise rotation of a page by multiples of 90 degrees, the same /Rotate does.
+# Rows are indexed by rotation // 90: matrix (a, b, c, d) followed by the shift that
+# brings the rotated page back to the origin, as multipliers of original width and
+# height (e = ew * width + eh * height, f = fw * width + fh * height)
+ROTATIONS = np.array([
+    # a, b, c, d, ew, eh, fw, fh
+    [1, 0, 0, 1, 0, 0, 0, 0],
+    [0, -1, 1, 0, 0, 0, 1, 0],
+    [-1, 0, 0, -1, 1, 0, 0, 1],
+    [0, 1, -1, 0, 0, 1, 0, 0],
+], dtype=float)
+
+
+class LayoutPlan:
+    """
+    Placement of every sticker calculated from sizes of stickers only, without
+    touching their content. All stickers are processed at once with array operations,
+    so a plan for a huge job can be built, checked and reused (e.g. for previews)
+    before any page is composed.
+
+    For every sticker the plan keeps the page it goes to, its position on that page,
+    the rotation and the scale, and the resulting transformation matrix
+    that puts the sticker content in place.
+    """
+    def __init__(
+            self,
+            widths,
+            heights,
+            page_width: float,
+            page_height: float,
+            stickers_in_width: int = 2,
+            stickers_in_height: int = 3,
+            margin: float = 0,
+            fill: bool = False,
+            keep_ratio: bool = True,
+            lefts=None,
+            bottoms=None,
+            rotations=None,
+            start: int = 0,
+    ):
+        """
+        :param widths: widths of media boxes of stickers
+        :param heights: heights of media boxes of stickers
+        :param page_width: width of a resulting page
+        :param page_height: height of a resulting page
+        :param stickers_in_width: how many stickers in a single row on a page
+        :param stickers_in_height: how many rows of stickers on a page
+        :param margin: margins around each sticker in points
+        :param fill: set True to resize stickers to fill all available space
+        :param keep_ratio: to rotate or not stickers if their original ratio is violated
+        :param lefts: left sides of media boxes. Zeros if not provided
+        :param bottoms: bottom sides of media boxes. Zeros if not provided
+        :param rotations: /Rotate values of stickers. Zeros if not provided
+        :param start: index of the first sticker in the whole job, for plans of its parts
+        """
+        self.widths = np.asarray(widths, dtype=float)
+        self.heights = np.asarray(heights, dtype=float)
+        count = len(self.widths)
+        self.lefts = np.zeros(count) if lefts is None else np.asarray(lefts, dtype=float)
+        self.bottoms = np.zeros(count) if bottoms is None else np.asarray(bottoms, dtype=float)
+        source_rotations = np.zeros(count, dtype=int) if rotations is None else np.asarray(rotations, dtype=int)
+
+        self.page_width = page_width
+        self.page_height = page_height
+        self.stickers_in_width = stickers_in_width
+        self.stickers_on_page = stickers_in_width * stickers_in_height
+        self.start = start
+
+        # Dimensions of stickers with margins:
+        space_width = page_width / stickers_in_width
+        space_height = page_height / stickers_in_height
+        # Dimensions of stickers without margins:
+        self.sticker_width = space_width - margin * 2
+        self.sticker_height = space_height - margin * 2
+
+        index = np.arange(start, start + count)
+        self.sheets = index // self.stickers_on_page
+        # Current sticker on x and y
+        column = index % stickers_in_width
+        row = (index % self.stickers_on_page) // stickers_in_width
+        self.x = column * space_width + margin
+        self.y = page_height - (row + 1) * space_height + margin  # origin is left bottom corner
+
+        # Rotate stickers if needed to roughly keep their ratio.
+        # Rotation already set for the page is applied as well
+        rotate = np.zeros(count, dtype=bool)
+        if keep_ratio:
+            rotate = (self.widths / self.heights > 1) != (self.sticker_width / self.sticker_height > 1)
+        self.rotations = np.where(rotate, (source_rotations // 90 * 90 + 90) % 360, 0)
+
+        swap = (self.rotations == 90) | (self.rotations == 270)
+        rotated_widths = np.where(swap, self.heights, self.widths)
+        rotated_heights = np.where(swap, self.widths, self.heights)
+
+        # Resize stickers
+        if fill:
+            self.scales_x = self.sticker_width / rotated_widths
+            self.scales_y = self.sticker_height / rotated_heights
+        else:
+            self.scales_x = np.minimum(self.sticker_width / rotated_widths, self.sticker_height / rotated_heights)
+            self.scales_y = self.scales_x
+
+        self._place()
+
+    def _place(self) -> None:
+        """
+        Makes transformation matrices of stickers from their rotations, scales and positions.
+        """
+        # Single matrix for: move the lower left corner of the media box to the origin,
+        # rotate, scale and move to the place on a page
+        a, b, c, d, ew, eh, fw, fh = ROTATIONS[self.rotations // 90].T
+        e = ew * self.widths + eh * self.heights - a * self.lefts - c * self.bottoms
+        f = fw * self.widths + fh * self.heights - b * self.lefts - d * self.bottoms
+        self.matrices = np.column_stack((
+            self.scales_x * a,
+            self.scales_y * b,
+            self.scales_x * c,
+            self.scales_y * d,
+            self.scales_x * e + self.x,
+            self.scales_y * f + self.y,
+        ))
+
+    def __len__(self) -> int:
+        return len(self.widths)
+
+    @property
+    def sheets_count(self) -> int:
+        """
+        Number of resulting pages the planned stickers are spread over.
+        """
+        if not len(self):
+            return 0
+        return int(self.sheets[-1] - self.sheets[0] + 1)
+
+    def sheet(self, number: int) -> range:
+        """
+        Indexes of stickers in the plan that go to the page with the given number.
+        """
+        first = max(number * self.stickers_on_page - self.start, 0)
+        last = min((number + 1) * self.stickers_on_page - self.start, len(self))
+        return range(first, max(first, last))
+
+    def ctm(self, index: int) -> tuple[float, ...]:
+        """
+        Transformation matrix of a sticker as (a, b, c, d, e, f).
+        """
+        return tuple(float(v) for v in self.matrices[index])
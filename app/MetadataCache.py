@@ -0,0 +1,228 @@
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+from typing import Iterable
+
+
+def default_cache_file() -> pathlib.Path:
+    """
+    Location of the cache shared by all runs of the application of the current user.
+    """
+    base = os.environ.get('XDG_CACHE_HOME') or pathlib.Path.home() / '.cache'
+    return pathlib.Path(base) / 'pdf-stickers' / 'metadata.sqlite3'
+
+
+def file_hash(path: str | os.PathLike, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as fp:
+        while chunk := fp.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class _Counter(logging.Handler):
+    """
+    Counts warnings of pypdf logged by every thread separately, so files parsed at the same time
+    by other threads don't add theirs. The handler is on the logger only while some thread counts,
+    so warnings of anything else are printed as usual.
+    """
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._counting = 0
+
+    def start(self) -> None:
+        self._local.count = 0
+        with self._lock:
+            if not self._counting:
+                logging.getLogger('pypdf').addHandler(self)
+            self._counting += 1
+
+    def stop(self) -> int:
+        """
+        Stops counting in the current thread.
+
+        :return: number of warnings logged by the thread since it started counting
+        """
+        with self._lock:
+            self._counting -= 1
+            if not self._counting:
+                logging.getLogger('pypdf').removeHandler(self)
+        count, self._local.count = self._local.count, None
+        return count
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # Handlers are called by the thread that logs
+        if getattr(self._local, 'count', None) is not None:
+            self._local.count += 1
+
+
+_counter = _Counter()
+
+
+def read_metadata(path: str | os.PathLike) -> dict:
+    """
+    Parses pdf file to learn what's needed to plan and check a job.
+
+    :param path: path to pdf file
+    :return: number of pages, media boxes and rotations of pages as kwargs of plan_layout,
+    whether the file was parsed without any warnings and error if it can't be parsed at all
+    """
+    # Import here, as the main module uses this one, and pypdf is only needed for parsing
+    from pypdf import PdfReader
+
+    from app.main import page_boxes
+
+    _counter.start()
+    try:
+        pages = PdfReader(pathlib.Path(path)).pages
+        metadata = {'pages': len(pages), **page_boxes(pages), 'error': None}
+    except Exception as e:
+        metadata = {'pages': 0, 'error': str(e) or type(e).__name__}
+    finally:
+        warnings = _counter.stop()
+    metadata['clean'] = metadata['error'] is None and not warnings
+    return metadata
+
+
+# Entries are marked as used again only if they weren't for this many seconds, so lookups of known
+# files don't write anything. Eviction order is that precise
+USED_PRECISION = 3600
+
+
+class MetadataCache:
+    """
+    Persistent cache of metadata of pdf files (see read_metadata), so unchanged files
+    don't have to be parsed again to plan and check a job.
+
+    Files are looked up by path, size and modification time, so a known file costs a single stat.
+    If any of them changed, content hash of the file is calculated and the metadata is looked up
+    by it, so copied, moved or touched files are not parsed again either.
+    Least recently used entries are evicted when there are more than max_entries of them
+    or they take more than max_bytes.
+    """
+    def __init__(
+            self,
+            file: str | os.PathLike | None = None,
+            max_entries: int = 100_000,
+            max_bytes: int = 64 * 2 ** 20,
+    ):
+        """
+        :param file: sqlite database to keep the cache in. Created if missing.
+        Default is metadata.sqlite3 in user's cache directory
+        :param max_entries: number of distinct files to keep metadata of
+        :param max_bytes: approximate size of kept metadata
+        """
+        self.file = pathlib.Path(file) if file is not None else default_cache_file()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        # Cache can be used from a background thread, one at a time
+        self._lock = threading.Lock()
+        try:
+            self._connection = self._connect()
+        except sqlite3.DatabaseError:
+            # Not a database or corrupted one. It's just a cache, start over
+            self.file.unlink()
+            self._connection = self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.file, timeout=30, check_same_thread=False)
+        with connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS paths (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, hash TEXT)'
+            )
+            connection.execute('CREATE TABLE IF NOT EXISTS metadata (hash TEXT PRIMARY KEY, data TEXT, used REAL)')
+        return connection
+
+    def _lookup(self, path: str | os.PathLike, now: float, touched: list[tuple[float, str]]) -> tuple[dict, bool]:
+        """
+        Metadata of the file and whether it's new to the cache. Entries not used for USED_PRECISION
+        are put in touched, to be marked as used at once.
+        """
+        stat = os.stat(path)
+        key = str(pathlib.Path(path).resolve())
+        row = self._connection.execute(
+            'SELECT metadata.hash, data, used FROM paths JOIN metadata ON paths.hash = metadata.hash '
+            'WHERE path = ? AND size = ? AND mtime = ?',
+            (key, stat.st_size, stat.st_mtime_ns),
+        ).fetchone()
+        added = False
+        if row is not None:
+            digest, data, used = row
+        else:
+            digest = file_hash(path)
+            row = self._connection.execute('SELECT data, used FROM metadata WHERE hash = ?', (digest,)).fetchone()
+            if row is not None:
+                data, used = row
+            else:
+                data, used, added = json.dumps(read_metadata(path)), now, True
+                self._connection.execute('INSERT OR REPLACE INTO metadata VALUES (?, ?, ?)', (digest, data, used))
+            self._connection.execute(
+                'INSERT OR REPLACE INTO paths VALUES (?, ?, ?, ?)',
+                (key, stat.st_size, stat.st_mtime_ns, digest),
+            )
+        if used < now - USED_PRECISION:
+            touched.append((now, digest))
+        return {**json.loads(data), 'hash': digest}, added
+
+    def _evict(self) -> None:
+        """
+        Evicts least recently used entries if there are too many of them or they are too big.
+        """
+        count, size = self._connection.execute('SELECT COUNT(*), SUM(LENGTH(data)) FROM metadata').fetchone()
+        if count <= self.max_entries and (size or 0) <= self.max_bytes:
+            return
+        self._connection.execute(
+            'DELETE FROM metadata WHERE hash IN ('
+            '   SELECT hash FROM ('
+            '       SELECT hash,'
+            '           ROW_NUMBER() OVER (ORDER BY used DESC) AS number,'
+            '           SUM(LENGTH(data)) OVER (ORDER BY used DESC) AS size'
+            '       FROM metadata'
+            '   ) WHERE number > ? OR size > ?'
+            ')',
+            (self.max_entries, self.max_bytes),
+        )
+        self._connection.execute('DELETE FROM paths WHERE hash NOT IN (SELECT hash FROM metadata)')
+
+    def get_many(self, files_list: Iterable[str | os.PathLike]) -> list[dict]:
+        """
+        Metadata of every file. Files not known yet are parsed and remembered. Nothing is written
+        for known files, unless they weren't used for USED_PRECISION.
+
+        :param files_list: paths to existing files
+        :return: list of metadata in the same order, with content hashes of files as 'hash'
+        """
+        now = time.time()
+        touched = []
+        with self._lock, self._connection:
+            found = [self._lookup(f, now, touched) for f in files_list]
+            if touched:
+                self._connection.executemany('UPDATE metadata SET used = ? WHERE hash = ?', touched)
+            # Only new entries can make the cache too big
+            if any(added for _, added in found):
+                self._evict()
+        return [metadata for metadata, _ in found]
+
+    def get(self, path: str | os.PathLike) -> dict:
+        return self.get_many([path])[0]
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+def default_cache() -> MetadataCache | None:
+    """
+    Cache in the default location, or None if it can't be used there (e.g. read-only home directory).
+    """
+    try:
+        return MetadataCache()
+    except (OSError, sqlite3.Error):
+        return None
@@ -0,0 +1,96 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+
+class Metrics:
+    """
+    Collects time spent in every stage of a job and counters of what was processed.
+
+    Stages:
+    validation - checking paths before anything is opened
+    open - opening and parsing input files
+    collection - collecting pages from opened files
+    layout - planning rotation, scale and position of stickers. Rotation and scaling
+    are applied while merging with the same transformation, so they are planned together
+    merge - placing stickers on pages
+    write - writing the result. Includes pages written while composing in streaming mode
+
+    Counters: files, pages, sheets, bytes_written, planned_sheets - number of sheets
+    the whole job takes, counted once the job is planned, if it's planned up front,
+    bytes_saved - how much smaller optimization made the result, and reused_sheets - sheets
+    copied from the previous result by an incremental job, or kept in shards completed by the previous run.
+
+    Stages don't overlap: time of a stage nested in another one (e.g. a file opened while
+    pages are collected) is counted only in the nested one, so the stages add up to wall time.
+
+    Every measurement goes through add_time and count, so a subclass can override them
+    to pass measurements further (logs, monitoring etc.) as soon as they are taken.
+    """
+    STAGES = ('validation', 'open', 'collection', 'layout', 'merge', 'write')
+    COUNTERS = ('files', 'pages', 'sheets', 'planned_sheets', 'bytes_written', 'bytes_saved', 'reused_sheets')
+
+    def __init__(self):
+        self.stages = dict.fromkeys(self.STAGES, 0.0)
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        # Time spent on every input file: opening, parsing and collecting pages
+        self.files: dict[str, float] = {}
+        # Time of stages nested in every stage being measured, innermost last, by thread
+        self._nested = threading.local()
+
+    @contextmanager
+    def stage(self, name: str, path: str | None = None) -> Iterator[None]:
+        """
+        Measures the time of the enclosed block as a part of the stage, without stages nested in it.
+
+        :param name: one of STAGES
+        :param path: input file the time is spent on, if any
+        """
+        if not hasattr(self._nested, 'stack'):
+            self._nested.stack = []
+        stack = self._nested.stack
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            nested = stack.pop()
+            if stack:
+                stack[-1] += seconds
+            self.add_time(name, seconds - nested, path)
+
+    def add_time(self, name: str, seconds: float, path: str | None = None) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        if path is not None:
+            self.files[path] = self.files.get(path, 0.0) + seconds
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def slowest_files(self, number: int = 5) -> list[tuple[str, float]]:
+        """
+        Input files that took the most time, slowest first.
+
+        :param number: how many files to return
+        :return: list of (path, seconds)
+        """
+        return sorted(self.files.items(), key=lambda item: item[1], reverse=True)[:number]
+
+    def as_dict(self) -> dict:
+        return {
+            'stages': dict(self.stages),
+            'counters': dict(self.counters),
+            'slowest_files': self.slowest_files(),
+        }
+
+    def __str__(self):
+        total = sum(self.stages.values())
+        lines = [f'{name}: {seconds:.3f}s' for name, seconds in self.stages.items()]
+        lines.append(f'total: {total:.3f}s')
+        lines += [f'{name}: {value}' for name, value in self.counters.items()]
+        if self.files:
+            lines.append('slowest files:')
+            lines += [f'  {seconds:.3f}s {path}' for path, seconds in self.slowest_files()]
+        return '\n'.join(lines)
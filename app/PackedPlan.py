@@ -0,0 +1,158 @@
+import numpy as np
+
+from app.LayoutPlan import LayoutPlan
+
+# Tolerance of comparisons of sizes in points, so stickers that exactly fill a page fit in it
+EPSILON = 1e-6
+
+
+def pack_shelves(
+        widths: list[float],
+        heights: list[float],
+        page_width: float,
+        page_height: float,
+        turn: bool = True,
+) -> tuple[list[int], list[float], list[float], list[bool]]:
+    """
+    Puts boxes on pages in shelves: rows as high as their first box, filled from left to right.
+
+    Every box goes to the first shelf of the current page it fits in, turned by 90 degrees if it fills
+    the height of the shelf better that way, or starts a new shelf under the others, turned so that a row
+    of boxes like it fills the width of the page best. The page is finished when the box fits nowhere on it,
+    so pages keep the order of boxes and every page depends only on its own boxes. Every box is expected
+    to fit in an empty page at least in one orientation.
+
+    :param widths: widths of boxes
+    :param heights: heights of boxes
+    :param page_width: width of a page
+    :param page_height: height of a page
+    :param turn: set False to keep boxes as they are
+    :return: page of every box, its left side and top side counted from the top of the page,
+    and whether it's turned
+    """
+    sheets, lefts, tops, turned = [], [], [], []
+    sheet = 0
+    # Shelves of the current page as [top, height, left side of the free space]
+    shelves = []
+    used_height = 0.0
+    page_width += EPSILON
+    page_height += EPSILON
+    for w, h in zip(widths, heights):
+        options = ((w, h, False), (h, w, True)) if turn and w != h else ((w, h, False),)
+        choice = None
+        for shelf in shelves:
+            top, height, free = shelf
+            for option in options:
+                if free + option[0] <= page_width and option[1] <= height + EPSILON:
+                    if choice is None or option[1] > choice[1]:
+                        choice = option
+            if choice is not None:
+                shelf[2] = free + choice[0]
+                break
+        else:
+            fitting = [o for o in options if o[0] <= page_width and used_height + o[1] <= page_height]
+            if not fitting:
+                sheet += 1
+                shelves = []
+                used_height = 0.0
+                fitting = [o for o in options if o[0] <= page_width and o[1] <= page_height]
+            # Orientation that fills the width of a page with boxes like this one best, the lower one of equal
+            choice = min(fitting, key=lambda o: (-(page_width // o[0]) * o[0], o[1]))
+            top, free = used_height, 0.0
+            shelves.append([top, choice[1], choice[0]])
+            used_height += choice[1]
+        sheets.append(sheet)
+        lefts.append(free)
+        tops.append(top)
+        turned.append(choice[2])
+    return sheets, lefts, tops, turned
+
+
+class PackedPlan(LayoutPlan):
+    """
+    Placement of stickers of different sizes at their own size, with as many stickers
+    on a page as fit in it, instead of the grid of equal cells.
+
+    Stickers are shown the way their /Rotate shows them and scaled by max_scale. Only stickers
+    that don't fit in a page at that scale are shrunk to fit. They are packed in shelves
+    (see pack_shelves), so a part of a job planned from the beginning of a page
+    is planned the same way the whole job is.
+
+    Pages of the plan are numbered from 0, whatever its start is.
+    """
+    def __init__(
+            self,
+            widths,
+            heights,
+            page_width: float,
+            page_height: float,
+            margin: float = 0,
+            max_scale: float = 1,
+            keep_ratio: bool = True,
+            lefts=None,
+            bottoms=None,
+            rotations=None,
+            start: int = 0,
+    ):
+        """
+        :param widths: widths of media boxes of stickers
+        :param heights: heights of media boxes of stickers
+        :param page_width: width of a resulting page
+        :param page_height: height of a resulting page
+        :param margin: margins around each sticker in points
+        :param max_scale: scale of stickers that fit in a page
+        :param keep_ratio: to turn or not stickers by 90 degrees when they fit better that way
+        :param lefts: left sides of media boxes. Zeros if not provided
+        :param bottoms: bottom sides of media boxes. Zeros if not provided
+        :param rotations: /Rotate values of stickers. Zeros if not provided
+        :param start: index of the first sticker in the whole job, for plans of its parts
+        """
+        self.widths = np.asarray(widths, dtype=float)
+        self.heights = np.asarray(heights, dtype=float)
+        count = len(self.widths)
+        self.lefts = np.zeros(count) if lefts is None else np.asarray(lefts, dtype=float)
+        self.bottoms = np.zeros(count) if bottoms is None else np.asarray(bottoms, dtype=float)
+        source_rotations = np.zeros(count, dtype=int) if rotations is None else np.asarray(rotations, dtype=int)
+        source_rotations = source_rotations // 90 * 90 % 360
+
+        self.page_width = page_width
+        self.page_height = page_height
+        self.start = start
+
+        # Sizes of stickers as they are shown
+        swap = (source_rotations == 90) | (source_rotations == 270)
+        shown_widths = np.where(swap, self.heights, self.widths)
+        shown_heights = np.where(swap, self.widths, self.heights)
+
+        # Stickers bigger than a page are shrunk to fit in it, turned if they are allowed to
+        room_width, room_height = page_width - margin * 2, page_height - margin * 2
+        fit = np.minimum(room_width / shown_widths, room_height / shown_heights)
+        if keep_ratio:
+            fit = np.maximum(fit, np.minimum(room_width / shown_heights, room_height / shown_widths))
+        self.scales_x = np.minimum(fit, max_scale)
+        self.scales_y = self.scales_x
+
+        sheets, x, tops, turned = pack_shelves(
+            (shown_widths * self.scales_x + margin * 2).tolist(),
+            (shown_heights * self.scales_y + margin * 2).tolist(),
+            page_width,
+            page_height,
+            keep_ratio,
+        )
+        self.sheets = np.asarray(sheets, dtype=int)
+        turned = np.asarray(turned, dtype=bool)
+        self.rotations = np.where(turned, (source_rotations + 90) % 360, source_rotations)
+
+        # Stickers are put in the top left corner of their place. Origin is left bottom corner
+        placed_heights = np.where(turned, shown_widths, shown_heights) * self.scales_y
+        self.x = np.asarray(x, dtype=float) + margin
+        self.y = page_height - np.asarray(tops, dtype=float) - margin - placed_heights
+
+        self._place()
+
+    def sheet(self, number: int) -> range:
+        """
+        Indexes of stickers in the plan that go to the page with the given number.
+        """
+        first, last = np.searchsorted(self.sheets, (number, number + 1))
+        return range(int(first), int(last))
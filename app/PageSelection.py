@@ -0,0 +1,88 @@
+import os
+import pathlib
+import re
+
+# Selection of pages written after a path: manifest.pdf[1-20,45,100-]
+SELECTION_PATTERN = re.compile(r'^(?P<path>.+)\[(?P<pages>[^\[\]]*)]$')
+# Single item of a selection: page, range of pages with open ends allowed, and step
+ITEM_PATTERN = re.compile(r'^(?P<first>\d*)(?:(?P<dash>-)(?P<last>\d*))?(?::(?P<step>\d+))?$')
+
+
+class PageSelection(os.PathLike):
+    """
+    Input file of which only some pages are used as stickers, in the given order.
+
+    Pages are numbered from 1 and selected by comma separated items:
+    45 - single page, 1-20 - range including both ends, 100- - from page 100 to the end,
+    -5 - from the first page to page 5, and :2 after a range takes every second page of it
+    (1-:2 - odd pages, 2-:2 - even ones). Pages can be repeated.
+
+    It's a path to the file for everything else, so it goes wherever a path does.
+    """
+    def __init__(self, path: str | os.PathLike, pages: str):
+        """
+        :param path: path to the file
+        :param pages: selection of pages like 1-20,45,100-
+        :raise ValueError: if the selection can't be parsed
+        """
+        self.path = pathlib.Path(path)
+        self.pages = pages
+        # (first index, last index or None for the end, step) of every item
+        self._items: list[tuple[int, int | None, int]] = []
+        for item in pages.split(','):
+            match = ITEM_PATTERN.match(item.strip())
+            if match is None or not match['first'] and not match['dash']:
+                raise ValueError(f'"{item.strip()}" is not a page or a range of pages')
+            first = int(match['first'] or 1)
+            last = first if not match['dash'] else int(match['last']) if match['last'] else None
+            step = int(match['step'] or 1)
+            if first < 1 or last is not None and last < first or step < 1:
+                raise ValueError(f'"{item.strip()}" is not a page or a range of pages')
+            self._items.append((first - 1, None if last is None else last - 1, step))
+
+    def __fspath__(self) -> str:
+        return os.fspath(self.path)
+
+    def __str__(self):
+        return f'{self.path}[{self.pages}]'
+
+    def __repr__(self):
+        return f'{type(self).__name__}({str(self.path)!r}, {self.pages!r})'
+
+    def __eq__(self, other):
+        return isinstance(other, PageSelection) and (self.path, self._items) == (other.path, other._items)
+
+    def __hash__(self):
+        return hash((self.path, tuple(self._items)))
+
+    def indexes(self, pages_count: int) -> list[int]:
+        """
+        Indexes of selected pages of the file.
+
+        :param pages_count: number of pages in the file
+        :return: list of indexes of pages in the order they are selected
+        :raise IndexError: if a selected page is beyond the end of the file
+        """
+        result = []
+        for first, last, step in self._items:
+            if max(first, last or 0) >= pages_count:
+                raise IndexError(f'Page {max(first, last or 0) + 1} is selected, but the file has {pages_count} pages')
+            result += range(first, pages_count if last is None else last + 1, step)
+        return result
+
+
+def parse_file(entry: str | os.PathLike) -> str | os.PathLike:
+    """
+    Makes PageSelection of a path followed by a selection of pages in brackets (manifest.pdf[1-20,45,100-]).
+    Existing files and other paths are left as they are.
+
+    :param entry: path, possibly with a selection of pages
+    :return: PageSelection or the same entry
+    :raise ValueError: if the selection can't be parsed
+    """
+    if not isinstance(entry, str) or os.path.exists(entry):
+        return entry
+    match = SELECTION_PATTERN.match(entry)
+    if match is None:
+        return entry
+    return PageSelection(match['path'], match['pages'])
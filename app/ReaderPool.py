@@ -0,0 +1,138 @@
+import os
+import pathlib
+import threading
+import weakref
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterable, Iterator
+
+from app.Metrics import Metrics
+from app.SourceReader import SourceReader
+
+# Files opened ahead of the one being composed by default
+DEFAULT_LOOKAHEAD = 4
+# Files kept open at once by default, well below the usual limit of 1024 descriptors of a process
+DEFAULT_MAX_OPEN = 256
+
+
+class ReaderPool:
+    """
+    Opens and parses upcoming input files on background threads while the current ones
+    are composed, so waiting for slow (e.g. network) storage overlaps with composing
+    instead of coming before it. Readers are given in the order of files, as the plain
+    iter_readers gives them.
+
+    At most lookahead files are opened ahead, each on its own thread. Memory-mapped files
+    keep their descriptors till their readers are closed, so only max_open - lookahead
+    readers are mapped and open at once, and the rest are read in memory. Together with
+    the files being opened, the pool never has more than max_open files open, however many
+    files a job has and however long their readers are kept.
+    """
+    def __init__(self, lookahead: int = DEFAULT_LOOKAHEAD, max_open: int = DEFAULT_MAX_OPEN):
+        """
+        :param lookahead: how many files to open ahead of the one being composed
+        :param max_open: most files kept open at once
+        :raise ValueError: if lookahead or max_open is not positive
+        """
+        if lookahead < 1 or max_open < 1:
+            raise ValueError('Look-ahead window and limit of open files should be positive')
+        self.lookahead = min(lookahead, max_open)
+        self.max_open = max_open
+        self._lock = threading.Lock()
+        # Mapped readers, each of them keeps a descriptor of its file till it's closed or collected
+        self._mapped: weakref.WeakSet[SourceReader] = weakref.WeakSet()
+        # Files being mapped right now
+        self._mapping = 0
+
+    def _mapped_count(self) -> int:
+        # Called under the lock. Closed readers don't keep their descriptors anymore
+        for reader in [r for r in self._mapped if r.closed]:
+            self._mapped.discard(reader)
+        return len(self._mapped) + self._mapping
+
+    def _open(self, path: str | os.PathLike, mapped: bool) -> SourceReader:
+        if mapped:
+            with self._lock:
+                mapped = self._mapped_count() < self.max_open - self.lookahead
+                if mapped:
+                    self._mapping += 1
+        try:
+            reader = SourceReader(path, mapped=mapped)
+            # Root of the page tree is read as well, it's the first thing composing asks for
+            reader.pages_count
+        finally:
+            if mapped:
+                with self._lock:
+                    self._mapping -= 1
+        if mapped:
+            with self._lock:
+                self._mapped.add(reader)
+        return reader
+
+    def readers(
+            self,
+            files_list: Iterable[str | os.PathLike],
+            share: bool = False,
+            metrics: Metrics | None = None,
+            mapped: bool = False,
+            opened: dict[pathlib.Path, SourceReader] | None = None,
+            count: bool = True,
+    ) -> Iterator[SourceReader]:
+        """
+        Same as iter_readers, but upcoming files are opened in the background.
+        Time spent waiting for a file that isn't opened yet is counted as opening it.
+
+        :param files_list: paths to pdf files, already validated
+        :param share: set True to open repeated files only once and yield the same reader
+        :param metrics: Metrics to collect time of opening files and their number in
+        :param mapped: set True to memory-map files instead of reading them in memory
+        :param opened: readers opened already by resolved paths of their files, to share them between
+        several calls. Readers opened while sharing are added to it
+        :param count: set False not to count files, when they are opened again by the same job
+        :return: Iterator of SourceReader objects
+        """
+        if metrics is None:
+            metrics = Metrics()
+        if opened is None:
+            opened = {}
+        files = iter(files_list)
+        # Upcoming files: resolved path and the future of its reader, None if it's opened already
+        window: deque[tuple[pathlib.Path, Future | None]] = deque()
+        # Futures of shared files being opened
+        pending: dict[pathlib.Path, Future] = {}
+        executor = ThreadPoolExecutor(max_workers=self.lookahead, thread_name_prefix='reader')
+
+        def fill() -> None:
+            while len(window) < self.lookahead:
+                f = next(files, None)
+                if f is None:
+                    return
+                key = pathlib.Path(f).resolve()
+                if share and (key in opened or key in pending):
+                    window.append((key, pending.get(key)))
+                    continue
+                future = executor.submit(self._open, f, mapped)
+                if share:
+                    pending[key] = future
+                window.append((key, future))
+
+        try:
+            fill()
+            while window:
+                key, future = window.popleft()
+                # The next file starts opening while this one is composed
+                fill()
+                if count:
+                    metrics.count('files')
+                if future is None:
+                    yield opened[key]
+                    continue
+                with metrics.stage('open', str(key)):
+                    reader = future.result()
+                if share:
+                    opened[key] = reader
+                    pending.pop(key, None)
+                yield reader
+        finally:
+            # Files nobody is going to use are not opened
+            executor.shutdown(wait=True, cancel_futures=True)
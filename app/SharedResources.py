@@ -0,0 +1,165 @@
+import hashlib
+import weakref
+
+from pypdf import PdfReader, PdfWriter, PageObject
+from pypdf.generic import (
+    ArrayObject,
+    DictionaryObject,
+    IndirectObject,
+    NameObject,
+    PdfObject,
+    StreamObject,
+)
+
+# Categories of page resources that are referred to by name from content streams
+RESOURCE_CATEGORIES = ('/ExtGState', '/Font', '/XObject', '/ColorSpace', '/Pattern', '/Shading', '/Properties')
+
+
+class _Cycle(Exception):
+    pass
+
+
+class SharedResources:
+    """
+    Registry of resources (fonts, images, graphic states etc.) put in a writer, by hashes
+    of their content. Every sticker brings its own copies of resources of its file,
+    and stickers made by the same generator in different files bring identical ones.
+    Resources of stickers are replaced by the ones already in the writer before
+    the stickers are placed, so every distinct resource is in the document once,
+    and a sheet refers to it by a single name however many stickers use it.
+
+    Hashes are taken from the source objects, so resources are compared without cloning them.
+    Objects referring to themselves (directly or through others) are never shared.
+    """
+    # Registries of writers, so several calls composing in the same writer share its resources
+    _registries: 'weakref.WeakKeyDictionary[PdfWriter, SharedResources]' = weakref.WeakKeyDictionary()
+
+    def __init__(self, writer: PdfWriter):
+        # Registry is kept by the writer, so it mustn't keep the writer itself
+        self._writer = weakref.ref(writer)
+        # References to resources in the writer by hashes of their content
+        self.objects: dict[bytes, IndirectObject] = {}
+        # Resource dictionaries made of shared resources by hashes of source ones. They are kept
+        # out of the writer, as a streaming writer drops objects of written pages
+        self._dictionaries: dict[bytes, DictionaryObject] = {}
+        # Hashes of objects of the current source by their numbers, None for the ones
+        # that can't be shared. The source is kept, as its numbers mean nothing for other files
+        self._source: PdfReader | None = None
+        self._digests: dict[int, bytes | None] = {}
+
+    @classmethod
+    def of(cls, writer: PdfWriter) -> 'SharedResources':
+        """
+        Registry of the writer, created on the first call.
+        """
+        if writer not in cls._registries:
+            cls._registries[writer] = cls(writer)
+        return cls._registries[writer]
+
+    def _use(self, source: PdfReader) -> None:
+        if source is not self._source:
+            self._source = source
+            self._digests = {}
+
+    def _digest(self, ref: IndirectObject, pending: set[int]) -> bytes:
+        if ref.idnum in self._digests:
+            digest = self._digests[ref.idnum]
+            if digest is None:
+                raise _Cycle
+            return digest
+        if ref.idnum in pending:
+            raise _Cycle
+        pending.add(ref.idnum)
+        try:
+            hasher = hashlib.blake2b(digest_size=20)
+            self._update(hasher, ref.get_object(), pending)
+            digest = hasher.digest()
+        except _Cycle:
+            self._digests[ref.idnum] = None
+            raise
+        finally:
+            pending.discard(ref.idnum)
+        self._digests[ref.idnum] = digest
+        return digest
+
+    def _update(self, hasher, obj: PdfObject | None, pending: set[int]) -> None:
+        if isinstance(obj, IndirectObject):
+            hasher.update(b'R' + self._digest(obj, pending))
+        elif isinstance(obj, DictionaryObject):
+            hasher.update(b'<<%d' % len(obj))
+            for key in sorted(obj):
+                hasher.update(key.encode())
+                self._update(hasher, obj.raw_get(key), pending)
+            if isinstance(obj, StreamObject):
+                # Encoded data is compared, along with its filters from the dictionary
+                hasher.update(b'stream%d' % len(obj._data))
+                hasher.update(obj._data)
+        elif isinstance(obj, ArrayObject):
+            hasher.update(b'[%d' % len(obj))
+            for item in obj:
+                self._update(hasher, item, pending)
+        elif obj is None:
+            hasher.update(b'null')
+        else:
+            hasher.update(type(obj).__name__.encode() + b' ' + repr(obj).encode())
+
+    def share(self, resources: DictionaryObject, source: PdfReader) -> DictionaryObject:
+        """
+        Resources with every indirect resource of the categories content refers to by name
+        replaced by the same one in the writer. Resources not seen before are cloned in the writer
+        and registered. Direct resources and other entries are left as they are.
+
+        :param resources: resource dictionary of a page of the source
+        :param source: reader the page is from
+        :return: new resource dictionary, the given one isn't changed
+        """
+        self._use(source)
+        shared = DictionaryObject()
+        for key in resources:
+            value = resources.raw_get(key)
+            if key not in RESOURCE_CATEGORIES:
+                shared[key] = value
+                continue
+            entries = value.get_object()
+            category = DictionaryObject()
+            for name in entries:
+                resource = entries.raw_get(name)
+                if isinstance(resource, IndirectObject) and resource.pdf is source:
+                    try:
+                        digest = self._digest(resource, set())
+                    except _Cycle:
+                        pass
+                    else:
+                        if digest not in self.objects:
+                            self.objects[digest] = resource.clone(self._writer())
+                        resource = self.objects[digest]
+                category[name] = resource
+            shared[key] = category
+        return shared
+
+    def page(self, page: PageObject) -> PageObject:
+        """
+        Copy of a page of a source with shared resources, to be merged instead of the page.
+        The page itself isn't changed.
+        """
+        copy = PageObject(page.pdf, page.indirect_reference)
+        for key in page:
+            copy[key] = page.raw_get(key)
+        if '/Resources' not in page:
+            return copy
+
+        resources = page.raw_get('/Resources')
+        # Pages of a file usually share their resource dictionary, then the shared one is registered as well
+        if isinstance(resources, IndirectObject) and resources.pdf is page.pdf:
+            self._use(page.pdf)
+            try:
+                digest = self._digest(resources, set())
+            except _Cycle:
+                pass
+            else:
+                if digest not in self._dictionaries:
+                    self._dictionaries[digest] = self.share(resources.get_object(), page.pdf)
+                copy[NameObject('/Resources')] = self._dictionaries[digest]
+                return copy
+        copy[NameObject('/Resources')] = self.share(resources.get_object(), page.pdf)
+        return copy
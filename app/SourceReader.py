@@ -0,0 +1,126 @@
+import io
+import mmap
+import os
+import pathlib
+
+from pypdf import PdfReader, PageObject
+from pypdf.generic import NameObject
+
+# Attributes pages take from the nodes of the page tree above them if they don't have their own
+INHERITED_ATTRIBUTES = ('/Resources', '/MediaBox', '/CropBox', '/Rotate')
+
+
+def _is_node(obj) -> bool:
+    """
+    Whether the object of the page tree is a node with kids rather than a page.
+    """
+    return obj.get('/Type', '/Pages' if '/Kids' in obj else '/Page') == '/Pages'
+
+
+class SourceReader(PdfReader):
+    """
+    PdfReader that remembers the file it's opened from.
+
+    Memory-mapped file is read right from the OS page cache instead of being copied
+    in memory as a whole, so it doesn't take memory of the process and is shared
+    by all processes reading the same file.
+
+    Content of a document that isn't a file (e.g. read from a pipe) can be given as data,
+    then the path is just a name of the document.
+
+    Pages can be taken one by one with page, which reads only the branch of the page tree
+    leading to the page, instead of pages, which loads all of them at once.
+    """
+    def __init__(self, path: str | os.PathLike, *args, mapped: bool = False, data: bytes | None = None, **kwargs):
+        # PdfReader takes anything but str and Path for a stream
+        stream = pathlib.Path(path) if data is None else io.BytesIO(data)
+        if mapped and data is None:
+            with open(path, 'rb') as fp:
+                # Empty file can't be mapped, let PdfReader complain about it as usual
+                if os.fstat(fp.fileno()).st_size:
+                    # Mapping stays valid after the file is closed
+                    stream = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        super().__init__(stream, *args, **kwargs)
+        # Document given as data isn't a file, the path is only its name
+        self.path = pathlib.Path(path).resolve() if data is None else pathlib.PurePosixPath(path)
+        self.closed = False
+
+    def release(self) -> None:
+        """
+        Forgets objects parsed so far (pages, content streams, resources etc.). pypdf keeps
+        every object it has parsed, so a reader that has given all its pages grows as big
+        as the pages themselves. Objects are parsed again if they are needed after that.
+        """
+        self.resolved_objects.clear()
+        self.flattened_pages = None
+        self._page_id2num = None
+
+    def close(self) -> None:
+        """
+        Releases parsed objects and the content of the file: the memory map along with the descriptor
+        of the file it keeps, or the copy of the file in memory. Mapped file is unmapped only when cyclic
+        references between the reader and its objects are collected otherwise, so close readers
+        as soon as their pages are placed. Nothing can be read after that.
+        """
+        if self.closed:
+            return
+        self.release()
+        self.stream.close()
+        self.closed = True
+
+    @property
+    def pages_count(self) -> int:
+        """
+        Number of pages, from the root of the page tree unless all pages are loaded already.
+        """
+        if self.flattened_pages is not None:
+            return len(self.flattened_pages)
+        return int(self.root_object['/Pages']['/Count'])
+
+    def page(self, index: int) -> PageObject:
+        """
+        Page by its index. Nodes of the page tree are skipped by numbers of pages in them,
+        so only the nodes on the way to the page are read, and a page of a huge file costs
+        about the same as a page of a small one.
+
+        :param index: index of the page
+        :return: PageObject with attributes inherited from the page tree, the same pages gives
+        :raise IndexError: if there is no such page
+        """
+        if self.flattened_pages is not None:
+            return self.flattened_pages[index]
+        if not 0 <= index < self.pages_count:
+            raise IndexError(f'Page index {index} is out of range')
+
+        node = self.root_object['/Pages'].get_object()
+        reference = None
+        inherited = {}
+        while _is_node(node):
+            inherited.update((name, node.raw_get(name)) for name in INHERITED_ATTRIBUTES if name in node)
+            kids = node['/Kids']
+            # Node with as many pages as kids usually has pages only, as writers make them,
+            # then the page is right at its index
+            if int(node.get('/Count', -1)) == len(kids):
+                child = kids[index].get_object()
+                if child and not _is_node(child):
+                    node, reference = child, kids[index]
+                    break
+            for kid in kids:
+                child = kid.get_object()
+                # Damaged file may have invalid kids
+                if not child:
+                    continue
+                count = int(child.get('/Count', 0)) if _is_node(child) else 1
+                if index < count:
+                    node, reference = child, kid
+                    break
+                index -= count
+            else:
+                raise IndexError('Page tree has less pages than it claims')
+
+        page = PageObject(self, reference)
+        page.update(node)
+        for name, value in inherited.items():
+            if name not in page:
+                page[NameObject(name)] = value
+        return page
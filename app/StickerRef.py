@@ -0,0 +1,86 @@
+from array import array
+from typing import Iterator, NamedTuple, Sequence
+
+
+class StickerRef(NamedTuple):
+    """
+    What's known about a sticker without its page: the file it's from, as an index
+    in the list of sources, the index of its page in the file, its media box and /Rotate.
+    """
+    source: int
+    page: int
+    width: float
+    height: float
+    left: float
+    bottom: float
+    rotation: int
+
+
+class StickerRefs(Sequence[StickerRef]):
+    """
+    Descriptors of stickers kept in typed arrays, 42 bytes per sticker, instead of parsed
+    pages with their dictionaries, kilobytes each. Stickers are planned from the arrays,
+    and pages are taken from their sources only to be placed, one at a time.
+
+    Items are StickerRef made on access, slices are StickerRefs sharing nothing with this one.
+    """
+    def __init__(self):
+        self.sources = array('I')
+        self.pages = array('I')
+        self.widths = array('d')
+        self.heights = array('d')
+        self.lefts = array('d')
+        self.bottoms = array('d')
+        self.rotations = array('h')
+
+    def append(self, source: int, page: int, width: float, height: float, left: float, bottom: float,
+               rotation: int) -> None:
+        for values, value in zip(self._columns(), (source, page, width, height, left, bottom, rotation)):
+            values.append(value)
+
+    def extend(self, source: int, pages: Sequence[int], boxes: dict[str, Sequence[float]]) -> None:
+        """
+        Adds stickers of a file.
+
+        :param source: index of the file in the list of sources
+        :param pages: indexes of pages of the file
+        :param boxes: widths, heights, lefts, bottoms and rotations of the pages, see page_boxes
+        """
+        self.sources.extend([source] * len(pages))
+        self.pages.extend(pages)
+        self.widths.extend(boxes['widths'])
+        self.heights.extend(boxes['heights'])
+        self.lefts.extend(boxes['lefts'])
+        self.bottoms.extend(boxes['bottoms'])
+        self.rotations.extend(int(r) for r in boxes['rotations'])
+
+    def _columns(self) -> tuple[array, ...]:
+        return self.sources, self.pages, self.widths, self.heights, self.lefts, self.bottoms, self.rotations
+
+    def boxes(self) -> dict[str, array]:
+        """
+        Widths, heights, left and bottom sides of media boxes and rotations of stickers
+        as keyword arguments of plan_layout.
+        """
+        return {
+            'widths': self.widths,
+            'heights': self.heights,
+            'lefts': self.lefts,
+            'bottoms': self.bottoms,
+            'rotations': self.rotations,
+        }
+
+    def __len__(self) -> int:
+        return len(self.pages)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            part = StickerRefs()
+            for values, source in zip(part._columns(), self._columns()):
+                values.extend(source[index])
+            return part
+        return StickerRef(*(values[index] for values in self._columns()))
+
+    def __iter__(self) -> Iterator[StickerRef]:
+        return map(StickerRef._make, zip(*self._columns()))
+
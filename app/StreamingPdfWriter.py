@@ -0,0 +1,169 @@
+from array import array
+from typing import BinaryIO
+
+from pypdf import PdfWriter, PageObject
+from pypdf.generic import (
+    ArrayObject,
+    DictionaryObject,
+    IndirectObject,
+    NullObject,
+    PdfObject,
+    StreamObject,
+)
+
+from app.optimize import compress_stream
+
+
+class _CountingStream:
+    """
+    Thin wrapper that keeps track of the amount of written bytes, so the
+    output stream doesn't have to be seekable (pipes, sockets etc.).
+    """
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+        self.position = 0
+
+    def write(self, data: bytes) -> int:
+        self.stream.write(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+
+class StreamingPdfWriter(PdfWriter):
+    """
+    PdfWriter that serializes every finished page with all objects it refers to
+    as soon as the next page is added, and releases them right away.
+    Only page tree, catalog, info and xref are written on close, so the amount
+    of memory taken doesn't depend on the number of pages in the document.
+    Written objects are replaced by placeholders, only their offsets are kept,
+    8 bytes per object, for the xref table.
+
+    Pages must not be modified after the next page is added.
+
+    With compress, streams without filters are Flate compressed as they are written.
+    """
+    def __init__(self, stream: BinaryIO, compress: bool = False):
+        super().__init__()
+        self.compress = compress
+        # How much smaller compressed streams are
+        self.bytes_saved = 0
+        self._output = _CountingStream(stream)
+        # Offsets of objects by their numbers - 1. Zero for not written ones,
+        # as no object can start where the header is
+        self._offsets = array('Q')
+        self._pending_page: PageObject | None = None
+        # Number of objects that existed at the moment of the last flush
+        self._flushed_up_to = len(self._objects)
+        self._header_written = False
+        self.closed = False
+
+    @property
+    def bytes_written(self) -> int:
+        return self._output.position
+
+    def _add_page(self, page, action, excluded_keys=()) -> PageObject:
+        self.flush()
+        added = super()._add_page(page, action, excluded_keys)
+        self._pending_page = added
+        return added
+
+    def _write_header(self) -> None:
+        if not self._header_written:
+            self._output.write(self.pdf_header.encode() + b'\n')
+            self._output.write(b'%\xE2\xE3\xCF\xD3\n')
+            self._header_written = True
+
+    def _written(self, idnum: int) -> bool:
+        return idnum <= len(self._offsets) and self._offsets[idnum - 1] != 0
+
+    def _write_object(self, idnum: int, obj: PdfObject) -> None:
+        if len(self._offsets) < idnum:
+            self._offsets.extend([0] * (idnum - len(self._offsets)))
+        self._offsets[idnum - 1] = self._output.tell()
+        if self.compress and isinstance(obj, StreamObject):
+            compressed = compress_stream(obj)
+            self.bytes_saved += len(obj._data) - len(compressed._data)
+            obj = compressed
+        self._output.write(f'{idnum} 0 obj\n'.encode())
+        obj.write_to_stream(self._output)
+        self._output.write(b'\nendobj\n')
+
+    def _release(self, idnum: int) -> None:
+        # Keep a reference in place of the written object: pypdf looks up already
+        # cloned objects by their number and needs only the reference to reuse them
+        placeholder = NullObject()
+        placeholder.indirect_reference = IndirectObject(idnum, 0, self)
+        self._objects[idnum - 1] = placeholder
+
+    def flush(self) -> None:
+        """
+        Writes the last added page with all not yet written objects it refers to.
+        Objects of the document structure are skipped as they are changed by
+        every added page.
+        """
+        page = self._pending_page
+        if page is None:
+            return
+        self._pending_page = None
+        self._write_header()
+
+        structure = {self._pages.idnum, self._root.idnum, self._info_obj.idnum}
+        stack = [page.indirect_reference]
+        while stack:
+            ref = stack.pop()
+            if ref.pdf is not self or self._written(ref.idnum) or ref.idnum in structure:
+                continue
+            obj = self._objects[ref.idnum - 1]
+            self._write_object(ref.idnum, obj)
+            # Walk through direct containers to find further indirect objects
+            children = [obj]
+            while children:
+                child = children.pop()
+                if isinstance(child, IndirectObject):
+                    stack.append(child)
+                elif isinstance(child, DictionaryObject):
+                    children.extend(child.values())
+                elif isinstance(child, ArrayObject):
+                    children.extend(child)
+            self._release(ref.idnum)
+
+        # Every merge replaces page contents with a new stream and leaves the previous
+        # one behind. Such objects can't be reached from anywhere, so just drop them
+        for idnum in range(self._flushed_up_to + 1, len(self._objects) + 1):
+            if not self._written(idnum) and idnum not in structure:
+                self._objects[idnum - 1] = None
+        self._flushed_up_to = len(self._objects)
+
+        # Page itself is written and doesn't need to be kept
+        for index in range(len(self.flattened_pages) - 1, -1, -1):
+            if self.flattened_pages[index] is page:
+                self.flattened_pages[index] = self._objects[page.indirect_reference.idnum - 1]
+                break
+
+    def close(self) -> None:
+        """
+        Flushes the last page and writes the rest of objects, xref table and trailer.
+        """
+        if self.closed:
+            return
+        self.flush()
+        self._write_header()
+        for i, obj in enumerate(self._objects):
+            idnum = i + 1
+            if not self._written(idnum) and obj is not None:
+                self._write_object(idnum, obj)
+
+        xref_location = self._output.tell()
+        self._output.write(b'xref\n')
+        self._output.write(f'0 {len(self._objects) + 1}\n'.encode())
+        self._output.write(f'{0:0>10} {65535:0>5} f \n'.encode())
+        for idnum in range(1, len(self._objects) + 1):
+            if self._written(idnum):
+                self._output.write(f'{self._offsets[idnum - 1]:0>10} {0:0>5} n \n'.encode())
+            else:
+                self._output.write(f'{0:0>10} {65535:0>5} f \n'.encode())
+        self._write_trailer(self._output, xref_location)
+        self.closed = True
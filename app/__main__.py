@@ -0,0 +1,17 @@
+import sys
+
+if __name__ == '__main__':
+    # python -m app batch jobs.jsonl runs a batch of jobs, serve runs the server for jobs,
+    # client sends a single job to it, everything else composes a single one
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        from app import batch
+        batch.main(sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == 'serve':
+        from app import service
+        service.serve_main(sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == 'client':
+        from app import service
+        service.client_main(sys.argv[2:])
+    else:
+        from app import main
+        main.main()
@@ -0,0 +1,230 @@
+from __future__ import annotations
+
+import json
+import os
+import pathlib
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import TYPE_CHECKING, Iterator
+
+from app.MetadataCache import MetadataCache, default_cache
+from app.Metrics import Metrics
+from app.main import (
+    UnprocessableArgumentsError,
+    compose_stickers,
+    file_name,
+    parse_files,
+    parse_options,
+    set_workers,
+)
+
+if TYPE_CHECKING:
+    from pypdf import PdfReader
+
+# How many opened files a process keeps for the next jobs
+MAX_READERS = 256
+
+# Readers kept by the process between jobs, by resolved paths, least recently used first,
+# with sizes and modification times of their files to notice changed ones
+_readers: OrderedDict[pathlib.Path, PdfReader] = OrderedDict()
+_signatures: dict[pathlib.Path, tuple[int, int]] = {}
+_cache: MetadataCache | None = None
+
+
+def _signature(path: pathlib.Path) -> tuple[int, int] | None:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _forget_changed(files_list: list) -> None:
+    for f in files_list:
+        key = pathlib.Path(f).resolve()
+        if key in _readers and _signatures.get(key) != _signature(key):
+            del _readers[key]
+            _signatures.pop(key, None)
+
+
+def _remember_used(files_list: list) -> None:
+    for f in files_list:
+        key = pathlib.Path(f).resolve()
+        if key in _readers:
+            _readers.move_to_end(key)
+            if key not in _signatures:
+                _signatures[key] = _signature(key)
+    while len(_readers) > MAX_READERS:
+        key, _ = _readers.popitem(last=False)
+        _signatures.pop(key, None)
+
+
+def run_job(number: int, job: dict | str) -> dict:
+    """
+    Process pool task. Runs compose_stickers with kwargs of the job. Files opened by
+    previous jobs in the same process are reused, unless they are changed since then.
+    Nothing the job does raises, every failure is reported in the result.
+
+    :param number: number of the line of the job in the jobs file
+    :param job: kwargs of compose_stickers, or the line it was expected to be parsed from
+    :return: result of the job: its number, output file, status, error if any, time,
+    size of the output and counters of the job
+    """
+    global _cache
+    if _cache is None:
+        _cache = default_cache()
+
+    result = {'job': number, 'file_to_write': None, 'status': 'error'}
+    start = time.perf_counter()
+    try:
+        if not isinstance(job, dict):
+            raise UnprocessableArgumentsError([(str(job)[:100], 'Job should be a JSON object of arguments'), ])
+        job = dict(job)
+        # Selected pages are cut off the paths, so readers kept for the files are found by them
+        files_list = parse_files(job.pop('files_list', []))
+        file_to_write = job.pop('file_to_write', 'stickers.pdf')
+        result['file_to_write'] = str(file_to_write)
+        _forget_changed(files_list)
+        metrics = Metrics()
+        try:
+            compose_stickers(files_list, file_to_write, metrics=metrics, cache=_cache, readers=_readers, **job)
+        finally:
+            _remember_used(files_list)
+        sharded = job.get('shard_sheets') is not None or job.get('shard_bytes') is not None
+        result.update({
+            'status': 'ok',
+            # Shards kept from the previous run of the job are not written again
+            'output_bytes': metrics.counters['bytes_written'] if sharded else os.path.getsize(file_to_write),
+            'pages': metrics.counters['pages'],
+            'sheets': metrics.counters['sheets'],
+        })
+    except Exception as e:
+        result['error'] = str(e) if isinstance(e, UnprocessableArgumentsError) else f'{type(e).__name__}: {e}'
+    result['wall_time'] = round(time.perf_counter() - start, 4)
+    return result
+
+
+def read_jobs(jobs_file: str | os.PathLike) -> Iterator[tuple[int, dict | str]]:
+    """
+    Reads jobs from JSONL file, one object of compose_stickers kwargs per line.
+    Blank lines are skipped, lines that can't be parsed are passed as they are
+    to fail as separate jobs.
+
+    :param jobs_file: path to the file
+    :return: Iterator of (number of the line, job)
+    """
+    with open(jobs_file) as fp:
+        for number, line in enumerate(fp, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield number, json.loads(line)
+            except ValueError:
+                yield number, line.strip()
+
+
+def run_batch(
+        jobs_file: str | os.PathLike,
+        file_to_write: str | os.PathLike = 'results.jsonl',
+        workers: int | None = None,
+) -> int:
+    """
+    Runs all jobs of the batch in a pool of processes and writes their results to JSONL file
+    as soon as they are done, so results are not lost if the batch is interrupted.
+    Processes live through the whole batch, so every job doesn't pay for starting
+    the interpreter and opening files used by previous jobs again.
+
+    :param jobs_file: JSONL file with kwargs of compose_stickers per line
+    :param file_to_write: JSONL file for results, see run_job
+    :param workers: number of processes. Number of CPUs by default, 1 means running jobs in the current process
+    :return: number of failed jobs
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers < 1:
+        raise UnprocessableArgumentsError([(str(workers), 'Number of workers should be a positive integer'), ])
+    try:
+        jobs = dict(read_jobs(jobs_file))
+    except OSError as e:
+        raise UnprocessableArgumentsError([(str(jobs_file), f'Jobs file cannot be read: {e.strerror}'), ])
+
+    failed = 0
+    with open(file_to_write, 'w') as results:
+        def report(result: dict) -> None:
+            nonlocal failed
+            failed += result['status'] != 'ok'
+            results.write(json.dumps(result) + '\n')
+            results.flush()
+
+        if workers == 1:
+            for number, job in jobs.items():
+                report(run_job(number, job))
+            return failed
+
+        pending = dict(jobs)
+        suspects = set()
+        while pending:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                tasks = {executor.submit(run_job, number, job): number for number, job in pending.items()}
+                for task in as_completed(tasks):
+                    try:
+                        result = task.result()
+                    except BrokenProcessPool:
+                        continue
+                    del pending[tasks[task]]
+                    report(result)
+
+            # Process killed by a job (e.g. out of memory) breaks the pool and all unfinished jobs with it.
+            # They are run again in a new pool, and those that are unfinished after the second time
+            # are run one by one to find the job that kills it
+            for number in sorted(pending.keys() & suspects):
+                with ProcessPoolExecutor(max_workers=1) as executor:
+                    try:
+                        result = executor.submit(run_job, number, pending[number]).result()
+                    except BrokenProcessPool:
+                        result = {'job': number, 'file_to_write': None, 'status': 'error',
+                                  'error': 'Worker process terminated abruptly', 'wall_time': None}
+                del pending[number]
+                report(result)
+            suspects.update(pending)
+    return failed
+
+
+def parse_arguments(arguments: list[str]) -> dict:
+    """
+    Parse command line arguments of batch command.
+
+    -f - optional. Name of the results file. Default is results.jsonl
+    --workers - optional. Number of processes to run jobs in. Number of CPUs by default
+
+    :param arguments: arguments after the command name
+    :return: Dict of kwargs to run_batch
+    """
+    implemented_options = {
+        '-f': file_name,
+        '--workers': set_workers,
+    }
+    options, rest = parse_options(arguments, implemented_options)
+    if len(rest) != 1:
+        raise UnprocessableArgumentsError([(' '.join(rest), 'Exactly one jobs file is expected'), ])
+
+    result = {
+        'jobs_file': rest[0],
+        'file_to_write': 'results.jsonl',
+    }
+    for option, value in options:
+        implemented_options[option](value=value, result_dict=result)
+    return result
+
+
+def main(arguments: list[str]) -> None:
+    try:
+        failed = run_batch(**parse_arguments(arguments))
+    except UnprocessableArgumentsError as uae:
+        print(uae, file=sys.stderr)
+        sys.exit(1)
+    if failed:
+        print(f'{failed} jobs failed', file=sys.stderr)
+        sys.exit(2)
@@ -0,0 +1,198 @@
+import json
+import os
+import pathlib
+from itertools import islice, repeat
+from typing import Iterable, Iterator, Sequence
+
+from pypdf import PdfWriter
+
+from app.LayoutPlan import LayoutPlan
+from app.Metrics import Metrics
+from app.ReaderPool import ReaderPool
+from app.SourceReader import SourceReader
+from app.main import iter_selected_pages, selected_pages, sticker_stacker
+
+MANIFEST_VERSION = 1
+# Parameters of sticker_stacker that change what sheets look like, with their defaults
+LAYOUT_DEFAULTS = {
+    'paper_format': 'A4',
+    'stickers_in_width': 2,
+    'stickers_in_height': 3,
+    'sticker_margin': 0,
+    'fill': False,
+    'keep_ratio': True,
+    'packing': False,
+    'max_scale': 100,
+    'xobjects': False,
+}
+
+
+def manifest_path(file_to_write: str | os.PathLike) -> pathlib.Path:
+    """
+    Sidecar manifest of the output, next to it.
+    """
+    return pathlib.Path(f'{file_to_write}.manifest.json')
+
+
+def full_layout(layout: dict) -> dict:
+    """
+    All layout parameters, so the same layout is recorded the same way however it was given.
+    """
+    result = {**LAYOUT_DEFAULTS, **{k: v for k, v in layout.items() if k in LAYOUT_DEFAULTS}}
+    result['paper_format'] = result['paper_format'].upper()
+    return result
+
+
+def iter_sheet_stickers(pages: list[Sequence[int]], sheet_sizes: Iterable[int]) -> Iterator[list[tuple[int, int]]]:
+    """
+    Stickers of every sheet of the job.
+
+    :param pages: indexes of used pages of every input file
+    :param sheet_sizes: how many stickers every sheet holds
+    :return: Iterator of lists of (index of file in the files' list, index of page) for every sheet
+    """
+    stickers = (
+        (file_index, page_index)
+        for file_index, indexes in enumerate(pages)
+        for page_index in indexes
+    )
+    for size in sheet_sizes:
+        sheet = list(islice(stickers, size))
+        if not sheet:
+            return
+        yield sheet
+
+
+def read_manifest(file_to_write: str | os.PathLike, layout: dict) -> dict[tuple, int]:
+    """
+    Sheets of the previous output that can be reused. Nothing is reused if the manifest or the output
+    is missing, the output is changed since the manifest was written, or the layout is different.
+
+    :param file_to_write: output of the job
+    :param layout: full layout of the job, see full_layout
+    :return: index of the sheet in the previous output by its stickers as ((file hash, page index), ...)
+    """
+    try:
+        with open(manifest_path(file_to_write)) as fp:
+            manifest = json.load(fp)
+        stat = os.stat(file_to_write)
+        if (
+                manifest['version'] != MANIFEST_VERSION
+                or manifest['output'] != [stat.st_size, stat.st_mtime_ns]
+                or manifest['layout'] != layout
+        ):
+            return {}
+        return {
+            tuple(tuple(sticker) for sticker in sheet): index
+            for index, sheet in enumerate(manifest['sheets'])
+        }
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}
+
+
+def write_manifest(file_to_write: str | os.PathLike, layout: dict, sheets: list[list[tuple[str, int]]]) -> None:
+    """
+    Records what every sheet of the written output is made of.
+
+    :param file_to_write: written output of the job
+    :param layout: full layout of the job, see full_layout
+    :param sheets: stickers of every sheet as (file hash, page index)
+    """
+    stat = os.stat(file_to_write)
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'output': [stat.st_size, stat.st_mtime_ns],
+        'layout': layout,
+        'sheets': sheets,
+    }
+    path = manifest_path(file_to_write)
+    temporary = path.with_name(path.name + '.tmp')
+    with open(temporary, 'w') as fp:
+        json.dump(manifest, fp, separators=(',', ':'))
+    os.replace(temporary, path)
+
+
+def incremental_stacker(
+        files_list: list[str | os.PathLike],
+        hashes: list[str],
+        pages_counts: list[int],
+        previous: dict[tuple, int],
+        previous_output: str | os.PathLike,
+        writer: PdfWriter | None = None,
+        metrics: Metrics | None = None,
+        opened: dict[pathlib.Path, SourceReader] | None = None,
+        sheets: list[list[tuple[str, int]]] | None = None,
+        plan: LayoutPlan | None = None,
+        pool: ReaderPool | None = None,
+        **kwargs
+) -> PdfWriter:
+    """
+    Same as sticker_stacker, but sheets made of the same stickers with the same layout
+    are copied from the previous output instead of being composed again.
+    Input files are opened only if some of their pages are composed.
+
+    :param files_list: list of paths to pdf files, already validated
+    :param hashes: content hashes of the files
+    :param pages_counts: numbers of pages of the files
+    :param previous: sheets of the previous output, see read_manifest
+    :param previous_output: the previous output
+    :param writer: PdfWriter to put pages in. New one is created if not provided
+    :param metrics: Metrics to collect time of stages and counters in
+    :param opened: readers opened already by resolved paths of their files. Opened ones are added to it
+    and kept open. Without it, every file is opened only while its stickers are composed
+    :param sheets: list to put stickers of every sheet in, as (file hash, page index), to write the manifest
+    :param plan: LayoutPlan of all stickers. Required for packed stickers, as their sheets hold different
+    numbers of them
+    :param pool: ReaderPool to open upcoming files of changed sheets in the background
+    :param kwargs: layout parameters of sticker_stacker
+    :return: PdfWriter object ready to write in file
+    """
+    if metrics is None:
+        metrics = Metrics()
+    if writer is None:
+        writer = PdfWriter()
+    if sheets is None:
+        sheets = []
+    if kwargs.get('packing'):
+        sheet_sizes = (len(plan.sheet(number)) for number in range(plan.sheets_count))
+    else:
+        sheet_sizes = repeat(kwargs.get('stickers_in_width', 2) * kwargs.get('stickers_in_height', 3))
+
+    previous_reader = None
+    # Consecutive sheets to compose are composed at once
+    changed = []
+
+    def compose_changed() -> None:
+        stickers = iter_selected_pages(
+            [(files_list[file_index], page_index) for file_index, page_index in changed],
+            metrics=metrics,
+            mapped=True,
+            opened=opened,
+            pool=pool,
+        )
+        sticker_stacker(stickers, writer=writer, metrics=metrics, close_sources=opened is None, **kwargs)
+        changed.clear()
+
+    pages = [selected_pages(path, pages_count) for path, pages_count in zip(files_list, pages_counts)]
+    for sheet in iter_sheet_stickers(pages, sheet_sizes):
+        key = tuple((hashes[file_index], page_index) for file_index, page_index in sheet)
+        sheets.append(list(key))
+        if key not in previous:
+            changed += sheet
+            continue
+        if changed:
+            compose_changed()
+        if previous_reader is None:
+            # The previous output is replaced only when the new one is written,
+            # and the mapping stays valid after that
+            previous_reader = SourceReader(previous_output, mapped=True)
+        with metrics.stage('write'):
+            writer.add_page(previous_reader.page(previous[key]))
+        metrics.count('sheets')
+        metrics.count('reused_sheets')
+    if changed:
+        compose_changed()
+    if previous_reader is not None:
+        writer.reset_translation(previous_reader)
+
+    return writer
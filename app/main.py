@@ -1,16 +1,67 @@
+from __future__ import annotations
+
+import fnmatch
+import io
 import os
 import pathlib
+import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from functools import partial
-from typing import Iterable
-
-from pypdf import (
-    PdfReader,
-    PageObject,
-    PdfWriter,
-    Transformation,
-    PaperSize,
+from itertools import groupby, islice, repeat
+from operator import itemgetter
+from typing import TYPE_CHECKING, Iterable, Iterator, NamedTuple, Sequence
+
+from app.Metrics import Metrics
+
+# pypdf, numpy and the process pool take most of the start-up time, so they are imported
+# by functions that compose. Parsing arguments, validation errors and the UI don't wait for them
+if TYPE_CHECKING:
+    from pypdf import PdfReader, PageObject, PdfWriter
+    from pypdf.generic import DictionaryObject, IndirectObject
+
+    from app.LayoutPlan import LayoutPlan
+    from app.MetadataCache import MetadataCache
+    from app.ReaderPool import ReaderPool
+    from app.SharedResources import SharedResources
+    from app.SourceReader import SourceReader
+    from app.StickerRef import StickerRef, StickerRefs
+
+
+class Dimensions(NamedTuple):
+    width: int
+    height: int
+
+
+# Paper formats in points, the same pypdf.PaperSize has
+PAPER_SIZES = {
+    'A0': Dimensions(2384, 3370),
+    'A1': Dimensions(1684, 2384),
+    'A2': Dimensions(1191, 1684),
+    'A3': Dimensions(842, 1191),
+    'A4': Dimensions(595, 842),
+    'A5': Dimensions(420, 595),
+    'A6': Dimensions(298, 420),
+    'A7': Dimensions(210, 298),
+    'A8': Dimensions(147, 210),
+    'C4': Dimensions(649, 918),
+}
+
+# Files picked from directories by default
+PDF_PATTERNS = ('*.pdf',)
+# Input path and output file name standing for the standard input and output
+STDIN = STDOUT = '-'
+# How far from the start and the end of a file its header and end-of-file marker are looked for
+PREFLIGHT_WINDOW = 1024
+
+# Keyword arguments of sticker_stacker that define the layout, the ones validate_layout checks go first
+VALIDATED_PARAMETERS = (
+    'paper_format', 'stickers_in_width', 'stickers_in_height', 'sticker_margin', 'packing', 'max_scale',
 )
+LAYOUT_PARAMETERS = (*VALIDATED_PARAMETERS, 'fill', 'keep_ratio')
+# Stickers planned at once when packed stickers are pulled one page at a time
+PACKING_CHUNK = 256
 
 
 class UnprocessableArgumentsError(Exception):
@@ -51,158 +102,1189 @@ def validate_margins(margin: int, *args) -> list[tuple[str, str]]:
     return errors
 
 
+def validate_layout(
+        paper_format: str = 'A4',
+        stickers_in_width: int = 2,
+        stickers_in_height: int = 3,
+        sticker_margin: int = 0,
+        packing: bool = False,
+        max_scale: int = 100,
+) -> Dimensions:
+    """
+    Checks layout parameters all together. Grid is not checked when stickers are packed.
+
+    :return: dimensions of the specified paper format
+    :raise UnprocessableArgumentsError: with all invalid parameters
+    """
+    # TODO: redo error handling
+    errors = []
+    if not packing:
+        errors += validate_grid_value(stickers_in_width, stickers_in_height)
+    elif max_scale < 1 or max_scale > 1000:
+        errors.append((str(max_scale), 'Scale should be an integer from 1 to 1000 percent.'))
+    elif sticker_margin < 0:
+        errors.append((str(sticker_margin), 'Margins can\'t be negative when stickers are packed'))
+
+    try:
+        page_size = PAPER_SIZES[paper_format.upper()]
+    except KeyError:
+        errors.append((paper_format, f'It is not a valid paper format. Please chose from: {", ".join(PAPER_SIZES)}'))
+
+    # Dimensions of stickers with margins:
+    if not errors and packing:
+        errors += validate_margins(sticker_margin, page_size.width, page_size.height)
+    elif not errors:  # Patch
+        sticker_space_width = page_size.width / stickers_in_width
+        sticker_space_height = page_size.height / stickers_in_height
+        errors += validate_margins(sticker_margin, sticker_space_width, sticker_space_height)
+
+    if errors:
+        raise UnprocessableArgumentsError(errors)
+
+    return page_size
+
+
+def page_boxes(stickers: Iterable[PageObject | StickerRef]) -> dict[str, list[float]]:
+    """
+    Collects what LayoutPlan needs to know about stickers.
+
+    :param stickers: iterable of PageObject representing each sticker, or of StickerRef
+    :return: widths, heights, left and bottom sides of media boxes and rotations of stickers
+    as keyword arguments of plan_layout
+    """
+    boxes = {'widths': [], 'heights': [], 'lefts': [], 'bottoms': [], 'rotations': []}
+    for s in stickers:
+        if isinstance(s, tuple):
+            sizes = s.width, s.height, s.left, s.bottom, s.rotation
+        else:
+            box = s.mediabox
+            sizes = box.width, box.height, box.left, box.bottom, s.rotation
+        for values, value in zip(boxes.values(), sizes):
+            values.append(float(value))
+    return boxes
+
+
+def plan_layout(
+        widths: Iterable[float],
+        heights: Iterable[float],
+        paper_format: str = 'A4',
+        stickers_in_width: int = 2,
+        stickers_in_height: int = 3,
+        sticker_margin: int = 0,
+        fill: bool = False,
+        keep_ratio: bool = True,
+        packing: bool = False,
+        max_scale: int = 100,
+        lefts: Iterable[float] | None = None,
+        bottoms: Iterable[float] | None = None,
+        rotations: Iterable[float] | None = None,
+        start: int = 0,
+) -> LayoutPlan:
+    """
+    Checks layout parameters and sizes of stickers and calculates placement of every sticker.
+    No pdf content is needed for that, so it can be used to check and estimate a job up front.
+
+    :param widths: widths of media boxes of stickers
+    :param heights: heights of media boxes of stickers
+    :param paper_format: paper format to use (e.g. A4, A3 etc.)
+    :param stickers_in_width: how many stickers do you want to place in a single row on a page(stickers in width)
+    :param stickers_in_height: how many rows of stickers should be on a page(stickers in height)
+    :param sticker_margin: margins around each sticker in mm
+    :param fill: set True to resize sticker to fill all available space
+    :param keep_ratio: to rotate or not the sticker if its original ratio is violated
+    :param packing: set True to place stickers at their own size, as many on a page as fit, instead of the grid
+    :param max_scale: scale of packed stickers in percent. Stickers bigger than a page are shrunk to fit anyway
+    :param lefts: left sides of media boxes
+    :param bottoms: bottom sides of media boxes
+    :param rotations: /Rotate values of stickers
+    :param start: index of the first sticker in the whole job
+    :return: LayoutPlan, PackedPlan if stickers are packed
+    :raise UnprocessableArgumentsError: if layout parameters are invalid or stickers have no area
+    """
+    page_size = validate_layout(paper_format, stickers_in_width, stickers_in_height, sticker_margin, packing, max_scale)
+
+    import numpy as np
+    from app.LayoutPlan import LayoutPlan
+
+    widths, heights = np.asarray(widths, dtype=float), np.asarray(heights, dtype=float)
+    empty = (widths <= 0) | (heights <= 0)
+    if empty.any():
+        raise UnprocessableArgumentsError([
+            (f'Sticker {start + i + 1}', 'Page has no area') for i in empty.nonzero()[0]
+        ])
+
+    if packing:
+        from app.PackedPlan import PackedPlan
+
+        return PackedPlan(
+            widths,
+            heights,
+            page_size.width,
+            page_size.height,
+            round(sticker_margin * 2.8347),
+            max_scale / 100,
+            keep_ratio,
+            lefts,
+            bottoms,
+            rotations,
+            start,
+        )
+    return LayoutPlan(
+        widths,
+        heights,
+        page_size.width,
+        page_size.height,
+        stickers_in_width,
+        stickers_in_height,
+        round(sticker_margin * 2.8347),
+        fill,
+        keep_ratio,
+        lefts,
+        bottoms,
+        rotations,
+        start,
+    )
+
+
+def _source_key(page: PageObject) -> tuple[pathlib.Path | int, int]:
+    """
+    Identifies a page of a source file, even if the file is opened by several readers.
+    """
+    path = getattr(page.pdf, 'path', None)
+    return path if path is not None else id(page.pdf), page.indirect_reference.idnum
+
+
+def page_to_form(page: PageObject, writer: PdfWriter, shared: SharedResources | None = None) -> IndirectObject:
+    """
+    Wraps the page content in a Form XObject in the writer, so it can be placed
+    any number of times without copying its content and resources again.
+    Annotations of the page are not carried over.
+
+    :param page: PageObject to wrap
+    :param writer: PdfWriter to put the form in
+    :param shared: SharedResources of the writer to take resources of the form from
+    :return: reference to the form in the writer
+    """
+    from pypdf.generic import ArrayObject, DecodedStreamObject, DictionaryObject, NameObject, RectangleObject
+
+    if shared is not None:
+        page = shared.page(page)
+
+    data = b''
+    if '/Contents' in page:
+        contents = page['/Contents']
+        if isinstance(contents, ArrayObject):
+            data = b'\n'.join(c.get_object().get_data() for c in contents)
+        else:
+            data = contents.get_data()
+
+    form = DecodedStreamObject()
+    form.set_data(data)
+    form.update({
+        NameObject('/Type'): NameObject('/XObject'),
+        NameObject('/Subtype'): NameObject('/Form'),
+        # Content out of crop box is cut off, the same as while merging pages
+        NameObject('/BBox'): RectangleObject(page.cropbox),
+        NameObject('/Resources'): (
+            page.raw_get('/Resources').clone(writer) if '/Resources' in page else DictionaryObject()
+        ),
+    })
+    if '/Group' in page:
+        form[NameObject('/Group')] = page.raw_get('/Group').clone(writer)
+    return writer._add_object(form.flate_encode())
+
+
+def _place_forms(page: PageObject, forms: DictionaryObject, operations: list[str]) -> None:
+    """
+    Sets content of a page that consists of forms only.
+
+    :param page: PageObject in a writer
+    :param forms: XObject resources of the page
+    :param operations: content stream lines that paint the forms
+    """
+    from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+    page[NameObject('/Resources')] = DictionaryObject({NameObject('/XObject'): forms})
+    content = DecodedStreamObject()
+    content.set_data('\n'.join(operations).encode())
+    page.replace_contents(content)
+
+
+def _number(value: float) -> str:
+    return f'{value:.5f}'.rstrip('0').rstrip('.')
+
+
 def sticker_stacker(
-        stickers: list[PageObject],
+        stickers: Iterable[PageObject | StickerRef],
         paper_format: str = 'A4',
         stickers_in_width: int = 2,
         stickers_in_height: int = 3,
         sticker_margin: int = 0,
         fill: bool = False,
         keep_ratio: bool = True,
+        packing: bool = False,
+        max_scale: int = 100,
+        xobjects: bool = False,
+        writer: PdfWriter | None = None,
+        plan: LayoutPlan | None = None,
+        metrics: Metrics | None = None,
+        sources: Iterable[SourceReader] | None = None,
+        close_sources: bool = False,
 ) -> PdfWriter:
     """
     Creates a PdfWriter object with all stickers placed on pages of specified format, according to
     specified layout.
 
-    :param stickers: list of PageObject representing each sticker
+    :param stickers: iterable of PageObject representing each sticker, or of StickerRef if sources are given.
+    Consumed only once, so it can be a generator
     :param paper_format: paper format to use (e.g. A4, A3 etc.)
     :param stickers_in_width: how many stickers do you want to place in a single row on a page(stickers in width)
     :param stickers_in_height: how many rows of stickers should be on a page(stickers in height)
     :param sticker_margin: margins around each sticker in mm
     :param fill: set True to resize sticker to fill all available space
     :param keep_ratio: to rotate or not the sticker if its original ratio is violated
+    :param packing: set True to place stickers at their own size, as many on a page as fit, instead of the grid
+    :param max_scale: scale of packed stickers in percent. Stickers bigger than a page are shrunk to fit anyway
+    :param xobjects: set True to put every distinct page in the writer only once as a Form XObject
+    and paint it wherever it's used. Stickers are not changed in this case.
+    Either way, identical resources of stickers (fonts, images etc.) are put in the writer once,
+    and all stickers refer to them
+    :param writer: PdfWriter to put pages in. New one is created if not provided
+    :param plan: LayoutPlan of all stickers made with the same layout parameters.
+    If not provided, stickers are planned page by page
+    :param metrics: Metrics to collect time of stages and counters in
+    :param sources: readers of files StickerRef stickers refer to, in the order of their indexes. Consumed
+    as stickers come, so it can be a generator opening files when they are needed. Pages are taken
+    just before they are placed, and what's parsed for them is released once the next file is started
+    :param close_sources: set True to close every reader once its stickers are placed. Stickers of a reader
+    must go one after another then, and the reader mustn't be used by anything else
     :return: PdfWriter object ready to write in file
     """
+    from pypdf import PdfWriter
+    from pypdf.generic import DictionaryObject, NameObject
+
+    from app.SharedResources import SharedResources
+
+    if metrics is None:
+        metrics = Metrics()
+    layout = {
+        'paper_format': paper_format,
+        'stickers_in_width': stickers_in_width,
+        'stickers_in_height': stickers_in_height,
+        'sticker_margin': sticker_margin,
+        'fill': fill,
+        'keep_ratio': keep_ratio,
+        'packing': packing,
+        'max_scale': max_scale,
+    }
+    page_size = validate_layout(paper_format, stickers_in_width, stickers_in_height, sticker_margin, packing, max_scale)
+
+    if writer is None:
+        writer = PdfWriter()
+    shared = SharedResources.of(writer)
+
+    source = None
+    if sources is not None:
+        # Reader of the file stickers come from, by its index
+        sources = enumerate(sources)
+        source_index, source_reader = -1, None
+    # Forms of distinct pages when xobjects are used
+    forms: dict[tuple[pathlib.Path | int, int], tuple[IndirectObject, PdfReader | None]] = {}
+
+    def done(reader: PdfReader) -> None:
+        # Forget what was cloned from the file, otherwise the writer keeps it alive till the end
+        writer.reset_translation(reader)
+        if close_sources:
+            reader.close()
+        elif sources is not None:
+            reader.release()
+
+    i = 0
+    for sheet, sheet_plan in iter_planned_sheets(stickers, layout, plan, metrics):
+        # Add blank page. Streaming writer writes the previous page at this moment
+        with metrics.stage('write'):
+            destpage = writer.add_blank_page(
+                width=page_size.width,
+                height=page_size.height,
+            )
+        metrics.count('sheets')
+        page_forms = DictionaryObject()
+        page_operations = []
+
+        for s in sheet:
+            if sources is not None:
+                with metrics.stage('collection'):
+                    while source_index < s.source:
+                        # File with no stickers is done right away
+                        if source_reader is not None and source_reader is not source:
+                            done(source_reader)
+                        source_index, source_reader = next(sources)
+                    s = source_reader.page(s.page)
+            if s.pdf is not source:
+                # Previous file is done
+                if source is not None:
+                    done(source)
+                source = s.pdf
+            j = i - sheet_plan.start
+            i += 1
+            metrics.count('pages')
+
+            with metrics.stage('merge'):
+                if xobjects:
+                    key = _source_key(s)
+                    if key not in forms:
+                        # Keep the reader if it's the only thing that identifies the page
+                        forms[key] = page_to_form(s, writer, shared), s.pdf if isinstance(key[0], int) else None
+                    form = forms[key][0]
+                    name = NameObject(f'/Sticker{form.idnum}')
+                    page_forms[name] = form
+                    ctm = sheet_plan.ctm(j)
+                    page_operations.append(f'q {" ".join(_number(v) for v in ctm)} cm {name} Do Q')
+                    continue
+
+                # Rotation, scale and position are applied together while merging,
+                # so the sticker itself stays untouched and can be placed again.
+                # Resources the sheet has already are referred to by their names instead of copies under new ones
+                destpage.merge_transformed_page(shared.page(s), sheet_plan.ctm(j))
+
+        if page_operations:
+            with metrics.stage('merge'):
+                _place_forms(destpage, page_forms, page_operations)
+
+    if source is not None:
+        done(source)
+    return writer
 
-    # TODO: redo error handling
-    errors = []
-    errors += validate_grid_value(stickers_in_width, stickers_in_height)
 
-    try:
-        # Try to get dimensions of specified format, if this format is present in
-        # PaperSize class of pypdf
-        page_size = getattr(PaperSize, paper_format.upper())
-    except AttributeError:
-        valid_formats = [f for f in dir(PaperSize) if not f.startswith('__')]
-        errors.append((paper_format, f'It is not a valid paper format. Please chose from: {", ".join(valid_formats)}'))
-
-    stickers_on_page = stickers_in_width * stickers_in_height
-    margin_in_pixels = round(sticker_margin * 2.8347)
-    # Dimensions of stickers with margins:
-    if not errors:  # Patch
-        sticker_space_width = page_size.width / stickers_in_width
-        sticker_space_height = page_size.height / stickers_in_height
-        errors += validate_margins(sticker_margin, sticker_space_width, sticker_space_height)
+def iter_sheets(stickers: Iterable[PageObject], stickers_on_page: int) -> Iterator[list[PageObject]]:
+    """
+    Pulls stickers by one page at a time.
 
-    if errors:
-        raise UnprocessableArgumentsError(errors)
+    :param stickers: iterable of PageObject representing each sticker
+    :param stickers_on_page: how many stickers fit in a single page
+    :return: Iterator of lists of stickers for every page
+    """
+    stickers = iter(stickers)
+    sheet = list(islice(stickers, stickers_on_page))
+    while sheet:
+        yield sheet
+        sheet = list(islice(stickers, stickers_on_page))
+
+
+def iter_planned_sheets(
+        stickers: Iterable[PageObject],
+        layout: dict,
+        plan: LayoutPlan | None = None,
+        metrics: Metrics | None = None,
+) -> Iterator[tuple[list[PageObject], LayoutPlan]]:
+    """
+    Pulls stickers by one page at a time along with the plan they are placed by.
+    Only one page of stickers is planned at once if there is no plan for all of them.
+    Pages of packed stickers hold as many of them as fit, so stickers are planned by chunks,
+    and the last page of a chunk is planned again with the next one.
+
+    :param stickers: iterable of PageObject representing each sticker
+    :param layout: layout parameters of plan_layout
+    :param plan: LayoutPlan of all stickers made with the same layout parameters
+    :param metrics: Metrics to collect time of planning in
+    :return: Iterator of lists of stickers for every page and plans they are in
+    """
+    if metrics is None:
+        metrics = Metrics()
+    if not layout.get('packing'):
+        stickers_on_page = layout.get('stickers_in_width', 2) * layout.get('stickers_in_height', 3)
+        i = 0
+        for sheet in iter_sheets(stickers, stickers_on_page):
+            if plan is not None:
+                yield sheet, plan
+                continue
+            with metrics.stage('layout'):
+                sheet_plan = plan_layout(**page_boxes(sheet), **layout, start=i)
+            i += len(sheet)
+            yield sheet, sheet_plan
+        return
+
+    stickers = iter(stickers)
+    if plan is not None:
+        for number in range(plan.sheets_count):
+            yield list(islice(stickers, len(plan.sheet(number)))), plan
+        return
+    pending = []
+    i = 0
+    while True:
+        chunk = list(islice(stickers, PACKING_CHUNK))
+        pending += chunk
+        if not pending:
+            return
+        with metrics.stage('layout'):
+            chunk_plan = plan_layout(**page_boxes(pending), **layout, start=i)
+        # The last page can take stickers of the next chunk
+        finished = chunk_plan.sheets_count - 1 if chunk else chunk_plan.sheets_count
+        for number in range(finished):
+            sheet = chunk_plan.sheet(number)
+            yield pending[sheet.start:sheet.stop], chunk_plan
+        done = chunk_plan.sheet(finished - 1).stop if finished else 0
+        pending = pending[done:]
+        i += done
+
+
+def sheet_ranges(stickers_count: int, stickers_on_page: int, chunks: int) -> list[range]:
+    """
+    Splits indexes of stickers into consecutive ranges of whole pages.
 
-    writer = PdfWriter()
+    :param stickers_count: total amount of stickers
+    :param stickers_on_page: how many stickers fit in a single page
+    :param chunks: how many ranges to make at most
+    :return: list of ranges of sticker indexes
+    """
+    pages_count = -(-stickers_count // stickers_on_page)
+    step = -(-pages_count // chunks) * stickers_on_page
+    return [range(start, min(start + step, stickers_count)) for start in range(0, stickers_count, step)]
 
-    # Dimensions of stickers without margins:
-    sticker_width = sticker_space_width - margin_in_pixels * 2
-    sticker_height = sticker_space_height - margin_in_pixels * 2
 
-    destpage: PageObject | None = None
-    for i, s in enumerate(stickers):
-        if i % stickers_on_page == 0:
-            # Add blank page
-            destpage = writer.add_blank_page(
-                width=page_size.width,
-                height=page_size.height,
-            )
-            # Move cursor from default position according to specified margins
-            # destpage.add_transformation(Transformation().translate(margin_in_pixels, margin_in_pixels))
+def plan_ranges(plan: LayoutPlan, chunks: int) -> list[range]:
+    """
+    Same as sheet_ranges, but pages are taken from the plan of all stickers, so they can hold different
+    numbers of stickers, as packed pages do.
 
-        if keep_ratio:
-            # Rotate sticker if needed to roughly keep its ratio
-            if ((s.mediabox.width/s.mediabox.height) > 1) != ((sticker_space_width / sticker_space_height) > 1):
-                s.rotate(90).transfer_rotation_to_content()
+    :param plan: LayoutPlan of all stickers
+    :param chunks: how many ranges to make at most
+    :return: list of ranges of sticker indexes
+    """
+    step = -(-plan.sheets_count // chunks)
+    return [
+        range(plan.sheet(first).start, plan.sheet(min(first + step, plan.sheets_count) - 1).stop)
+        for first in range(0, plan.sheets_count, step)
+    ]
+
+
+def selected_pages(path: str | os.PathLike, pages_count: int) -> Sequence[int]:
+    """
+    Indexes of pages of a file that are used as stickers.
+
+    :param path: path to the file, PageSelection if only some pages are used
+    :param pages_count: number of pages in the file
+    :return: indexes of pages in the order they are used
+    :raise UnprocessableArgumentsError: if selected pages are beyond the end of the file
+    """
+    from app.PageSelection import PageSelection
+
+    if not isinstance(path, PageSelection):
+        return range(pages_count)
+    try:
+        return path.indexes(pages_count)
+    except IndexError as e:
+        raise UnprocessableArgumentsError([(str(path), str(e)), ])
+
+
+def _compose_range(selection: list[tuple[int, str | os.PathLike, int]], layout: dict) -> bytes:
+    """
+    Process pool task. Composes pages for a part of stickers.
+
+    :param selection: list of (index of file in the files' list, path to file, index of page)
+    :param layout: kwargs of sticker_stacker
+    :return: composed pages as pdf file content
+    """
+    # Processes reading the same file share its pages in the OS cache. Every file is open
+    # only while its pages are placed
+    stickers = iter_selected_pages([(path, page_index) for _, path, page_index in selection], mapped=True)
+
+    output = io.BytesIO()
+    sticker_stacker(stickers, close_sources=True, **layout).write(output)
+    return output.getvalue()
+
+
+def parallel_sticker_stacker(
+        files_list: list[str | os.PathLike],
+        workers: int,
+        writer: PdfWriter | None = None,
+        metrics: Metrics | None = None,
+        pages_counts: list[int] | None = None,
+        plan: LayoutPlan | None = None,
+        **kwargs
+) -> PdfWriter:
+    """
+    Same as sticker_stacker, but pages are composed in a pool of processes.
+    Stickers are split in ranges of whole pages, every range is composed separately
+    and the results are put in the writer in the original order.
+
+    :param files_list: list of paths to pdf files, already validated
+    :param workers: number of processes to use
+    :param writer: PdfWriter to put pages in. New one is created if not provided
+    :param metrics: Metrics to collect time of stages and counters in. Processes measure nothing,
+    all the time spent in them is counted as merge
+    :param pages_counts: numbers of pages in files if they are known. Files are opened to count them otherwise,
+    one at a time
+    :param plan: LayoutPlan of all stickers. Packed stickers are split by its pages, files are opened
+    to plan them if it's not provided
+    :param kwargs: layout parameters of sticker_stacker
+    :return: PdfWriter object ready to write in file
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from pypdf import PdfReader, PdfWriter
+
+    if metrics is None:
+        metrics = Metrics()
+    validate_layout(**{k: v for k, v in kwargs.items() if k in VALIDATED_PARAMETERS})
+    stickers_on_page = kwargs.get('stickers_in_width', 2) * kwargs.get('stickers_in_height', 3)
+    packing = kwargs.get('packing', False)
+
+    if writer is None:
+        writer = PdfWriter()
+
+    # Global order of stickers: every page of every file
+    if pages_counts is None or packing and plan is None:
+        pages_counts = []
+        boxes = {'widths': [], 'heights': [], 'lefts': [], 'bottoms': [], 'rotations': []}
+        # Files are mapped and closed right after counting, workers parse them again anyway
+        for path, reader in zip(files_list, iter_readers(files_list, metrics=metrics, mapped=True)):
+            pages_counts.append(reader.pages_count)
+            if packing:
+                for key, values in page_boxes(_collect_pages(reader, metrics, path)).items():
+                    boxes[key] += values
+            reader.close()
+        if packing:
+            with metrics.stage('layout'):
+                plan = plan_layout(**boxes, **{k: v for k, v in kwargs.items() if k in LAYOUT_PARAMETERS})
+    selection = [
+        (file_index, path, page_index)
+        for file_index, (path, pages_count) in enumerate(zip(files_list, pages_counts))
+        for page_index in selected_pages(path, pages_count)
+    ]
+    # Few ranges per process to keep them all busy till the end
+    if packing:
+        ranges = plan_ranges(plan, workers * 4)
+    else:
+        ranges = sheet_ranges(len(selection), stickers_on_page, workers * 4)
+
+    with metrics.stage('merge'), ProcessPoolExecutor(max_workers=workers) as executor:
+        tasks = [selection[r.start:r.stop] for r in ranges]
+        for composed in executor.map(_compose_range, tasks, [kwargs] * len(tasks)):
+            part = PdfReader(io.BytesIO(composed))
+            for page in part.pages:
+                writer.add_page(page)
+            metrics.count('sheets', len(part.pages))
+            writer.reset_translation(part)
+    metrics.count('pages', len(selection))
 
-        # Resize sticker
-        if fill:
-            s.scale_to(width=sticker_width, height=sticker_height)
-        else:
-            s.scale_by(min(sticker_width/s.mediabox.width, sticker_height/s.mediabox.height))
-
-        # Current sticker on x and y
-        x = i % stickers_in_width
-        y = (i % stickers_on_page) // stickers_in_width
-
-        # Move cursor to current sticker position and put it there
-        destpage.merge_transformed_page(
-            s,
-            Transformation().translate(
-                x * sticker_space_width + margin_in_pixels,
-                page_size.height - (y + 1) * sticker_space_height + margin_in_pixels,  # origin is left bottom corner
-            ),
-        )
     return writer
 
 
-def sticker_list(files_list: list[PdfReader]) -> list[PageObject]:
+def _collect_pages(reader: PdfReader, metrics: Metrics, path: str | os.PathLike | None = None) -> list[PageObject]:
+    from app.PageSelection import PageSelection
+    from app.SourceReader import SourceReader
+
+    with metrics.stage('collection', str(reader.path) if isinstance(reader, SourceReader) else None):
+        if not isinstance(path, PageSelection):
+            return list(reader.pages)
+        # Only selected pages are looked up, the rest of the page tree isn't loaded
+        if isinstance(reader, SourceReader):
+            return [reader.page(i) for i in selected_pages(path, reader.pages_count)]
+        return [reader.pages[i] for i in selected_pages(path, len(reader.pages))]
+
+
+def iter_stickers(
+        files_list: Iterable[PdfReader],
+        metrics: Metrics | None = None,
+        paths: Iterable[str | os.PathLike] | None = None,
+) -> Iterator[PageObject]:
+    """
+    Lazy version of sticker_list. Yields pages one by one, so readers are opened
+    and parsed only when their pages are needed.
+
+    :param files_list: Iterable of PdfReader objects representing each file
+    :param metrics: Metrics to collect time of collecting pages in
+    :param paths: paths the readers are opened from. Only selected pages are taken from PageSelection ones
+    :return: Iterator of PageObject objects
+    """
+    if metrics is None:
+        metrics = Metrics()
+    for f, path in zip(files_list, paths if paths is not None else repeat(None)):
+        yield from _collect_pages(f, metrics, path)
+
+
+def sticker_list(
+        files_list: list[PdfReader],
+        metrics: Metrics | None = None,
+        paths: Iterable[str | os.PathLike] | None = None,
+) -> list[PageObject]:
     """
     Make list of individual PageObject objects representing each sticker
 
     :param files_list: List of PdfReader objects representing each file
+    :param metrics: Metrics to collect time of collecting pages in
+    :param paths: paths the readers are opened from. Only selected pages are taken from PageSelection ones
     :return: List of PageObject objects
     """
+    if metrics is None:
+        metrics = Metrics()
     stickers = []
-    for f in files_list:
-        stickers += f.pages
+    for f, path in zip(files_list, paths if paths is not None else repeat(None)):
+        stickers += _collect_pages(f, metrics, path)
     return stickers
 
 
-def process_paths(files_list: list[str | os.PathLike]) -> list[PdfReader]:
+def sticker_refs(
+        files_list: list[str | os.PathLike],
+        readers: Iterable[SourceReader] | None = None,
+        metrics: Metrics | None = None,
+        metadata: Iterable[dict] | None = None,
+        close: bool = False,
+) -> StickerRefs:
     """
-    Checks whether all files are available and processable.
-    Files can be repeated and their content will also be repeated in the result
+    Same as sticker_list, but stickers are described by StickerRef kept in arrays, and pages
+    are not kept. Only selected pages of PageSelection paths are described.
+
+    :param files_list: paths to pdf files
+    :param readers: readers of the files, in the same order. Not used if metadata is given.
+    Every reader is released once its pages are described, so the pages don't stay parsed
+    :param metrics: Metrics to collect time of collecting pages in
+    :param metadata: metadata of the files from MetadataCache. Pages are not read at all if it's given
+    :param close: set True to close readers instead of releasing them, when they are not used anymore
+    :return: StickerRefs of all stickers, with sources as indexes of files in files_list
+    """
+    from app.StickerRef import StickerRefs
+
+    if metrics is None:
+        metrics = Metrics()
+    refs = StickerRefs()
+    if metadata is not None:
+        for source, (path, m) in enumerate(zip(files_list, metadata)):
+            refs.extend(source, selected_pages(path, m['pages']), metadata_boxes([m], [path]))
+        return refs
+    for source, (path, reader) in enumerate(zip(files_list, readers)):
+        with metrics.stage('collection', str(reader.path)):
+            pages = selected_pages(path, reader.pages_count)
+            refs.extend(source, pages, page_boxes(reader.page(i) for i in pages))
+            if close:
+                reader.close()
+            else:
+                reader.release()
+    return refs
+
+
+def iter_selected_pages(
+        selection: Iterable[tuple[str | os.PathLike, int]],
+        metrics: Metrics | None = None,
+        mapped: bool = False,
+        opened: dict[pathlib.Path, PdfReader] | None = None,
+        pool: ReaderPool | None = None,
+) -> Iterator[PageObject]:
+    """
+    Pages of the selection. Every run of consecutive pages of a file is taken from its own reader,
+    opened when the first of them is needed, so with sticker_stacker closing its sources only the files
+    being composed are open, however many files the selection has.
+
+    :param selection: (path to file, index of page) of every page
+    :param metrics: Metrics to collect time of opening files in
+    :param mapped: set True to memory-map files instead of reading them in memory
+    :param opened: readers opened already by resolved paths of their files. Readers are shared
+    and kept in it if it's given, so they mustn't be closed then
+    :param pool: ReaderPool to open upcoming files in the background
+    :return: Iterator of PageObject
+    """
+    runs = [(path, [page_index for _, page_index in run]) for path, run in groupby(selection, key=itemgetter(0))]
+    readers = iter_readers(
+        (path for path, _ in runs), share=opened is not None, metrics=metrics, mapped=mapped, opened=opened,
+        pool=pool,
+    )
+    for (_, indexes), reader in zip(runs, readers):
+        for page_index in indexes:
+            yield reader.page(page_index)
+
+
+def parse_files(files_list: Iterable[str | os.PathLike]) -> list[str | os.PathLike]:
+    """
+    Makes PageSelection of every path followed by a selection of pages (manifest.pdf[1-20,45,100-]).
+
+    :param files_list: paths to pdf files
+    :return: list of the same paths, PageSelection ones where pages are selected
+    :raise UnprocessableArgumentsError: with all selections that can't be parsed
+    """
+    from app.PageSelection import parse_file
+
+    parsed = []
+    errors = []
+    for f in files_list:
+        try:
+            parsed.append(parse_file(f))
+        except ValueError as e:
+            errors.append((str(f), str(e)))
+    if errors:
+        raise UnprocessableArgumentsError(errors)
+    return parsed
+
+
+def is_stdin(path: str | os.PathLike) -> bool:
+    return os.fspath(path) == STDIN
+
+
+def validate_paths(files_list: list[str | os.PathLike]) -> None:
+    """
+    Checks whether all files are available and processable without opening them.
 
     :param files_list: list of absolute paths to pdf files
-    :return: list of PdfReader objects
     :raise UnporcessableFilesError: if file is missing, has non-pdf extension
     or unreadable, with the list of the unprocessable files
     """
     if len(files_list) < 1:
         raise ValueError('The files\' list is empty')
 
-    unprocessable_paths = []
-    for f in files_list:
-        p = pathlib.Path(f)
-
-        file_error = None
-        if not p.exists():
-            file_error = (p, 'File doesn\'t exist')
-        elif p.suffix not in ('.pdf', '.PDF'):
-            file_error = (p, 'File has non-pdf extension')
-        elif not os.access(p, os.R_OK):
-            file_error = (p, 'File cannot be read')
-
-        if file_error:
-            unprocessable_paths.append(file_error)
+    # Checks wait for storage most of the time, so slow (e.g. network) one is asked about many files at once
+    with ThreadPoolExecutor(max_workers=min(32, len(files_list))) as executor:
+        checked = executor.map(preflight, files_list)
+        unprocessable_paths = [(pathlib.Path(f), error) for f, error in zip(files_list, checked) if error]
 
     if unprocessable_paths:
         raise UnprocessableArgumentsError(unprocessable_paths)
 
-    return [PdfReader(f) for f in files_list]
+
+def preflight(path: str | os.PathLike) -> str | None:
+    """
+    Checks a file without parsing it: it exists, can be read and looks like pdf,
+    with the header in its beginning and the end-of-file marker in its end.
+
+    :param path: path to pdf file
+    :return: what's wrong with the file or None
+    """
+    p = pathlib.Path(path)
+    if not p.exists():
+        return 'File doesn\'t exist'
+    if p.suffix not in ('.pdf', '.PDF'):
+        return 'File has non-pdf extension'
+    try:
+        with open(p, 'rb') as fp:
+            head = fp.read(PREFLIGHT_WINDOW)
+            fp.seek(max(fp.seek(0, os.SEEK_END) - PREFLIGHT_WINDOW, 0))
+            tail = fp.read()
+    except OSError:
+        return 'File cannot be read'
+    if b'%PDF-' not in head:
+        return 'File has no pdf header'
+    if b'%%EOF' not in tail:
+        return 'File is truncated, no end-of-file marker'
+    return None
+
+
+def natural_key(path: pathlib.PurePath) -> tuple:
+    """
+    Sort key that puts numbers in their numeric order: page2.pdf goes before page10.pdf.
+    """
+    parts = re.split(r'(\d+)', path.as_posix().lower())
+    # Strings and numbers alternate, so they are never compared to each other
+    return tuple(int(p) if i % 2 else p for i, p in enumerate(parts)), path.as_posix()
+
+
+def scan_directory(
+        directory: str | os.PathLike,
+        recursive: bool = False,
+        include: Iterable[str] = PDF_PATTERNS,
+        exclude: Iterable[str] = (),
+) -> list[pathlib.Path]:
+    """
+    Lists files of a directory, in natural order of their paths.
+
+    Patterns are matched against paths relative to the directory, case-insensitively,
+    and * matches through subdirectories as well (e.g. 2023-*/* or *draft*).
+    Subdirectories matching exclude patterns are not scanned at all.
+
+    :param directory: directory to scan
+    :param recursive: set True to scan subdirectories as well
+    :param include: glob patterns of files to pick
+    :param exclude: glob patterns of files and subdirectories to skip
+    :return: list of paths to files
+    :raise UnprocessableArgumentsError: if directory doesn't exist
+    """
+    root = pathlib.Path(directory)
+    if not root.is_dir():
+        raise UnprocessableArgumentsError([(str(directory), 'No such directory'), ])
+    include = [p.lower() for p in include]
+    exclude = [p.lower() for p in exclude]
+
+    def matches(relative: str, patterns: list[str]) -> bool:
+        return any(fnmatch.fnmatchcase(relative, p) for p in patterns)
+
+    found = []
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                relative = pathlib.PurePath(entry.path).relative_to(root).as_posix().lower()
+                if matches(relative, exclude):
+                    continue
+                # Links to directories are not followed to avoid loops
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        stack.append(pathlib.Path(entry.path))
+                elif entry.is_file() and matches(relative, include):
+                    found.append(pathlib.Path(entry.path))
+    return sorted(found, key=lambda f: natural_key(f.relative_to(root)))
+
+
+def files_metadata(files_list: list[str | os.PathLike], cache: MetadataCache) -> list[dict]:
+    """
+    Gets metadata of every file from the cache. Only files not seen before are parsed.
+
+    :param files_list: list of paths to pdf files, already validated with validate_paths
+    :param cache: MetadataCache to use
+    :return: list of metadata of files (see read_metadata)
+    :raise UnprocessableArgumentsError: with the list of files that can't be parsed
+    """
+    metadata = cache.get_many(files_list)
+    unparsable = [
+        (pathlib.Path(f), f'File cannot be parsed: {m["error"]}') for f, m in zip(files_list, metadata) if m['error']
+    ]
+    if unparsable:
+        raise UnprocessableArgumentsError(unparsable)
+    return metadata
+
+
+def metadata_boxes(
+        metadata: Iterable[dict],
+        files_list: Iterable[str | os.PathLike] | None = None,
+) -> dict[str, list[float]]:
+    """
+    Same as page_boxes, but made of metadata of files instead of pages.
+
+    :param metadata: metadata of files from MetadataCache
+    :param files_list: paths to the files. Only selected pages of PageSelection ones are taken
+    :return: widths, heights, left and bottom sides of media boxes and rotations of stickers
+    as keyword arguments of plan_layout
+    """
+    boxes = {'widths': [], 'heights': [], 'lefts': [], 'bottoms': [], 'rotations': []}
+    for m, path in zip(metadata, files_list if files_list is not None else repeat(None)):
+        indexes = selected_pages(path, m['pages'])
+        for key, values in boxes.items():
+            values += m[key] if isinstance(indexes, range) else [m[key][i] for i in indexes]
+    return boxes
+
+
+def iter_readers(
+        files_list: Iterable[str | os.PathLike],
+        share: bool = False,
+        metrics: Metrics | None = None,
+        mapped: bool = False,
+        opened: dict[pathlib.Path, PdfReader] | None = None,
+        pool: ReaderPool | None = None,
+        count: bool = True,
+) -> Iterator[PdfReader]:
+    """
+    Opens files one by one when the next one is requested.
+    Paths are expected to be validated already.
+
+    :param files_list: paths to pdf files
+    :param share: set True to open repeated files only once and yield the same reader
+    :param metrics: Metrics to collect time of opening files and their number in
+    :param mapped: set True to memory-map files instead of reading them in memory
+    :param opened: readers opened already by resolved paths of their files, to share them between
+    several calls. Readers opened while sharing are added to it
+    :param pool: ReaderPool to open upcoming files in the background while the current ones are used
+    :param count: set False not to count files, when they are opened again by the same job
+    :return: Iterator of PdfReader objects
+    """
+    from app.SourceReader import SourceReader
+
+    if pool is not None:
+        yield from pool.readers(files_list, share, metrics, mapped, opened, count)
+        return
+    if metrics is None:
+        metrics = Metrics()
+    if opened is None:
+        opened = {}
+    for f in files_list:
+        if count:
+            metrics.count('files')
+        key = pathlib.Path(f).resolve()
+        if share and key in opened:
+            yield opened[key]
+            continue
+        with metrics.stage('open', str(key)):
+            reader = SourceReader(f, mapped=mapped)
+        if share:
+            opened[key] = reader
+        yield reader
+
+
+def process_paths(
+        files_list: list[str | os.PathLike],
+        share: bool = False,
+        metrics: Metrics | None = None,
+        cache: MetadataCache | None = None,
+        pool: ReaderPool | None = None,
+) -> list[PdfReader]:
+    """
+    Checks whether all files are available and processable.
+    Files can be repeated and their content will also be repeated in the result
+
+    :param files_list: list of absolute paths to pdf files
+    :param share: set True to open repeated files only once
+    :param metrics: Metrics to collect time of checking and opening files in
+    :param cache: MetadataCache to check that all files can be parsed before opening any of them
+    :param pool: ReaderPool to open several files at once
+    :return: list of PdfReader objects
+    :raise UnporcessableFilesError: if file is missing, has non-pdf extension,
+    unreadable or can't be parsed, with the list of the unprocessable files
+    """
+    if metrics is None:
+        metrics = Metrics()
+    with metrics.stage('validation'):
+        validate_paths(files_list)
+        if cache is not None:
+            files_metadata(files_list, cache)
+    return list(iter_readers(files_list, share, metrics, pool=pool))
 
 
 def compose_stickers(
     files_list: list[str | os.PathLike],
     file_to_write: str | os.PathLike = 'stickers.pdf',
+    stream: bool = False,
+    workers: int = 1,
+    metrics: Metrics | None = None,
+    cache: MetadataCache | None = None,
+    readers: dict[pathlib.Path, PdfReader] | None = None,
+    optimize: bool = False,
+    incremental: bool = False,
+    shard_sheets: int | None = None,
+    shard_bytes: int | None = None,
+    prefetch: int = 0,
+    max_open: int | None = None,
+    stdin: str | os.PathLike | None = None,
     **kwargs
 ) -> None:
     """
     Make .pdf file with all pages from listed files as stickers placed on A4 page.
 
-    :param files_list: List of paths to pdf files. Can be strings or PathLike objects
+    :param files_list: List of paths to pdf files. Can be strings or PathLike objects. Only some pages
+    of a file are used if it's a PageSelection or a path followed by pages in brackets: manifest.pdf[1-20,45,100-]
     :param file_to_write: Name for the final file
+    :param stream: set True to open files only when their pages are needed and write
+    every finished page right away. Files are memory-mapped instead of being read in memory.
+    Memory usage then depends on a single page of stickers instead of the whole job
+    :param workers: number of processes to compose pages in. 1 means composing
+    in the current process
+    :param metrics: Metrics to collect time of every stage and counters of the job in
+    :param cache: MetadataCache to check all files and plan the whole job before opening any of them
+    :param readers: readers by resolved paths of their files to reuse and keep opened ones in,
+    so several jobs with the same files open them only once. Not used with several workers
+    :param optimize: set True to make the result as small as possible: unused objects are dropped,
+    streams are compressed, identical objects (fonts, images etc. copied with every sticker) are written once,
+    and the rest is packed in compressed object streams. In streaming mode pages are written before
+    the rest of the job is known, so streams are only compressed. Saved bytes are counted in metrics
+    :param incremental: set True to keep a manifest of sheets next to the result and recompose only sheets
+    whose stickers or layout changed since the previous run. The rest are copied from the previous result
+    :param shard_sheets: split the result in shards of at most this many sheets, named after file_to_write
+    (stickers.pdf -> stickers-0001.pdf). Shards are composed by workers at the same time, and a manifest
+    next to them (stickers.pdf.shards.json) lets the next run of the same job compose only unfinished ones
+    :param shard_bytes: same as shard_sheets, but shards take about this many bytes, estimated from sizes
+    of input files. Shard is closed by whichever limit comes first if both are given
+    :param prefetch: how many upcoming files to open and parse on background threads while the current ones
+    are composed. 0 opens every file only when it's needed. Worth it for slow (e.g. network) storage
+    :param max_open: most input files kept open at once by prefetching, see ReaderPool
+    :param stdin: file to read in place of the standard input, for jobs sent by a client to the server
+
+    - in place of a path stands for pdf documents of the standard input: a single one, several ones written
+    one after another, or a tar archive of them. - as file_to_write is the standard output.
+    Both make the job streamed, as neither can be read or written twice
     """
-    stickers = process_paths(files_list)
-    writer = sticker_stacker(sticker_list(stickers), **kwargs)
+    if workers < 1:
+        raise UnprocessableArgumentsError([(str(workers), 'Number of workers should be a positive integer'), ])
+    if incremental and workers > 1:
+        raise UnprocessableArgumentsError([(str(workers), 'Incremental job is composed in a single process'), ])
+    sharded = shard_sheets is not None or shard_bytes is not None
+    for limit in (shard_sheets, shard_bytes):
+        if limit is not None and limit < 1:
+            raise UnprocessableArgumentsError([(str(limit), 'Size of shards should be a positive integer'), ])
+    if incremental and sharded:
+        raise UnprocessableArgumentsError([(str(file_to_write), 'Sharded job can\'t be incremental'), ])
+    if prefetch < 0:
+        raise UnprocessableArgumentsError([(str(prefetch), 'Number of files to prefetch can\'t be negative'), ])
+    if max_open is not None and max_open < 1:
+        raise UnprocessableArgumentsError([(str(max_open), 'Limit of open files should be a positive integer'), ])
+    pool = None
+    if prefetch:
+        from app.ReaderPool import DEFAULT_MAX_OPEN, ReaderPool
+
+        pool = ReaderPool(prefetch, max_open or DEFAULT_MAX_OPEN)
+    if metrics is None:
+        metrics = Metrics()
+    layout = {k: v for k, v in kwargs.items() if k in LAYOUT_PARAMETERS}
+
+    with metrics.stage('validation'):
+        # Layout is checked before files, so wrong options fail without parsing anything
+        validate_layout(**{k: v for k, v in layout.items() if k in VALIDATED_PARAMETERS})
+        files_list = parse_files(files_list)
+        piped = sum(is_stdin(f) for f in files_list)
+        to_stdout = os.fspath(file_to_write) == STDOUT
+        if piped > 1:
+            raise UnprocessableArgumentsError([(STDIN, 'Standard input can be used only once'), ])
+        if (piped or to_stdout) and (incremental or sharded):
+            raise UnprocessableArgumentsError([
+                (STDIN, 'Job with standard input or output can\'t be incremental or sharded'),
+            ])
+        if piped and workers > 1:
+            raise UnprocessableArgumentsError([(STDIN, 'Standard input is read in a single process'), ])
+        stream = stream or bool(piped) or to_stdout
+        if len(files_list) > piped:
+            validate_paths([f for f in files_list if not is_stdin(f)])
+        metadata = files_metadata(files_list, cache) if cache is not None and not piped else None
+    plan = None
+    if metadata is not None:
+        with metrics.stage('layout'):
+            plan = plan_layout(**metadata_boxes(metadata, files_list), **layout)
+        metrics.count('planned_sheets', plan.sheets_count)
+
+    if incremental or sharded:
+        # Both jobs are recognized by content of files, and split by sheets of the whole job
+        with metrics.stage('validation'):
+            if metadata is not None:
+                hashes = [m['hash'] for m in metadata]
+                pages_counts = [m['pages'] for m in metadata]
+            else:
+                from app.MetadataCache import file_hash
+
+                hashes = [file_hash(f) for f in files_list]
+        if metadata is None:
+            # Files are counted, and opened again only if their stickers are composed,
+            # so nothing is kept open meanwhile
+            pages_counts = []
+            boxes = {'widths': [], 'heights': [], 'lefts': [], 'bottoms': [], 'rotations': []}
+            opened = iter_readers(
+                files_list, share=readers is not None, metrics=metrics, mapped=True, opened=readers, pool=pool,
+                count=False,
+            )
+            for path, reader in zip(files_list, opened):
+                pages_counts.append(reader.pages_count)
+                # Pages of packed stickers hold different numbers of them, so the whole job is planned
+                if layout.get('packing'):
+                    for key, values in page_boxes(_collect_pages(reader, metrics, path)).items():
+                        boxes[key] += values
+                if readers is None:
+                    reader.close()
+                else:
+                    reader.release()
+            if layout.get('packing'):
+                with metrics.stage('layout'):
+                    plan = plan_layout(**boxes, **layout)
+
+    if sharded:
+        from app.shards import sharded_stacker
+
+        sharded_stacker(
+            files_list,
+            file_to_write,
+            hashes,
+            pages_counts,
+            shard_sheets,
+            shard_bytes,
+            workers=workers,
+            stream=stream,
+            optimize=optimize,
+            metrics=metrics,
+            plan=plan,
+            prefetch=prefetch,
+            max_open=max_open,
+            **kwargs
+        )
+        return
+
+    if incremental:
+        from app.incremental import full_layout, incremental_stacker, read_manifest, write_manifest
+
+        sheets = []
+        compose = partial(
+            incremental_stacker,
+            files_list,
+            hashes,
+            pages_counts,
+            read_manifest(file_to_write, full_layout(kwargs)),
+            file_to_write,
+            metrics=metrics,
+            opened=readers,
+            sheets=sheets,
+            plan=plan,
+            pool=pool,
+            **kwargs
+        )
+    elif workers > 1:
+        pages_counts = [m['pages'] for m in metadata] if metadata is not None else None
+        compose = partial(
+            parallel_sticker_stacker,
+            files_list,
+            workers,
+            metrics=metrics,
+            pages_counts=pages_counts,
+            plan=plan,
+            **kwargs
+        )
+    elif piped:
+        from app.pipe import iter_piped_stickers
+
+        stickers = iter_piped_stickers(files_list, sys.stdin.buffer if stdin is None else stdin, metrics)
+        compose = partial(sticker_stacker, stickers, plan=plan, metrics=metrics, close_sources=True, **kwargs)
+    elif stream:
+        opened = iter_readers(
+            files_list, share=readers is not None, metrics=metrics, mapped=True, opened=readers, pool=pool,
+        )
+        stickers = iter_stickers(opened, metrics, files_list)
+        # Every file is closed once its pages are placed, unless readers are kept for other jobs
+        compose = partial(
+            sticker_stacker, stickers, plan=plan, metrics=metrics, close_sources=readers is None, **kwargs
+        )
+    else:
+        # Only descriptors of stickers are kept. Files are opened to describe their pages if there's
+        # no metadata, and then to place them, and closed right after that unless readers are kept for other jobs
+        share = readers is not None
+        described = None
+        if metadata is None:
+            described = iter_readers(files_list, share=share, metrics=metrics, opened=readers, pool=pool)
+        stickers = sticker_refs(files_list, described, metrics, metadata, close=not share)
+        # Whole job is checked and planned before anything is composed
+        if plan is None:
+            with metrics.stage('layout'):
+                plan = plan_layout(**stickers.boxes(), **layout)
+            metrics.count('planned_sheets', plan.sheets_count)
+        sources = iter_readers(
+            files_list, share=share, metrics=metrics, opened=readers, pool=pool, count=metadata is not None,
+        )
+        compose = partial(
+            sticker_stacker, stickers, plan=plan, metrics=metrics, sources=sources, close_sources=not share, **kwargs
+        )
 
-    with open(file_to_write, 'wb') as fp:
-        writer.write(fp)
+    # Incremental job copies sheets from the previous result, so it's replaced only when the new one is written
+    target = pathlib.Path(f'{file_to_write}.tmp') if incremental else file_to_write
+    if stream:
+        try:
+            from app.StreamingPdfWriter import StreamingPdfWriter
+
+            with nullcontext(sys.stdout.buffer) if to_stdout else open(target, 'wb') as fp:
+                writer = StreamingPdfWriter(fp, compress=optimize)
+                compose(writer=writer)
+                with metrics.stage('write'):
+                    writer.close()
+                    fp.flush()
+        except BaseException:
+            # Don't leave partially written file behind
+            if not to_stdout:
+                pathlib.Path(target).unlink(missing_ok=True)
+            raise
+        metrics.count('bytes_written', writer.bytes_written)
+        metrics.count('bytes_saved', writer.bytes_saved)
+    else:
+        writer = compose()
+
+        with metrics.stage('write'), open(target, 'wb') as fp:
+            if optimize:
+                from app.optimize import write_optimized
+
+                plain_size, written = write_optimized(writer, fp)
+                metrics.count('bytes_saved', plain_size - written)
+            else:
+                writer.write(fp)
+            metrics.count('bytes_written', fp.tell())
+
+    if incremental:
+        os.replace(target, file_to_write)
+        write_manifest(file_to_write, full_layout(kwargs), sheets)
 
 
 def parse_options(
@@ -240,14 +1322,40 @@ def file_name(value: str, result_dict: dict) -> None:
 def directory(value: str, result_dict: dict) -> None:
     """
     -d option. User defined directory from which all pdf files will be used as files list.
+    It's scanned when all options are parsed, see scan_options.
 
     :param value: Name of the directory
     :param result_dict: Dict of arguments to modify
     """
-    try:
-        result_dict['files_list'] = [value / pathlib.Path(f) for f in os.listdir(value) if f.endswith(('.pdf', '.PDF'))]
-    except FileNotFoundError:
-        raise UnprocessableArgumentsError([(value, 'No such directory'), ])
+    result_dict['directory'] = value
+
+
+def patterns(attr_key: str, value: str, result_dict: dict) -> None:
+    """
+    Options that take comma separated glob patterns.
+
+    :param attr_key: kwarg of scan_directory to set
+    :param value: patterns like *.pdf,*label*
+    :param result_dict: Dict of arguments to modify
+    """
+    result_dict[attr_key] = [p.strip() for p in value.split(',') if p.strip()]
+
+
+# --include option. Patterns of files to pick from the directory
+set_include = partial(patterns, attr_key='include')
+# --exclude option. Patterns of files and subdirectories to skip in the directory
+set_exclude = partial(patterns, attr_key='exclude')
+
+
+def scan_options(result_dict: dict) -> None:
+    """
+    Replaces options of the directory scan with found files, put before individual files.
+
+    :param result_dict: Dict of arguments to modify
+    """
+    options = {k: result_dict.pop(k) for k in ('recursive', 'include', 'exclude') if k in result_dict}
+    if 'directory' in result_dict:
+        result_dict['files_list'] = scan_directory(result_dict.pop('directory'), **options) + result_dict['files_list']
 
 
 def grid_parameters(attr_key: str, value: str, result_dict: dict) -> None:
@@ -299,6 +1407,65 @@ def set_fill(value: str, result_dict: dict) -> None:
         result_dict['fill'] = True
 
 
+def boolean_option(attr_key: str, value: str, result_dict: dict) -> None:
+    """
+    Options that switch some feature on. Pass 'true' to enable it.
+    Everything else will be considered as false.
+
+    :param attr_key: kwarg of compose_stickers to set
+    :param value: string 'true' is expected. Others are ignored
+    :param result_dict: Dict of arguments to modify
+    """
+    if value.lower() in ('true', 't', '1'):
+        result_dict[attr_key] = True
+
+
+# --stream option. Open files lazily and write pages as soon as they are ready
+set_stream = partial(boolean_option, attr_key='stream')
+# --xobjects option. Put every distinct page in the file only once
+set_xobjects = partial(boolean_option, attr_key='xobjects')
+# --optimize option. Write the result as small as possible
+set_optimize = partial(boolean_option, attr_key='optimize')
+# --pack option. Place stickers at their own size, as many on a page as fit
+set_packing = partial(boolean_option, attr_key='packing')
+# --max-scale option. Scale of packed stickers in percent
+set_max_scale = partial(grid_parameters, attr_key='max_scale')
+# --incremental option. Recompose only sheets changed since the previous run
+set_incremental = partial(boolean_option, attr_key='incremental')
+# --workers option. Number of processes to compose pages in
+set_workers = partial(grid_parameters, attr_key='workers')
+# --prefetch option. Files to open in the background ahead of the one being composed
+set_prefetch = partial(grid_parameters, attr_key='prefetch')
+# --max-open option. Most input files kept open at once while prefetching
+set_max_open = partial(grid_parameters, attr_key='max_open')
+# --shard-sheets option. Most sheets in a shard of the result
+set_shard_sheets = partial(grid_parameters, attr_key='shard_sheets')
+
+
+def set_shard_bytes(value: str, result_dict: dict) -> None:
+    """
+    --shard-bytes option. Approximate size of shards of the result. K, M and G suffixes stand for
+    kibibytes, mebibytes and gibibytes.
+
+    :param value: size like 1048576 or 50M
+    :param result_dict: Dict of arguments to modify
+    """
+    units = {'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30}
+    multiplier = units.get(value[-1:].upper(), 1)
+    try:
+        result_dict['shard_bytes'] = int(value[:-1] if multiplier > 1 else value) * multiplier
+    except ValueError:
+        raise UnprocessableArgumentsError([(value, 'Should be an integer, optionally followed by K, M or G'), ])
+
+
+# --profile option. Print time of every stage and counters of the job
+set_profile = partial(boolean_option, attr_key='profile')
+# --recursive option. Scan subdirectories of the directory too
+set_recursive = partial(boolean_option, attr_key='recursive')
+# --cache option. Keep metadata of input files in the persistent cache, so unchanged files aren't parsed again
+set_cache = partial(boolean_option, attr_key='cache')
+
+
 def set_margins(value: int, result_dict: dict) -> None:
     try:
         result_dict['sticker_margin'] = int(value)
@@ -306,18 +1473,35 @@ def set_margins(value: int, result_dict: dict) -> None:
         raise UnprocessableArgumentsError([(str(value), 'Is not valid value for margin.'), ])
 
 
-def parse_arguments() -> dict[str, str]:
+def parse_arguments(arguments: list[str] | None = None) -> dict[str, str]:
     """
     Parse command line arguments.
 
-    -f - optional. Name of the final file to save
+    -f - optional. Name of the final file to save, - to write it to the standard output
     -d - optional. Directory from which all pdf files will be used as input files
+    --recursive - optional. Use files from subdirectories of the directory too
+    --include - optional. Comma separated glob patterns of files to use from the directory
+    --exclude - optional. Comma separated glob patterns of files and subdirectories to skip
     -w - optional. How many stickers should be placed across the page
     -h - optional. How many stickers should be placed down the page
     -s - optional. Paper format to use (e.g. A4, A3 etc.)
     -r - optional. Rotate to keep original ratio of stickers
     -m - optional. Margins around each sticker in mm
-
+    --pack - optional. Place stickers at their own size, as many on a page as fit, instead of the grid
+    --max-scale - optional. Scale of packed stickers in percent, stickers bigger than a page are shrunk anyway
+    --stream - optional. Open files lazily and write every page as soon as it's ready
+    --workers - optional. Number of processes to compose pages in
+    --xobjects - optional. Put every distinct page in the file only once and reuse it
+    --optimize - optional. Compress the result and write identical objects in it once
+    --incremental - optional. Keep a manifest next to the result and recompose only changed sheets
+    --shard-sheets - optional. Split the result in files of at most this many sheets, written by workers at once
+    --shard-bytes - optional. Split the result in files of about this many bytes (K, M and G suffixes are allowed)
+    --prefetch - optional. Number of upcoming files to open in the background while composing, 0 by default
+    --max-open - optional. Most input files kept open at once while prefetching
+    --profile - optional. Print time of every stage and counters of the job when it's done
+    --cache - optional. Use the persistent metadata cache of input files. False by default
+
+    :param arguments: arguments to parse. Arguments of the command line by default
     :return: Dict of kwargs to main function
     """
 
@@ -325,33 +1509,82 @@ def parse_arguments() -> dict[str, str]:
     implemented_options = {
         '-f': file_name,
         '-d': directory,
+        '--recursive': set_recursive,
+        '--include': set_include,
+        '--exclude': set_exclude,
         '-w': set_stickers_in_width,
         '-h': set_stickers_in_height,
         '-s': set_paper_format,
         '-r': set_keep_ratio,
         '-l': set_fill,
         '-m': set_margins,
+        '--pack': set_packing,
+        '--max-scale': set_max_scale,
+        '--stream': set_stream,
+        '--workers': set_workers,
+        '--xobjects': set_xobjects,
+        '--optimize': set_optimize,
+        '--incremental': set_incremental,
+        '--shard-sheets': set_shard_sheets,
+        '--shard-bytes': set_shard_bytes,
+        '--prefetch': set_prefetch,
+        '--max-open': set_max_open,
+        '--profile': set_profile,
+        '--cache': set_cache,
     }
 
     # Get list of options with their values and list of files to use
-    options, files = parse_options(sys.argv[1:], implemented_options)
+    options, files = parse_options(sys.argv[1:] if arguments is None else arguments, implemented_options)
 
     # Default input to main function
     result = {
         'files_list': files,
-        'file_to_write': 'stickers.pdf'
+        'file_to_write': 'stickers.pdf',
+        # Single runs don't leave anything behind unless asked to
+        'cache': False,
     }
 
     # For all parsed options call corresponding function with its value and result dict to modify
     for option, value in options:
         implemented_options[option](value=value, result_dict=result)
+    scan_options(result)
 
     return result
 
 
-if __name__ == '__main__':
+def usage() -> str:
+    """
+    Help of the command made of options described in parse_arguments
+    """
+    options = [line.strip() for line in parse_arguments.__doc__.splitlines() if line.strip().startswith('-')]
+    return '\n'.join(['python3 -m app [OPTIONS] files... (- for pdf files from stdin)', *options])
+
+
+def main() -> None:
+    if '--help' in sys.argv[1:]:
+        print(usage())
+        return
     try:
-        compose_stickers(**parse_arguments())
+        arguments = parse_arguments()
+        if arguments['cache']:
+            from app.MetadataCache import default_cache
+            arguments['cache'] = default_cache()
+        else:
+            arguments['cache'] = None
+        profile = arguments.pop('profile', False)
+        if profile or arguments.get('optimize'):
+            arguments['metrics'] = Metrics()
+        compose_stickers(**arguments)
+        if profile:
+            print(arguments['metrics'], file=sys.stderr)
+        elif arguments.get('optimize'):
+            counters = arguments['metrics'].counters
+            print(f'{counters["bytes_written"]} bytes written, {counters["bytes_saved"]} bytes saved', file=sys.stderr)
     except UnprocessableArgumentsError as uae:
-        print(uae)
+        # The standard output can be the resulting file
+        print(uae, file=sys.stderr)
         sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+import hashlib
+import io
+import zlib
+from collections import defaultdict, deque
+from typing import BinaryIO, Iterator
+
+from pypdf import PdfWriter
+from pypdf.generic import (
+    ArrayObject,
+    DictionaryObject,
+    EncodedStreamObject,
+    IndirectObject,
+    NameObject,
+    NumberObject,
+    PdfObject,
+    StreamObject,
+)
+
+# Objects packed in a single object stream. Reader has to decompress the whole stream to get any of them
+OBJECTS_PER_STREAM = 200
+# Objects that are never merged with identical ones: every page must stay in the page tree only once
+_STRUCTURE_TYPES = ('/Page', '/Pages', '/Catalog')
+# Object and cross-reference streams came with pdf 1.5, so it's the lowest version of the result
+MIN_VERSION = (1, 5)
+
+
+def compress_stream(obj: StreamObject, level: int = 9) -> StreamObject:
+    """
+    Flate compresses the stream if it has no filters and gets smaller with it.
+
+    :param obj: stream to compress
+    :param level: zlib compression level
+    :return: compressed stream, or the same one if it's not worth it
+    """
+    if '/Filter' in obj:
+        return obj
+    # Content streams build their data from parsed operations only when asked
+    data = obj.get_data()
+    encoded = obj.flate_encode(level)
+    # Encoded stream gives decoded data back, the encoded one is only in _data
+    if len(encoded._data) >= len(data):
+        return obj
+    encoded.indirect_reference = obj.indirect_reference
+    return encoded
+
+
+def _references(obj: PdfObject) -> Iterator[tuple[PdfObject, object, IndirectObject]]:
+    """
+    References in the object and in direct objects it contains.
+
+    :return: Iterator of (container, key or index in it, reference)
+    """
+    containers = [obj]
+    while containers:
+        container = containers.pop()
+        if isinstance(container, DictionaryObject):
+            items = container.items()
+        elif isinstance(container, ArrayObject):
+            items = enumerate(container)
+        else:
+            continue
+        for key, value in items:
+            if isinstance(value, IndirectObject):
+                yield container, key, value
+            else:
+                containers.append(value)
+
+
+def _serialize(obj: PdfObject) -> bytes:
+    output = io.BytesIO()
+    obj.write_to_stream(output)
+    return output.getvalue()
+
+
+def _object_bytes(idnum: int, data: bytes) -> bytes:
+    return b'%d 0 obj\n%s\nendobj\n' % (idnum, data)
+
+
+def _header(writer: PdfWriter) -> bytes:
+    """
+    Header of the writer, raised to MIN_VERSION if it's lower. Higher versions sources need are kept.
+    """
+    header = writer.pdf_header
+    if isinstance(header, str):
+        header = header.encode()
+    try:
+        version = tuple(int(part) for part in header[len(b'%PDF-'):].split(b'.'))
+    except ValueError:
+        version = ()
+    if version < MIN_VERSION:
+        return b'%%PDF-%d.%d' % MIN_VERSION
+    return header
+
+
+def _plain_size(writer: PdfWriter, sizes: dict[int, int]) -> int:
+    """
+    Size the writer takes written by pypdf as it is.
+
+    :param sizes: sizes of serialized objects by their numbers
+    """
+    size = len(writer.pdf_header) + 1 + 6
+    size += sum(len(b'%d 0 obj\n\nendobj\n' % idnum) + length for idnum, length in sizes.items())
+    size += len(f'xref\n0 {len(writer._objects) + 1}\n') + 20 * (len(writer._objects) + 1)
+    trailer = io.BytesIO()
+    writer._write_trailer(trailer, size)
+    return size + len(trailer.getvalue())
+
+
+def write_optimized(writer: PdfWriter, stream: BinaryIO, level: int = 9) -> tuple[int, int]:
+    """
+    Writes the document in the smallest form it can without touching what pages look like:
+    - objects that can't be reached from the catalog or the info are skipped. Every merge of
+    a sticker replaces page contents with a new stream and leaves the previous one behind
+    - streams without filters (content streams first of all) are Flate compressed
+    - identical objects are written once. Fonts, images, ICC profiles etc. are copied from
+    the source file with every page that uses them, so stickers of the same file carry
+    their own copies of them
+    - objects other than streams are packed in compressed object streams, and
+    the cross-reference table is a compressed stream as well (PDF 1.5)
+
+    Objects of the writer are changed, so it shouldn't be used after that.
+
+    :param writer: composed document
+    :param stream: binary stream to write to. It doesn't have to be seekable
+    :param level: zlib compression level
+    :return: size of the document written as it is and written size, in bytes
+    """
+    if not writer._root:
+        writer._root = writer._add_object(writer._root_object)
+    writer._sweep_indirect_references(writer._root)
+    objects = writer._objects
+
+    # Objects the document consists of, and where each of them is referred from
+    referrers: dict[int, set[int]] = defaultdict(set)
+    live = set()
+    pending = [writer._root.idnum, writer._info_obj.idnum]
+    while pending:
+        idnum = pending.pop()
+        if idnum in live or objects[idnum - 1] is None:
+            continue
+        live.add(idnum)
+        for _, _, ref in _references(objects[idnum - 1]):
+            if ref.pdf is writer:
+                referrers[ref.idnum].add(idnum)
+                pending.append(ref.idnum)
+
+    serialized: dict[int, bytes] = {}
+    sizes = {}
+    for idnum, obj in enumerate(objects, start=1):
+        if obj is None:
+            continue
+        data = _serialize(obj)
+        sizes[idnum] = len(data)
+        if idnum in live:
+            if isinstance(obj, StreamObject):
+                compressed = compress_stream(obj, level)
+                if compressed is not obj:
+                    objects[idnum - 1] = compressed
+                    data = _serialize(compressed)
+            serialized[idnum] = data
+    plain_size = _plain_size(writer, sizes)
+
+    # Identical objects are merged until nothing changes: once duplicates are merged,
+    # objects referring to them can become identical too (e.g. font dictionaries
+    # referring to identical font files)
+    fixed = {writer._info_obj.idnum}
+    for idnum in live:
+        obj = objects[idnum - 1]
+        if isinstance(obj, DictionaryObject) and obj.get('/Type') in _STRUCTURE_TYPES:
+            fixed.add(idnum)
+    digests: dict[int, bytes] = {}
+    by_digest: dict[bytes, int] = {}
+    queue = deque(sorted(live))
+    while queue:
+        idnum = queue.popleft()
+        if idnum not in live or idnum in fixed:
+            continue
+        if idnum in digests and by_digest.get(digests[idnum]) == idnum:
+            del by_digest[digests[idnum]]
+        digest = hashlib.blake2b(serialized[idnum], digest_size=16).digest()
+        digests[idnum] = digest
+        same = by_digest.get(digest)
+        if same is None or serialized[same] != serialized[idnum]:
+            by_digest[digest] = idnum
+            continue
+        live.discard(idnum)
+        del serialized[idnum]
+        for referrer in referrers.pop(idnum, ()):
+            if referrer not in live:
+                continue
+            for container, key, ref in list(_references(objects[referrer - 1])):
+                if ref.pdf is writer and ref.idnum == idnum:
+                    container[key] = IndirectObject(same, 0, writer)
+            serialized[referrer] = _serialize(objects[referrer - 1])
+            referrers[same].add(referrer)
+            queue.append(referrer)
+
+    written = 0
+
+    def write(data: bytes) -> None:
+        nonlocal written
+        stream.write(data)
+        written += len(data)
+
+    write(_header(writer) + b'\n%\xE2\xE3\xCF\xD3\n')
+    # Cross-reference entries by object numbers: (1, offset, 0) for objects written as they are,
+    # (2, number of object stream, index in it) for objects in object streams
+    entries: dict[int, tuple[int, int, int]] = {}
+    packed = []
+    for idnum in sorted(live):
+        if isinstance(objects[idnum - 1], StreamObject):
+            entries[idnum] = (1, written, 0)
+            write(_object_bytes(idnum, serialized[idnum]))
+        else:
+            packed.append(idnum)
+
+    next_number = len(objects) + 1
+    for start in range(0, len(packed), OBJECTS_PER_STREAM):
+        chunk = packed[start:start + OBJECTS_PER_STREAM]
+        header, body = [], io.BytesIO()
+        for index, idnum in enumerate(chunk):
+            header.append(b'%d %d' % (idnum, body.tell()))
+            body.write(serialized[idnum] + b'\n')
+            entries[idnum] = (2, next_number, index)
+        header = b' '.join(header) + b'\n'
+        object_stream = EncodedStreamObject()
+        object_stream.update({
+            NameObject('/Type'): NameObject('/ObjStm'),
+            NameObject('/N'): NumberObject(len(chunk)),
+            NameObject('/First'): NumberObject(len(header)),
+            NameObject('/Filter'): NameObject('/FlateDecode'),
+        })
+        object_stream._data = zlib.compress(header + body.getvalue(), level)
+        entries[next_number] = (1, written, 0)
+        write(_object_bytes(next_number, _serialize(object_stream)))
+        next_number += 1
+
+    xref_number = next_number
+    entries[xref_number] = (1, written, 0)
+    width = max(1, (max(written, xref_number).bit_length() + 7) // 8)
+    rows = io.BytesIO()
+    for idnum in range(xref_number + 1):
+        kind, field, generation = entries.get(idnum, (0, 0, 65535 if idnum == 0 else 0))
+        rows.write(kind.to_bytes(1, 'big') + field.to_bytes(width, 'big') + generation.to_bytes(2, 'big'))
+    xref = EncodedStreamObject()
+    xref.update({
+        NameObject('/Type'): NameObject('/XRef'),
+        NameObject('/Size'): NumberObject(xref_number + 1),
+        NameObject('/W'): ArrayObject([NumberObject(1), NumberObject(width), NumberObject(2)]),
+        NameObject('/Root'): writer._root,
+        NameObject('/Info'): writer._info_obj,
+        NameObject('/Filter'): NameObject('/FlateDecode'),
+    })
+    if writer._ID:
+        xref[NameObject('/ID')] = writer._ID
+    xref._data = zlib.compress(rows.getvalue(), level)
+    xref_location = written
+    write(_object_bytes(xref_number, _serialize(xref)))
+    write(f'startxref\n{xref_location}\n%%EOF\n'.encode())
+    return plain_size, written
@@ -0,0 +1,165 @@
+import fnmatch
+import os
+import re
+import tarfile
+from typing import BinaryIO, Iterable, Iterator
+
+from pypdf import PageObject
+from pypdf.errors import PyPdfError
+
+from app.Metrics import Metrics
+from app.SourceReader import SourceReader
+from app.main import PDF_PATTERNS, STDIN, UnprocessableArgumentsError, _collect_pages, is_stdin
+
+# How much of the standard input is read at once
+CHUNK_SIZE = 1 << 20
+# End of a document followed by the header of the next one in concatenated documents
+BOUNDARY_PATTERN = re.compile(rb'%%EOF[\r\n\t\f\0 ]*(?=%PDF-)')
+# Longest boundary that can be split between chunks, without the header of the next document
+BOUNDARY_OVERLAP = 64
+# Offset of the cross-reference section written right before the end-of-file marker
+STARTXREF_PATTERN = re.compile(rb'startxref[\r\n\t\f\0 ]+(\d+)[\r\n\t\f\0 ]*$')
+# What the cross-reference section starts with: xref table or xref stream object
+XREF_PATTERN = re.compile(rb'[\r\n\t\f\0 ]*(?:xref|\d+[\r\n\t\f\0 ]+\d+[\r\n\t\f\0 ]+obj)')
+
+
+class _Prefixed:
+    """
+    Binary stream that gives the already read prefix back before the rest of the stream.
+    """
+    def __init__(self, prefix: bytes, stream: BinaryIO):
+        self.prefix = prefix
+        self.stream = stream
+
+    def read(self, size: int = -1) -> bytes:
+        if not self.prefix:
+            return self.stream.read(size)
+        if size < 0:
+            data, self.prefix = self.prefix + self.stream.read(), b''
+            return data
+        data, self.prefix = self.prefix[:size], self.prefix[size:]
+        return data
+
+
+def _ends_document(document: bytes | bytearray, marker: int) -> bool:
+    """
+    Whether the end-of-file marker at the given place ends the document that starts the buffer:
+    it follows startxref with the offset of a cross-reference section from the start of the buffer.
+    Documents embedded in streams of others refer to offsets in themselves.
+    """
+    match = STARTXREF_PATTERN.search(document, max(marker - BOUNDARY_OVERLAP, 0), marker)
+    return match is not None and XREF_PATTERN.match(document, int(match[1]), marker) is not None
+
+
+def split_documents(stream: BinaryIO, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Splits concatenated pdf documents. A document ends with the last end-of-file marker
+    before the header of the next one, so documents with incremental updates stay whole.
+    Every document is given as soon as the header of the next one is read,
+    so only one document is kept at once.
+
+    Only markers right after startxref pointing to a cross-reference section of the document
+    end it, so uncompressed pdf files embedded in a document (e.g. attachments) don't split it.
+    Damaged documents without startxref are not split from the next ones, send such documents
+    in a tar archive instead.
+
+    :param stream: binary stream of documents
+    :param chunk_size: how many bytes to read at once
+    :return: Iterator of contents of documents
+    """
+    buffer = bytearray()
+    # Where the search for the next boundary continues from
+    scanned = 0
+    while chunk := stream.read(chunk_size):
+        buffer += chunk
+        while match := BOUNDARY_PATTERN.search(buffer, scanned):
+            if not _ends_document(buffer, match.start()):
+                scanned = match.end()
+                continue
+            yield bytes(buffer[:match.end()])
+            del buffer[:match.end()]
+            scanned = 0
+        scanned = max(len(buffer) - BOUNDARY_OVERLAP, scanned)
+    if buffer.strip():
+        yield bytes(buffer)
+
+
+def untar_documents(stream: BinaryIO, include: Iterable[str] = PDF_PATTERNS) -> Iterator[tuple[str, bytes]]:
+    """
+    Extracts pdf files from a tar archive (compressed or not) in the order they are in it,
+    reading the archive once, from the start to the end.
+
+    :param stream: binary stream of the archive
+    :param include: glob patterns of names of files to take
+    :return: Iterator of names and contents of files
+    :raise tarfile.TarError: if the stream is not a tar archive or it's damaged
+    """
+    with tarfile.open(fileobj=stream, mode='r|*') as archive:
+        for member in archive:
+            if member.isfile() and any(fnmatch.fnmatch(member.name.lower(), p) for p in include):
+                yield member.name, archive.extractfile(member).read()
+
+
+def read_documents(stream: BinaryIO, metrics: Metrics | None = None) -> Iterator[SourceReader]:
+    """
+    Opens documents of the standard input one by one as they come: a single pdf document,
+    several documents written one after another, or a tar archive of pdf files.
+
+    :param stream: binary stream of the standard input
+    :param metrics: Metrics to collect time of opening documents and their number in
+    :return: Iterator of SourceReader of every document, named after its place in the input
+    :raise UnprocessableArgumentsError: if the input is neither pdf nor tar, or a document can't be parsed
+    """
+    if metrics is None:
+        metrics = Metrics()
+    head = stream.read(CHUNK_SIZE)
+    stream = _Prefixed(head, stream)
+    if head.lstrip().startswith(b'%PDF-'):
+        documents = ((f'{STDIN}/{number}', data) for number, data in enumerate(split_documents(stream), start=1))
+    elif head:
+        documents = ((f'{STDIN}/{name}', data) for name, data in untar_documents(stream))
+    else:
+        raise UnprocessableArgumentsError([(STDIN, 'Standard input is empty'), ])
+
+    try:
+        for name, data in documents:
+            metrics.count('files')
+            with metrics.stage('open', name):
+                try:
+                    yield SourceReader(name, data=data)
+                except PyPdfError as e:
+                    raise UnprocessableArgumentsError([(name, f'File cannot be parsed: {e}'), ])
+    except tarfile.TarError:
+        raise UnprocessableArgumentsError([(STDIN, 'Standard input is neither pdf nor tar of pdf files'), ])
+
+
+def iter_piped_stickers(
+        files_list: Iterable[str | os.PathLike],
+        stream: BinaryIO | str | os.PathLike,
+        metrics: Metrics | None = None,
+) -> Iterator[PageObject]:
+    """
+    Same as iter_stickers, but documents of the standard input are used in place of -.
+    Selected pages (-[1-2]) are taken from every document of it.
+
+    :param files_list: paths to pdf files, already validated, and -
+    :param stream: binary stream of the standard input, or path to a file read in its place.
+    The file is closed when the iterator is done
+    :param metrics: Metrics to collect time of opening files and collecting pages in
+    :return: Iterator of PageObject objects
+    """
+    if isinstance(stream, (str, os.PathLike)):
+        with open(stream, 'rb') as fp:
+            yield from iter_piped_stickers(files_list, fp, metrics)
+        return
+    if metrics is None:
+        metrics = Metrics()
+    for path in files_list:
+        if is_stdin(path):
+            for reader in read_documents(stream, metrics):
+                yield from _collect_pages(reader, metrics, path)
+            continue
+        metrics.count('files')
+        with metrics.stage('open', str(path)):
+            reader = SourceReader(path, mapped=True)
+        yield from _collect_pages(reader, metrics, path)
@@ -0,0 +1,309 @@
+import http.client
+import itertools
+import json
+import os
+import pathlib
+import shutil
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app.PageSelection import parse_file
+from app.main import (
+    STDOUT,
+    UnprocessableArgumentsError,
+    grid_parameters,
+    is_stdin,
+    parse_arguments,
+    parse_options,
+    set_workers,
+)
+
+DEFAULT_PORT = 8765
+
+
+class ComposeHandler(BaseHTTPRequestHandler):
+    """
+    POST /compose with JSON object of compose_stickers kwargs runs the job in the pool of the server.
+    If the job has file_to_write, the file is written there and the result of the job
+    (see batch.run_job) is returned as JSON. Otherwise, the composed pdf itself is returned,
+    with the result in X-Stickers-Result header. Failed jobs are answered with 422 and the result.
+    GET /health answers 200 when the server is up.
+
+    Jobs read and write any file the server can, so only local programs may send them. Browsers
+    send requests of other sites with Origin header, and can't send JSON without it, so requests
+    with Origin are answered with 403 and the ones with other content types with 415.
+    """
+    server: 'ComposeServer'
+
+    def do_GET(self):
+        if self.path != '/health':
+            self.send_error(404)
+            return
+        self._send(200, json.dumps({'status': 'ok'}).encode(), 'application/json')
+
+    def do_POST(self):
+        if self.path != '/compose':
+            self.send_error(404)
+            return
+        if 'Origin' in self.headers:
+            self._send(403, json.dumps({'status': 'error', 'error': 'Requests of web pages are not allowed'}).encode(),
+                       'application/json')
+            return
+        content_type = self.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type != 'application/json':
+            self._send(415, json.dumps({'status': 'error', 'error': 'Content-Type application/json expected'}).encode(),
+                       'application/json')
+            return
+        try:
+            job = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        except ValueError:
+            job = None
+        if not isinstance(job, dict):
+            self._send(400, json.dumps({'status': 'error', 'error': 'JSON object of arguments expected'}).encode(),
+                       'application/json')
+            return
+
+        temporary = None
+        if 'file_to_write' not in job:
+            descriptor, temporary = tempfile.mkstemp(suffix='.pdf')
+            os.close(descriptor)
+            job['file_to_write'] = temporary
+        try:
+            result = self.server.run(job)
+            if temporary is not None:
+                result['file_to_write'] = None
+            if temporary is None or result['status'] != 'ok':
+                self._send(200 if result['status'] == 'ok' else 422, json.dumps(result).encode(), 'application/json')
+                return
+            with open(temporary, 'rb') as fp:
+                self._send(200, fp.read(), 'application/pdf', {'X-Stickers-Result': json.dumps(result)})
+        finally:
+            if temporary is not None:
+                pathlib.Path(temporary).unlink(missing_ok=True)
+
+    def _send(self, code: int, body: bytes, content_type: str, headers: dict | None = None) -> None:
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self) -> str:
+        # Clients of Unix socket have no address
+        return self.client_address[0] if self.client_address else 'local'
+
+
+class ComposeServer(ThreadingHTTPServer):
+    """
+    HTTP server on localhost that runs jobs in a pool of processes living as long as the server,
+    so jobs don't pay for starting the interpreter, imports and parsing files used before.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, workers: int | None = None, bind_and_activate: bool = True):
+        super().__init__(address, ComposeHandler, bind_and_activate)
+        # Imported here, so the client doesn't wait for the pool and everything jobs need
+        from concurrent.futures import ProcessPoolExecutor
+
+        self.workers = workers or os.cpu_count() or 1
+        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        self._pool_lock = threading.Lock()
+        self._numbers = itertools.count(1)
+
+    def run(self, job: dict) -> dict:
+        """
+        Runs the job in the pool. If a process of the pool is killed (e.g. out of memory),
+        the job fails and a new pool is started for the next ones.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        from concurrent.futures.process import BrokenProcessPool
+
+        from app.batch import run_job
+
+        pool = self._pool
+        number = next(self._numbers)
+        try:
+            return pool.submit(run_job, number, job).result()
+        except BrokenProcessPool:
+            with self._pool_lock:
+                if self._pool is pool:
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            return {'job': number, 'file_to_write': job.get('file_to_write'), 'status': 'error',
+                    'error': 'Worker process terminated abruptly', 'wall_time': None}
+
+    def server_close(self) -> None:
+        super().server_close()
+        self._pool.shutdown(cancel_futures=True)
+
+
+class UnixComposeServer(ComposeServer):
+    """
+    The same server on Unix socket, available to the current user only.
+    """
+    address_family = socket.AF_UNIX
+
+    def server_bind(self) -> None:
+        pathlib.Path(self.server_address).unlink(missing_ok=True)
+        socketserver.TCPServer.server_bind(self)
+        os.chmod(self.server_address, 0o600)
+        self.server_name, self.server_port = 'localhost', 0
+
+    def server_close(self) -> None:
+        super().server_close()
+        pathlib.Path(self.server_address).unlink(missing_ok=True)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float | None = None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def serve(port: int = DEFAULT_PORT, socket_path: str | None = None, workers: int | None = None) -> None:
+    """
+    Runs the server till it's interrupted.
+
+    :param port: port on localhost to listen to
+    :param socket_path: Unix socket to listen to instead of the port
+    :param workers: number of processes to run jobs in. Number of CPUs by default
+    """
+    if socket_path is not None:
+        server = UnixComposeServer(socket_path, workers)
+    else:
+        server = ComposeServer(('127.0.0.1', port), workers)
+    with server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def request(job: dict, port: int = DEFAULT_PORT, socket_path: str | None = None) -> tuple[dict, bytes | None]:
+    """
+    Sends the job to the server and waits for it to be done.
+
+    :param job: kwargs of compose_stickers. Paths are resolved by the server,
+    so they should be absolute
+    :param port: port on localhost the server listens to
+    :param socket_path: Unix socket the server listens to instead of the port
+    :return: result of the job, and the composed pdf if the job has no file_to_write
+    """
+    if socket_path is not None:
+        connection = UnixHTTPConnection(socket_path)
+    else:
+        connection = http.client.HTTPConnection('127.0.0.1', port)
+    try:
+        connection.request('POST', '/compose', json.dumps(job), {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        body = response.read()
+    finally:
+        connection.close()
+    if response.getheader('Content-Type') == 'application/pdf':
+        return json.loads(response.getheader('X-Stickers-Result')), body
+    return json.loads(body), None
+
+
+# --port option. Port on localhost the server listens to
+set_port = partial(grid_parameters, attr_key='port')
+
+
+def set_socket(value: str, result_dict: dict) -> None:
+    """
+    --socket option. Unix socket the server listens to instead of the port.
+
+    :param value: path to the socket
+    :param result_dict: Dict of arguments to modify
+    """
+    result_dict['socket_path'] = value
+
+
+# Options to reach the server, common for both commands
+CONNECTION_OPTIONS = {
+    '--port': set_port,
+    '--socket': set_socket,
+}
+
+
+def serve_main(arguments: list[str]) -> None:
+    """
+    python -m app serve [--port PORT | --socket PATH] [--workers N]
+    """
+    implemented_options = {**CONNECTION_OPTIONS, '--workers': set_workers}
+    try:
+        options, rest = parse_options(arguments + [''], implemented_options)
+        result = {}
+        for option, value in options:
+            implemented_options[option](value=value, result_dict=result)
+        if rest != ['']:
+            raise UnprocessableArgumentsError([(' '.join(rest), 'Unknown arguments'), ])
+    except UnprocessableArgumentsError as uae:
+        print(uae, file=sys.stderr)
+        sys.exit(1)
+    serve(**result)
+
+
+def client_main(arguments: list[str]) -> None:
+    """
+    python -m app client [--port PORT | --socket PATH] [OPTIONS] files...
+    Options are the same as for a single job, the job is run by the server.
+    """
+    connection = {}
+    rest = []
+    # Connection options are taken out wherever they are among options of the job
+    while arguments:
+        argument = arguments.pop(0)
+        if argument in CONNECTION_OPTIONS and arguments:
+            CONNECTION_OPTIONS[argument](value=arguments.pop(0), result_dict=connection)
+        else:
+            rest.append(argument)
+    try:
+        job = parse_arguments(rest)
+    except UnprocessableArgumentsError as uae:
+        print(uae, file=sys.stderr)
+        sys.exit(1)
+    # Server has its own cache and the measurements stay there
+    job.pop('cache', None)
+    job.pop('profile', None)
+    # Server doesn't know the working directory of the client, nor its standard input and output
+    job['files_list'] = [f if is_stdin(parse_file(f)) else str(pathlib.Path(f).absolute()) for f in job['files_list']]
+    to_stdout = os.fspath(job['file_to_write']) == STDOUT
+    if to_stdout:
+        # Composed pdf comes back in the response
+        del job['file_to_write']
+    else:
+        job['file_to_write'] = str(pathlib.Path(job['file_to_write']).absolute())
+    spooled = None
+    if any(is_stdin(parse_file(f)) for f in job['files_list']):
+        # Standard input is written to a file only the current user can read, and the server reads it instead
+        descriptor, spooled = tempfile.mkstemp(suffix='.stdin')
+        with os.fdopen(descriptor, 'wb') as fp:
+            shutil.copyfileobj(sys.stdin.buffer, fp)
+        job['stdin'] = spooled
+
+    try:
+        result, body = request(job, **connection)
+    except OSError as e:
+        print(f'Server is not available: {e}', file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if spooled is not None:
+            pathlib.Path(spooled).unlink(missing_ok=True)
+    if result['status'] != 'ok':
+        # The standard output can be the resulting file
+        print(result.get('error'), file=sys.stderr)
+        sys.exit(1)
+    if to_stdout:
+        sys.stdout.buffer.write(body)
+        sys.stdout.buffer.flush()
@@ -0,0 +1,334 @@
+import json
+import os
+import pathlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import repeat
+from typing import Iterable, NamedTuple
+
+from app.LayoutPlan import LayoutPlan
+from app.Metrics import Metrics
+from app.ReaderPool import DEFAULT_MAX_OPEN, ReaderPool
+from app.incremental import full_layout
+from app.main import iter_selected_pages, selected_pages, sticker_stacker
+
+SHARDS_VERSION = 2
+
+
+class Shard(NamedTuple):
+    path: pathlib.Path
+    # Sheets of the whole job the shard holds and stickers they are made of
+    sheets: range
+    stickers: range
+
+
+def shard_path(file_to_write: str | os.PathLike, number: int) -> pathlib.Path:
+    """
+    Shard of the output by its number, starting from 1: stickers.pdf -> stickers-0001.pdf.
+    """
+    path = pathlib.Path(file_to_write)
+    return path.with_name(f'{path.stem}-{number:04}{path.suffix}')
+
+
+def shards_manifest_path(file_to_write: str | os.PathLike) -> pathlib.Path:
+    """
+    Manifest of the shards of the output, next to them.
+    """
+    return pathlib.Path(f'{file_to_write}.shards.json')
+
+
+def split_shards(
+        file_to_write: str | os.PathLike,
+        sheet_sizes: Iterable[int],
+        sticker_bytes: list[float],
+        shard_sheets: int | None = None,
+        shard_bytes: int | None = None,
+) -> list[Shard]:
+    """
+    Splits sheets of the job in consecutive shards. A shard is closed when it has shard_sheets sheets
+    or when its stickers are estimated to take shard_bytes, whichever comes first. Every shard has
+    at least one sheet.
+
+    :param file_to_write: output of the job shards are named after
+    :param sheet_sizes: how many stickers every sheet holds
+    :param sticker_bytes: estimated size of every sticker in the output
+    :param shard_sheets: most sheets in a shard
+    :param shard_bytes: approximate most bytes in a shard
+    :return: list of shards
+    """
+    shards = []
+    first_sheet = first_sticker = 0
+    sheets = stickers = 0
+    size = 0.0
+    for sheet_size in sheet_sizes:
+        sheet_bytes = sum(sticker_bytes[first_sticker + stickers:first_sticker + stickers + sheet_size])
+        if sheets and (
+                shard_sheets is not None and sheets >= shard_sheets
+                or shard_bytes is not None and size + sheet_bytes > shard_bytes
+        ):
+            shards.append(Shard(
+                shard_path(file_to_write, len(shards) + 1),
+                range(first_sheet, first_sheet + sheets),
+                range(first_sticker, first_sticker + stickers),
+            ))
+            first_sheet, first_sticker = first_sheet + sheets, first_sticker + stickers
+            sheets = stickers = 0
+            size = 0.0
+        sheets += 1
+        stickers += sheet_size
+        size += sheet_bytes
+    if sheets:
+        shards.append(Shard(
+            shard_path(file_to_write, len(shards) + 1),
+            range(first_sheet, first_sheet + sheets),
+            range(first_sticker, first_sticker + stickers),
+        ))
+    return shards
+
+
+def read_shards_manifest(
+        file_to_write: str | os.PathLike,
+        job: dict,
+) -> tuple[dict[str, tuple[int, int]], list[str]]:
+    """
+    Shards completed by the previous run of the same job. Shard is complete if it's recorded
+    with its size and modification time, and the file in place has both of them the same,
+    as the output of an incremental job is checked.
+
+    :param file_to_write: output of the job
+    :param job: what the job is made of, see write_shards_manifest
+    :return: sizes and modification times of complete shards by their file names, and file names
+    of all shards of the previous run
+    """
+    try:
+        with open(shards_manifest_path(file_to_write)) as fp:
+            manifest = json.load(fp)
+        files = [shard['file'] for shard in manifest['shards']]
+        if manifest['version'] != SHARDS_VERSION or manifest['job'] != job:
+            return {}, files
+        directory = pathlib.Path(file_to_write).parent
+        complete = {}
+        for shard in manifest['shards']:
+            path = directory / shard['file']
+            if shard['bytes'] is None or not path.is_file():
+                continue
+            stat = path.stat()
+            if [stat.st_size, stat.st_mtime_ns] == [shard['bytes'], shard['mtime']]:
+                complete[shard['file']] = (shard['bytes'], shard['mtime'])
+        return complete, files
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}, []
+
+
+def write_shards_manifest(
+        file_to_write: str | os.PathLike,
+        job: dict,
+        shards: list[Shard],
+        stats: dict[str, tuple[int, int]],
+) -> None:
+    """
+    Lists all shards of the output with sizes and modification times of complete ones. Replaced atomically,
+    so it's never seen half-written, whenever the job stops.
+
+    :param file_to_write: output of the job
+    :param job: layout, content hashes of input files and writing options the shards are made with
+    :param shards: all shards of the job
+    :param stats: sizes and modification times of complete shards by their file names
+    """
+    manifest = {
+        'version': SHARDS_VERSION,
+        'job': job,
+        'shards': [
+            {
+                'file': shard.path.name,
+                'sheets': [shard.sheets.start, shard.sheets.stop],
+                'stickers': [shard.stickers.start, shard.stickers.stop],
+                'bytes': stats[shard.path.name][0] if shard.path.name in stats else None,
+                'mtime': stats[shard.path.name][1] if shard.path.name in stats else None,
+            }
+            for shard in shards
+        ],
+    }
+    path = shards_manifest_path(file_to_write)
+    temporary = path.with_name(path.name + '.tmp')
+    with open(temporary, 'w') as fp:
+        json.dump(manifest, fp, separators=(',', ':'))
+    os.replace(temporary, path)
+
+
+def compose_shard(
+        selection: list[tuple[str | os.PathLike, int]],
+        path: str | os.PathLike,
+        stream: bool = False,
+        optimize: bool = False,
+        metrics: Metrics | None = None,
+        prefetch: int = 0,
+        max_open: int | None = None,
+        **kwargs
+) -> tuple[int, int]:
+    """
+    Process pool task. Composes a shard in a temporary file next to it
+    and renames it to the shard when it's completely written.
+
+    :param selection: stickers of the shard as (path to file, index of page)
+    :param path: shard to write
+    :param stream: set True to write every finished page right away, see compose_stickers
+    :param optimize: set True to make the shard as small as possible, see compose_stickers
+    :param metrics: Metrics to collect time of stages and counters in
+    :param prefetch: how many upcoming files to open in the background, see ReaderPool
+    :param max_open: most input files kept open at once while prefetching
+    :param kwargs: layout parameters of sticker_stacker
+    :return: size of the shard and how much smaller optimization made it, in bytes
+    """
+    path = pathlib.Path(path)
+    temporary = path.with_name(path.name + '.tmp')
+    # Pool is made by every process, as it can't be passed to another one
+    pool = ReaderPool(prefetch, max_open or DEFAULT_MAX_OPEN) if prefetch else None
+    # Files are memory-mapped, opened when their first page is needed and closed once their pages are placed
+    stickers = iter_selected_pages(selection, metrics=metrics, mapped=True, pool=pool)
+    try:
+        with open(temporary, 'wb') as fp:
+            if stream:
+                from app.StreamingPdfWriter import StreamingPdfWriter
+
+                writer = StreamingPdfWriter(fp, compress=optimize)
+                sticker_stacker(stickers, writer=writer, metrics=metrics, close_sources=True, **kwargs)
+                writer.close()
+                saved = writer.bytes_saved
+            elif optimize:
+                from app.optimize import write_optimized
+
+                plain_size, written = write_optimized(
+                    sticker_stacker(stickers, metrics=metrics, close_sources=True, **kwargs), fp,
+                )
+                saved = plain_size - written
+            else:
+                sticker_stacker(stickers, metrics=metrics, close_sources=True, **kwargs).write(fp)
+                saved = 0
+            written = fp.tell()
+    except BaseException:
+        temporary.unlink(missing_ok=True)
+        raise
+    os.replace(temporary, path)
+    return written, saved
+
+
+def sharded_stacker(
+        files_list: list[str | os.PathLike],
+        file_to_write: str | os.PathLike,
+        hashes: list[str],
+        pages_counts: list[int],
+        shard_sheets: int | None = None,
+        shard_bytes: int | None = None,
+        workers: int = 1,
+        stream: bool = False,
+        optimize: bool = False,
+        metrics: Metrics | None = None,
+        plan: LayoutPlan | None = None,
+        prefetch: int = 0,
+        max_open: int | None = None,
+        **kwargs
+) -> list[pathlib.Path]:
+    """
+    Same as sticker_stacker, but the result is split in shards of at most shard_sheets sheets
+    or about shard_bytes bytes, estimated from sizes of input files. Shards are composed in a pool
+    of processes and every shard appears under its name only when it's completely written.
+    The manifest of shards is updated as soon as a shard is done, so the next run of the same job
+    composes only shards that are not complete yet.
+
+    :param files_list: list of paths to pdf files, already validated
+    :param file_to_write: output of the job, shards are named after it (stickers.pdf -> stickers-0001.pdf)
+    :param hashes: content hashes of the files
+    :param pages_counts: numbers of pages of the files
+    :param shard_sheets: most sheets in a shard
+    :param shard_bytes: approximate most bytes in a shard
+    :param workers: number of processes to compose shards in. 1 means composing in the current process
+    :param stream: set True to write every finished page right away, see compose_stickers
+    :param optimize: set True to make shards as small as possible, see compose_stickers
+    :param metrics: Metrics to collect time of stages and counters in. Processes measure nothing,
+    all the time spent in them is counted as merge
+    :param plan: LayoutPlan of all stickers. Required for packed stickers, as their sheets hold different
+    numbers of them
+    :param prefetch: how many upcoming files every shard opens in the background, see ReaderPool
+    :param max_open: most input files every shard keeps open at once while prefetching
+    :param kwargs: layout parameters of sticker_stacker
+    :return: paths to all shards of the output in their order
+    """
+    if metrics is None:
+        metrics = Metrics()
+    pages = [selected_pages(path, pages_count) for path, pages_count in zip(files_list, pages_counts)]
+    stickers_count = sum(len(indexes) for indexes in pages)
+    if kwargs.get('packing'):
+        sheet_sizes = [len(plan.sheet(number)) for number in range(plan.sheets_count)]
+    else:
+        stickers_on_page = kwargs.get('stickers_in_width', 2) * kwargs.get('stickers_in_height', 3)
+        sheet_sizes = [stickers_on_page] * (stickers_count // stickers_on_page)
+        if stickers_count % stickers_on_page:
+            sheet_sizes.append(stickers_count % stickers_on_page)
+    sticker_bytes = [
+        size
+        for path, pages_count, indexes in zip(files_list, pages_counts, pages)
+        for size in repeat(os.path.getsize(path) / max(pages_count, 1), len(indexes))
+    ]
+    shards = split_shards(file_to_write, sheet_sizes, sticker_bytes, shard_sheets, shard_bytes)
+    selection = [
+        (os.fspath(path), page_index)
+        for path, indexes in zip(files_list, pages)
+        for page_index in indexes
+    ]
+
+    job = {
+        'layout': full_layout(kwargs),
+        'files': hashes,
+        'pages': [getattr(path, 'pages', None) for path in files_list],
+        'shard_sheets': shard_sheets,
+        'shard_bytes': shard_bytes,
+        'stream': stream,
+        'optimize': optimize,
+    }
+    stats, previous_files = read_shards_manifest(file_to_write, job)
+    stats = {shard.path.name: stats[shard.path.name] for shard in shards if shard.path.name in stats}
+    # Shards of a different job that are not overwritten by this one
+    names = {shard.path.name for shard in shards}
+    for name in previous_files:
+        if name not in names:
+            (pathlib.Path(file_to_write).parent / name).unlink(missing_ok=True)
+    write_shards_manifest(file_to_write, job, shards, stats)
+
+    pending = []
+    for shard in shards:
+        if shard.path.name in stats:
+            metrics.count('sheets', len(shard.sheets))
+            metrics.count('reused_sheets', len(shard.sheets))
+        else:
+            pending.append(shard)
+
+    def done(shard: Shard, written: int, saved: int) -> None:
+        stats[shard.path.name] = (written, shard.path.stat().st_mtime_ns)
+        write_shards_manifest(file_to_write, job, shards, stats)
+        metrics.count('bytes_written', written)
+        metrics.count('bytes_saved', saved)
+
+    options = {'stream': stream, 'optimize': optimize, 'prefetch': prefetch, 'max_open': max_open, **kwargs}
+    if workers == 1:
+        for shard in pending:
+            selected = selection[shard.stickers.start:shard.stickers.stop]
+            done(shard, *compose_shard(selected, shard.path, metrics=metrics, **options))
+        return [shard.path for shard in shards]
+
+    with metrics.stage('merge'), ProcessPoolExecutor(max_workers=workers) as executor:
+        tasks = {
+            executor.submit(compose_shard, selection[shard.stickers.start:shard.stickers.stop], shard.path, **options):
+                shard
+            for shard in pending
+        }
+        try:
+            for task in as_completed(tasks):
+                shard = tasks[task]
+                done(shard, *task.result())
+                metrics.count('sheets', len(shard.sheets))
+                metrics.count('pages', len(shard.stickers))
+        except BaseException:
+            # Shards done so far are in the manifest already, the rest are composed on the next run
+            executor.shutdown(cancel_futures=True)
+            raise
+    return [shard.path for shard in shards]
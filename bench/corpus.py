@@ -0,0 +1,219 @@
+import hashlib
+import inspect
+import json
+import os
+import pathlib
+import random
+import zlib
+
+from pypdf import PdfWriter
+from pypdf.generic import (
+    ArrayObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    FloatObject,
+    IndirectObject,
+    NameObject,
+    NumberObject,
+    StreamObject,
+)
+
+# Media box sizes in points stickers are usually made of, both orientations are used
+PAGE_SIZES = (
+    (595, 842),  # A4
+    (420, 595),  # A5
+    (298, 420),  # A6
+    (612, 792),  # Letter
+    (283, 425),  # 100 x 150 mm shipping label
+    (288, 288),  # 4 x 4 inch square label
+    (170, 113),  # 60 x 40 mm price tag
+)
+
+# Glyphs of the embedded font: small filled squares and bars, enough to have
+# a real font program in every file without shipping any font data
+GLYPHS = {
+    'a': '0 0 500 500 re f',
+    'b': '0 0 250 700 re f',
+    'c': '0 0 700 250 re f',
+    'd': '100 100 300 300 re f',
+}
+
+
+def make_font(writer: PdfWriter) -> IndirectObject:
+    """
+    Embeds Type3 font with glyphs drawn by content streams.
+
+    :param writer: PdfWriter to add the font to
+    :return: reference to the font dictionary
+    """
+    procs = DictionaryObject()
+    for name, operations in GLYPHS.items():
+        glyph = DecodedStreamObject()
+        glyph.set_data(f'1000 0 0 0 1000 1000 d1 {operations}'.encode())
+        procs[NameObject(f'/{name}')] = writer._add_object(glyph)
+
+    first = ord(min(GLYPHS))
+    font = DictionaryObject({
+        NameObject('/Type'): NameObject('/Font'),
+        NameObject('/Subtype'): NameObject('/Type3'),
+        NameObject('/FontBBox'): ArrayObject([NumberObject(0), NumberObject(0),
+                                              NumberObject(1000), NumberObject(1000)]),
+        NameObject('/FontMatrix'): ArrayObject([FloatObject(0.001), NumberObject(0), NumberObject(0),
+                                                FloatObject(0.001), NumberObject(0), NumberObject(0)]),
+        NameObject('/CharProcs'): procs,
+        NameObject('/Encoding'): DictionaryObject({
+            NameObject('/Type'): NameObject('/Encoding'),
+            NameObject('/Differences'): ArrayObject(
+                [NumberObject(first)] + [NameObject(f'/{name}') for name in sorted(GLYPHS)]
+            ),
+        }),
+        NameObject('/FirstChar'): NumberObject(first),
+        NameObject('/LastChar'): NumberObject(ord(max(GLYPHS))),
+        NameObject('/Widths'): ArrayObject([NumberObject(1000)] * len(GLYPHS)),
+    })
+    return writer._add_object(font)
+
+
+def make_image(writer: PdfWriter, rng: random.Random, size: int = 64) -> IndirectObject:
+    """
+    Embeds RGB image of random noise compressed with Flate.
+
+    :param writer: PdfWriter to add the image to
+    :param rng: source of pixels
+    :param size: width and height of the image in pixels
+    :return: reference to the image stream
+    """
+    image = StreamObject()
+    image.update({
+        NameObject('/Type'): NameObject('/XObject'),
+        NameObject('/Subtype'): NameObject('/Image'),
+        NameObject('/Width'): NumberObject(size),
+        NameObject('/Height'): NumberObject(size),
+        NameObject('/ColorSpace'): NameObject('/DeviceRGB'),
+        NameObject('/BitsPerComponent'): NumberObject(8),
+        NameObject('/Filter'): NameObject('/FlateDecode'),
+    })
+    image._data = zlib.compress(rng.randbytes(size * size * 3))
+    return writer._add_object(image)
+
+
+def page_content(rng: random.Random, width: int, height: int, content_size: int, image: bool) -> bytes:
+    """
+    Random drawing of a page: frame, rectangles, lines and text of the embedded font,
+    repeated till the content stream reaches the requested size.
+
+    :param rng: source of the drawing
+    :param width: width of the page
+    :param height: height of the page
+    :param content_size: approximate size of the content stream in bytes
+    :param image: set True to paint the embedded image on the page
+    :return: content stream data
+    """
+    operations = [f'0 0 0 RG 2 w 5 5 {width - 10} {height - 10} re S']
+    if image:
+        operations.append(f'q {width // 3} 0 0 {height // 3} {width // 3} {height // 3} cm /Im1 Do Q')
+    size = sum(map(len, operations))
+    while size < content_size:
+        x, y = rng.randrange(width), rng.randrange(height)
+        kind = rng.randrange(3)
+        if kind == 0:
+            operation = (f'{rng.random():.3f} {rng.random():.3f} {rng.random():.3f} rg '
+                         f'{x} {y} {rng.randrange(1, 60)} {rng.randrange(1, 60)} re f')
+        elif kind == 1:
+            operation = f'{rng.randrange(1, 4)} w {x} {y} m {rng.randrange(width)} {rng.randrange(height)} l S'
+        else:
+            text = ''.join(rng.choice(tuple(GLYPHS)) for _ in range(rng.randrange(4, 16)))
+            operation = f'0 g BT /F1 {rng.randrange(6, 24)} Tf {x} {y} Td ({text}) Tj ET'
+        operations.append(operation)
+        size += len(operation) + 1
+    return '\n'.join(operations).encode()
+
+
+def make_pdf(
+        path: str | os.PathLike,
+        pages: int,
+        seed: int = 0,
+        content_size: int = 2000,
+        font: bool = True,
+        image: bool = True,
+) -> None:
+    """
+    Writes synthetic pdf file. The same arguments always give the same file.
+    Size of every page is picked from PAGE_SIZES in one of orientations,
+    size of its content varies around content_size.
+
+    :param path: where to write the file
+    :param pages: number of pages
+    :param seed: seed of all random choices
+    :param content_size: average size of page content stream in bytes
+    :param font: set True to embed a font and use it on pages
+    :param image: set True to embed an image and paint it on pages
+    """
+    rng = random.Random(seed)
+    writer = PdfWriter()
+    resources = DictionaryObject()
+    if font:
+        resources[NameObject('/Font')] = DictionaryObject({NameObject('/F1'): make_font(writer)})
+    if image:
+        resources[NameObject('/XObject')] = DictionaryObject({NameObject('/Im1'): make_image(writer, rng)})
+    resources = writer._add_object(resources)
+
+    for _ in range(pages):
+        width, height = rng.choice(PAGE_SIZES)
+        if rng.random() < 0.5:
+            width, height = height, width
+        page = writer.add_blank_page(width, height)
+        content = DecodedStreamObject()
+        content.set_data(page_content(rng, width, height, rng.randint(content_size // 2, content_size * 3 // 2), image))
+        page[NameObject('/Contents')] = writer._add_object(content.flate_encode())
+        page[NameObject('/Resources')] = resources
+
+    with open(path, 'wb') as fp:
+        writer.write(fp)
+
+
+def make_corpus(
+        directory: str | os.PathLike,
+        pages: int,
+        pages_per_file: int = 50,
+        seed: int = 0,
+        **kwargs
+) -> list[pathlib.Path]:
+    """
+    Writes set of synthetic pdf files with the given number of pages in total.
+    Files have from one page up to twice pages_per_file, the last one takes the rest.
+    Names of files have a digest of all the options they are made with, so existing files
+    with the same names are reused, as they would be the same anyway.
+
+    :param directory: where to put the files. Created if missing
+    :param pages: number of pages in all files
+    :param pages_per_file: average number of pages in a file
+    :param seed: seed of all random choices
+    :param kwargs: kwargs of make_pdf
+    :return: paths to the files in the order they should be composed
+    """
+    directory = pathlib.Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    # Defaults are included, so files made before a default changes are not taken for new ones
+    options = {
+        name: parameter.default for name, parameter in inspect.signature(make_pdf).parameters.items()
+        if parameter.default is not inspect.Parameter.empty and name != 'seed'
+    }
+    options.update(kwargs, pages_per_file=pages_per_file)
+    digest = hashlib.blake2b(json.dumps(options, sort_keys=True).encode(), digest_size=4).hexdigest()
+
+    files = []
+    left = pages
+    while left > 0:
+        count = min(left, rng.randint(1, pages_per_file * 2 - 1))
+        path = directory / f'synthetic-{seed}-{digest}-{len(files):05d}-{count}.pdf'
+        file_seed = rng.getrandbits(32)
+        if not path.exists():
+            # Written under temporary name, so interrupted run doesn't leave broken file to reuse
+            temporary = path.with_suffix('.tmp')
+            make_pdf(temporary, count, seed=file_seed, **kwargs)
+            temporary.replace(path)
+        files.append(path)
+        left -= count
+    return files
@@ -0,0 +1,127 @@
+import json
+import platform
+import subprocess
+import sys
+import time
+from functools import partial
+
+from app.main import UnprocessableArgumentsError, grid_parameters, parse_options
+from bench.main import output_file
+
+# Modules every entry point is imported through
+ENTRY_POINTS = ('app.main', 'app.service', 'ui.StickersUI')
+# Commands that are expected to finish before anything heavy is imported,
+# with bare interpreter start-up to compare them with
+COMMANDS = {
+    'interpreter': ['-c', 'pass'],
+    'help': ['-m', 'app', '--help'],
+    'invalid_arguments': ['-m', 'app', '-s', 'B5', 'missing.pdf'],
+}
+# Modules that take most of the start-up time and are only needed to compose
+HEAVY_MODULES = ('pypdf', 'numpy', 'multiprocessing')
+
+
+def parse_importtime(output: str) -> dict[str, tuple[int, int]]:
+    """
+    Parses what python -X importtime writes to stderr.
+
+    :param output: stderr of the process
+    :return: self and cumulative time in microseconds by imported module
+    """
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(own), int(cumulative)
+    return times
+
+
+def import_time(module: str, runs: int = 5) -> dict:
+    """
+    Imports the module in a fresh interpreter several times and keeps the fastest run.
+
+    :param module: name of the module to import
+    :param runs: number of fresh interpreters
+    :return: cumulative import time of the module in seconds, slowest modules it imports
+    and heavy modules among them, or error if it can't be imported
+    """
+    best = None
+    for _ in range(runs):
+        process = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                                 capture_output=True, text=True)
+        if process.returncode:
+            return {'error': process.stderr.strip().splitlines()[-1]}
+        times = parse_importtime(process.stderr)
+        if best is None or times[module][1] < best[module][1]:
+            best = times
+    slowest = sorted(best.items(), key=lambda item: item[1][1], reverse=True)[1:11]
+    return {
+        'import_time': round(best[module][1] / 1e6, 4),
+        'slowest_modules': [(name, round(cumulative / 1e6, 4)) for name, (_, cumulative) in slowest],
+        'heavy_modules': [m for m in HEAVY_MODULES if m in best],
+    }
+
+
+def command_time(arguments: list[str], runs: int = 5) -> float:
+    """
+    Runs the interpreter with the arguments several times.
+
+    :param arguments: arguments of the interpreter
+    :param runs: number of runs
+    :return: the fastest wall time in seconds, interpreter start-up included
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *arguments], capture_output=True)
+        times.append(time.perf_counter() - start)
+    return round(min(times), 4)
+
+
+def run_benchmarks(runs: int = 5) -> dict:
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'imports': {module: import_time(module, runs) for module in ENTRY_POINTS},
+        'commands': {name: command_time(arguments, runs) for name, arguments in COMMANDS.items()},
+    }
+
+
+def parse_arguments() -> dict:
+    """
+    Parse command line arguments.
+
+    -f - optional. Name of the report file. Default is imports.json
+    --runs - optional. Number of fresh interpreters every measurement takes the fastest of
+
+    :return: Dict of kwargs to main function
+    """
+    implemented_options = {
+        '-f': output_file,
+        '--runs': partial(grid_parameters, attr_key='runs'),
+    }
+    options, rest = parse_options(sys.argv[1:], implemented_options)
+    if rest:
+        raise UnprocessableArgumentsError([(' '.join(rest), 'Unknown arguments'), ])
+
+    result = {
+        'file_to_write': 'imports.json',
+        'runs': 5,
+    }
+    for key, value in options:
+        implemented_options[key](value=value, result_dict=result)
+    return result
+
+
+def main(file_to_write, runs) -> None:
+    with open(file_to_write, 'w') as fp:
+        json.dump(run_benchmarks(runs), fp, indent=2)
+
+
+if __name__ == '__main__':
+    try:
+        main(**parse_arguments())
+    except UnprocessableArgumentsError as uae:
+        print(uae)
+        sys.exit(1)
@@ -0,0 +1,290 @@
+import json
+import os
+import pathlib
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from functools import partial
+from itertools import product
+from multiprocessing import get_context
+
+import pypdf
+
+from app.main import (
+    UnprocessableArgumentsError,
+    compose_stickers,
+    parse_options,
+    set_max_scale,
+    set_optimize,
+    set_packing,
+    set_paper_format,
+    set_stream,
+    set_workers,
+    set_xobjects,
+)
+from bench.corpus import make_corpus
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Default benchmark matrix. Every combination is a separate case
+GRIDS = ((1, 1), (2, 3), (4, 4), (10, 10), (40, 40))
+FILLS = (False, True)
+KEEP_RATIOS = (True, False)
+MARGINS = (0, 5)
+PAGES = (10, 1000, 10000, 100000)
+# What identifies a case in reports
+CASE_KEYS = ('pages', 'stickers_in_width', 'stickers_in_height', 'fill', 'keep_ratio', 'sticker_margin')
+
+
+def benchmark_cases(
+        grids=GRIDS,
+        fills=FILLS,
+        keep_ratios=KEEP_RATIOS,
+        margins=MARGINS,
+        pages=PAGES,
+) -> list[dict]:
+    """
+    All combinations of layout parameters and input sizes, smallest inputs first.
+
+    :return: list of cases as dicts with 'pages' and kwargs of compose_stickers
+    """
+    return [
+        {
+            'pages': count,
+            'stickers_in_width': width,
+            'stickers_in_height': height,
+            'fill': fill,
+            'keep_ratio': keep_ratio,
+            'sticker_margin': margin,
+        }
+        for count, (width, height), fill, keep_ratio, margin in product(pages, grids, fills, keep_ratios, margins)
+    ]
+
+
+def peak_rss() -> int | None:
+    """
+    Peak resident set size of the current process in bytes, None if it's unknown.
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+
+def measure(files_list: list[pathlib.Path], case: dict, options: dict) -> dict:
+    """
+    Process pool task. Composes stickers once and measures it.
+    Runs in a fresh process, so peak RSS belongs to this case only.
+
+    :param files_list: input files
+    :param case: layout parameters of the case
+    :param options: other kwargs of compose_stickers
+    :return: wall time in seconds, peak RSS and size of the result in bytes,
+    or error if the case can't be composed
+    """
+    kwargs = {k: v for k, v in case.items() if k != 'pages'}
+    with tempfile.TemporaryDirectory() as directory:
+        output = pathlib.Path(directory) / 'stickers.pdf'
+        start = time.perf_counter()
+        try:
+            compose_stickers(files_list, output, **kwargs, **options)
+        except UnprocessableArgumentsError as uae:
+            return {'error': str(uae)}
+        wall_time = time.perf_counter() - start
+        return {
+            'wall_time': round(wall_time, 4),
+            'peak_rss': peak_rss(),
+            'output_bytes': output.stat().st_size,
+        }
+
+
+def run_benchmarks(
+        cases: list[dict],
+        corpus: str | os.PathLike,
+        seed: int = 0,
+        **options
+) -> dict:
+    """
+    Runs every case in its own process on synthetic files from the corpus directory.
+    Files are generated on the first run and reused by the next ones.
+
+    :param cases: cases from benchmark_cases
+    :param corpus: directory for synthetic input files
+    :param seed: seed of synthetic files
+    :param options: other kwargs of compose_stickers, the same for all cases
+    :return: environment description and results of all cases
+    """
+    report = {
+        'started': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pypdf': pypdf.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'seed': seed,
+        'options': options,
+        'results': [],
+    }
+    corpora = {}
+    for case in cases:
+        if case['pages'] not in corpora:
+            corpora[case['pages']] = make_corpus(corpus, case['pages'], seed=seed)
+        # Spawned process doesn't inherit memory of the previous cases
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            result = executor.submit(measure, corpora[case['pages']], case, options).result()
+        report['results'].append({**case, **result})
+        print(json.dumps(report['results'][-1]), file=sys.stderr)
+    return report
+
+
+def compare_reports(previous: dict, current: dict) -> list[dict]:
+    """
+    Matches cases of two reports and calculates how measurements changed.
+
+    :param previous: report to compare with
+    :param current: new report
+    :return: list of cases present in both reports with ratios current / previous
+    """
+    before = {tuple(r.get(k) for k in CASE_KEYS): r for r in previous['results'] if 'error' not in r}
+    changes = []
+    for result in current['results']:
+        old = before.get(tuple(result.get(k) for k in CASE_KEYS))
+        if old is None or 'error' in result:
+            continue
+        change = {k: result[k] for k in CASE_KEYS}
+        for measurement in ('wall_time', 'peak_rss', 'output_bytes'):
+            if old.get(measurement) and result.get(measurement) is not None:
+                change[measurement] = round(result[measurement] / old[measurement], 3)
+        changes.append(change)
+    return changes
+
+
+def values_list(attr_key: str, convert, value: str, result_dict: dict) -> None:
+    """
+    Options that take comma separated list of values to benchmark.
+
+    :param attr_key: kwarg of benchmark_cases to set
+    :param convert: function to turn a single value into what benchmark_cases expects
+    :param value: comma separated values
+    :param result_dict: Dict of arguments to modify
+    """
+    try:
+        result_dict['matrix'][attr_key] = tuple(convert(v.strip().lower()) for v in value.split(','))
+    except ValueError:
+        raise UnprocessableArgumentsError([(value, 'Not a valid list of values'), ])
+
+
+def grid(value: str) -> tuple[int, int]:
+    width, height = value.split('x')
+    return int(width), int(height)
+
+
+def boolean(value: str) -> bool:
+    if value not in ('true', 'false'):
+        raise ValueError(value)
+    return value == 'true'
+
+
+def output_file(value: str, result_dict: dict) -> None:
+    result_dict['file_to_write'] = value
+
+
+def corpus_directory(value: str, result_dict: dict) -> None:
+    result_dict['corpus'] = value
+
+
+def compare_with(value: str, result_dict: dict) -> None:
+    try:
+        with open(value) as fp:
+            result_dict['previous'] = json.load(fp)
+    except (OSError, ValueError):
+        raise UnprocessableArgumentsError([(value, 'Not a readable benchmark report'), ])
+
+
+def set_seed(value: str, result_dict: dict) -> None:
+    try:
+        result_dict['seed'] = int(value)
+    except ValueError:
+        raise UnprocessableArgumentsError([(value, 'Should be an integer'), ])
+
+
+def option(setter, value: str, result_dict: dict) -> None:
+    """
+    Options of compose_stickers passed to all cases as they are.
+    """
+    setter(value=value, result_dict=result_dict['options'])
+
+
+def parse_arguments() -> dict:
+    """
+    Parse command line arguments. Lists are comma separated.
+
+    -f - optional. Name of the report file. Default is benchmark.json
+    --grids - optional. Grids to benchmark like 1x1,2x3
+    --pages - optional. Total numbers of input pages
+    --fill - optional. true, false or both
+    --keep-ratio - optional. true, false or both
+    --margins - optional. Margins in mm
+    --corpus - optional. Directory for synthetic input files
+    --seed - optional. Seed of synthetic input files
+    --compare - optional. Previous report to compare results with
+    -s, --stream, --workers, --xobjects, --optimize, --pack, --max-scale - optional. Passed to compose_stickers
+    as they are
+
+    :return: Dict of kwargs to main function
+    """
+    implemented_options = {
+        '-f': output_file,
+        '--grids': partial(values_list, 'grids', grid),
+        '--pages': partial(values_list, 'pages', int),
+        '--fill': partial(values_list, 'fills', boolean),
+        '--keep-ratio': partial(values_list, 'keep_ratios', boolean),
+        '--margins': partial(values_list, 'margins', int),
+        '--corpus': corpus_directory,
+        '--seed': set_seed,
+        '--compare': compare_with,
+        '-s': partial(option, set_paper_format),
+        '--stream': partial(option, set_stream),
+        '--workers': partial(option, set_workers),
+        '--xobjects': partial(option, set_xobjects),
+        '--optimize': partial(option, set_optimize),
+        '--pack': partial(option, set_packing),
+        '--max-scale': partial(option, set_max_scale),
+    }
+    options, rest = parse_options(sys.argv[1:], implemented_options)
+    if rest:
+        raise UnprocessableArgumentsError([(' '.join(rest), 'Unknown arguments'), ])
+
+    result = {
+        'file_to_write': 'benchmark.json',
+        'corpus': pathlib.Path(tempfile.gettempdir()) / 'pdf-stickers-corpus',
+        'seed': 0,
+        'previous': None,
+        'matrix': {},
+        'options': {},
+    }
+    for key, value in options:
+        implemented_options[key](value=value, result_dict=result)
+    return result
+
+
+def main(file_to_write, corpus, seed, previous, matrix, options) -> None:
+    report = run_benchmarks(benchmark_cases(**matrix), corpus, seed, **options)
+    if previous is not None:
+        report['changes'] = compare_reports(previous, report)
+    with open(file_to_write, 'w') as fp:
+        json.dump(report, fp, indent=2)
+
+
+if __name__ == '__main__':
+    try:
+        main(**parse_arguments())
+    except UnprocessableArgumentsError as uae:
+        print(uae)
+        sys.exit(1)
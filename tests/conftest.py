@@ -0,0 +1,40 @@
+import os
+import shutil
+
+import pytest
+from pypdf import PdfReader
+
+from app.Metrics import Metrics
+from app.main import compose_stickers
+from bench.corpus import make_corpus
+
+
+def texts(*paths: str | os.PathLike) -> list[str]:
+    """
+    Text of every page of the files, to compare what composed files show.
+    """
+    return [page.extract_text() for path in paths for page in PdfReader(path).pages]
+
+
+def compose(files, output: str | os.PathLike, **kwargs) -> Metrics:
+    """
+    Composes the job and gives its metrics.
+    """
+    metrics = Metrics()
+    compose_stickers(files, output, metrics=metrics, **kwargs)
+    return metrics
+
+
+@pytest.fixture(scope='session')
+def _corpus_files(tmp_path_factory):
+    return make_corpus(tmp_path_factory.mktemp('corpus'), 60, pages_per_file=5, content_size=300)
+
+
+@pytest.fixture
+def corpus(_corpus_files, tmp_path):
+    """
+    Copies of synthetic pdf files, 60 pages in total, that a test can change.
+    """
+    directory = tmp_path / 'corpus'
+    directory.mkdir()
+    return [shutil.copy(f, directory / f.name) for f in _corpus_files]
@@ -0,0 +1,58 @@
+import os
+from functools import partial
+
+from pypdf import PdfReader
+
+from app.incremental import manifest_path
+from app.main import compose_stickers
+from bench.corpus import make_pdf
+from tests.conftest import compose, texts
+
+compose_incremental = partial(compose, incremental=True)
+
+
+def test_unchanged_job_reuses_every_sheet(corpus, tmp_path):
+    output = tmp_path / 'stickers.pdf'
+    first = compose_incremental(corpus, output)
+    assert first.counters['reused_sheets'] == 0
+    assert manifest_path(output).exists()
+    composed = texts(output)
+
+    second = compose_incremental(corpus, output)
+    assert second.counters['sheets'] == first.counters['sheets'] == len(composed)
+    assert second.counters['reused_sheets'] == len(composed)
+    # Nothing is opened to compose
+    assert second.counters['files'] == 0
+    assert texts(output) == composed
+
+
+def test_changed_file_recomposes_only_its_sheets(corpus, tmp_path):
+    output = tmp_path / 'stickers.pdf'
+    compose_incremental(corpus, output)
+    changed = corpus[len(corpus) // 2]
+    pages = len(PdfReader(changed).pages)
+    make_pdf(changed, pages, seed=12345, content_size=300)
+
+    metrics = compose_incremental(corpus, output)
+    sheets = metrics.counters['sheets']
+    # Stickers of the file span at most two more sheets than they fill
+    assert sheets - 2 - pages // 6 <= metrics.counters['reused_sheets'] < sheets
+
+    expected = tmp_path / 'expected.pdf'
+    compose_stickers(corpus, expected)
+    assert texts(output) == texts(expected)
+
+
+def test_changed_layout_or_output_reuses_nothing(corpus, tmp_path):
+    output = tmp_path / 'stickers.pdf'
+    compose_incremental(corpus, output)
+
+    metrics = compose_incremental(corpus, output, stickers_in_width=3)
+    assert metrics.counters['reused_sheets'] == 0
+
+    # Output changed by something else is not trusted
+    with open(output, 'ab') as fp:
+        fp.write(b'\n')
+    os.utime(output, ns=(0, 0))
+    metrics = compose_incremental(corpus, output, stickers_in_width=3)
+    assert metrics.counters['reused_sheets'] == 0
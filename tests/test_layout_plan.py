@@ -0,0 +1,84 @@
+import random
+
+import numpy as np
+import pytest
+
+from app.main import plan_layout
+
+# A4 in points, the size pypdf gives for the default paper format
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+
+
+def placed_box(ctm: tuple[float, ...], width: float, height: float, left: float = 0, bottom: float = 0):
+    """
+    Bounding box of a media box on the sheet after transformation.
+    """
+    a, b, c, d, e, f = ctm
+    corners = [(left, bottom), (left + width, bottom), (left, bottom + height), (left + width, bottom + height)]
+    xs = [a * x + c * y + e for x, y in corners]
+    ys = [b * x + d * y + f for x, y in corners]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def baseline_box(index: int, width: float, height: float, columns: int, rows: int, margin_mm: int,
+                 fill: bool, keep_ratio: bool):
+    """
+    Where the grid layout placed a sticker before it was planned: rotated to the orientation of its cell,
+    scaled and moved to the lower left corner of the cell within margins.
+    """
+    margin = round(margin_mm * 2.8347)
+    space_width, space_height = PAGE_WIDTH / columns, PAGE_HEIGHT / rows
+    sticker_width, sticker_height = space_width - margin * 2, space_height - margin * 2
+    if keep_ratio and (width / height > 1) != (space_width / space_height > 1):
+        width, height = height, width
+    if fill:
+        width, height = sticker_width, sticker_height
+    else:
+        scale = min(sticker_width / width, sticker_height / height)
+        width, height = width * scale, height * scale
+    stickers_on_page = columns * rows
+    x = index % columns * space_width + margin
+    y = PAGE_HEIGHT - ((index % stickers_on_page) // columns + 1) * space_height + margin
+    return x, y, x + width, y + height
+
+
+@pytest.mark.parametrize('columns, rows, margin, fill, keep_ratio', [
+    (2, 3, 0, False, True),
+    (3, 4, 5, False, True),
+    (1, 1, 0, True, True),
+    (4, 2, 2, True, False),
+    (2, 5, 0, False, False),
+])
+def test_grid_matches_baseline_layout(columns, rows, margin, fill, keep_ratio):
+    rng = random.Random(columns * 100 + rows)
+    widths = [rng.uniform(50, 800) for _ in range(40)]
+    heights = [rng.uniform(50, 800) for _ in range(40)]
+    plan = plan_layout(widths, heights, stickers_in_width=columns, stickers_in_height=rows,
+                       sticker_margin=margin, fill=fill, keep_ratio=keep_ratio)
+
+    assert plan.sheets_count == -(-40 // (columns * rows))
+    for i, (w, h) in enumerate(zip(widths, heights)):
+        assert plan.sheets[i] == i // (columns * rows)
+        assert placed_box(plan.ctm(i), w, h) == pytest.approx(
+            baseline_box(i, w, h, columns, rows, margin, fill, keep_ratio)
+        )
+
+
+def test_media_box_offset_is_placed_as_box_at_origin():
+    plan = plan_layout([300, 300], [200, 200], lefts=[0, 50], bottoms=[0, -30])
+    shifted = placed_box(plan.ctm(1), 300, 200, 50, -30)
+    expected = placed_box(plan.ctm(0), 300, 200)
+    # Second sticker is in the next cell of the row
+    assert shifted == pytest.approx((expected[0] + PAGE_WIDTH / 2, expected[1],
+                                     expected[2] + PAGE_WIDTH / 2, expected[3]))
+
+
+def test_partial_plans_match_whole_plan():
+    rng = random.Random(1)
+    widths = [rng.uniform(50, 800) for _ in range(20)]
+    heights = [rng.uniform(50, 800) for _ in range(20)]
+    whole = plan_layout(widths, heights)
+    part = plan_layout(widths[7:], heights[7:], start=7)
+    assert np.allclose(whole.matrices[7:], part.matrices)
+    assert list(part.sheet(1)) == list(range(0, 5))
+    assert list(whole.sheet(1)) == list(range(6, 12))
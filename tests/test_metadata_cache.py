@@ -0,0 +1,35 @@
+from app import MetadataCache as cache_module
+from app.MetadataCache import MetadataCache
+
+
+def test_known_files_are_looked_up_without_writing(corpus, tmp_path):
+    cache = MetadataCache(tmp_path / 'cache.sqlite3')
+    first = cache.get_many(corpus)
+    changes = cache._connection.total_changes
+
+    assert cache.get_many(corpus) == first
+    assert cache._connection.total_changes == changes
+    assert sum(m['pages'] for m in first) == 60
+
+
+def test_entries_not_used_for_a_while_are_marked_used(corpus, tmp_path):
+    cache = MetadataCache(tmp_path / 'cache.sqlite3')
+    cache.get_many(corpus)
+    cache._connection.execute('UPDATE metadata SET used = 0')
+    cache._connection.commit()
+
+    cache.get(corpus[0])
+    used = dict(cache._connection.execute('SELECT hash, used FROM metadata').fetchall())
+    assert sorted(used.values())[-1] > 0 and sorted(used.values())[-2] == 0
+
+
+def test_least_recently_used_entries_are_evicted(corpus, tmp_path, monkeypatch):
+    cache = MetadataCache(tmp_path / 'cache.sqlite3', max_entries=3)
+    now = 1_000_000.0
+    for path in corpus[:5]:
+        now += cache_module.USED_PRECISION
+        monkeypatch.setattr(cache_module.time, 'time', lambda: now)
+        cache.get(path)
+    hashes = {h for h, in cache._connection.execute('SELECT hash FROM metadata')}
+    assert hashes == {cache.get(p)['hash'] for p in corpus[2:5]}
+    assert cache._connection.execute('SELECT COUNT(*) FROM paths').fetchone()[0] == 3
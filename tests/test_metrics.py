@@ -0,0 +1,18 @@
+import time
+
+from app.Metrics import Metrics
+
+
+def test_nested_stages_are_counted_once():
+    metrics = Metrics()
+    start = time.perf_counter()
+    with metrics.stage('collection', 'a.pdf'):
+        time.sleep(0.02)
+        with metrics.stage('open', 'a.pdf'):
+            time.sleep(0.03)
+    wall = time.perf_counter() - start
+
+    assert 0.03 <= metrics.stages['open'] < 0.05
+    assert 0.02 <= metrics.stages['collection'] < 0.03
+    assert sum(metrics.stages.values()) <= wall
+    assert metrics.files['a.pdf'] <= wall
@@ -0,0 +1,21 @@
+import io
+
+import pytest
+from pypdf import PdfReader, PdfWriter
+
+from app.optimize import write_optimized
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('%PDF-1.3', '%PDF-1.5'),
+    ('%PDF-1.7', '%PDF-1.7'),
+    ('%PDF-2.0', '%PDF-2.0'),
+])
+def test_version_is_raised_to_object_streams_only(header, expected):
+    writer = PdfWriter()
+    writer.add_blank_page(100, 100)
+    writer.pdf_header = header
+    output = io.BytesIO()
+    write_optimized(writer, output)
+    assert output.getvalue().startswith(expected.encode() + b'\n')
+    assert len(PdfReader(output).pages) == 1
@@ -0,0 +1,56 @@
+import random
+
+import numpy as np
+import pytest
+
+from app.main import plan_layout
+from tests.test_layout_plan import PAGE_HEIGHT, PAGE_WIDTH, placed_box
+
+
+def overlaps(first, second) -> bool:
+    return first[0] < second[2] - 1e-6 and second[0] < first[2] - 1e-6 \
+        and first[1] < second[3] - 1e-6 and second[1] < first[3] - 1e-6
+
+
+@pytest.mark.parametrize('margin, max_scale, keep_ratio', [(0, 100, True), (3, 100, True), (0, 50, False)])
+def test_packed_stickers_fit_pages_without_overlapping(margin, max_scale, keep_ratio):
+    rng = random.Random(margin + max_scale)
+    widths = [rng.uniform(30, 1200) for _ in range(60)]
+    heights = [rng.uniform(30, 1200) for _ in range(60)]
+    plan = plan_layout(widths, heights, sticker_margin=margin, packing=True, max_scale=max_scale,
+                       keep_ratio=keep_ratio)
+
+    # Pages keep the order of stickers
+    assert list(plan.sheets) == sorted(plan.sheets)
+    for number in range(plan.sheets_count):
+        boxes = [placed_box(plan.ctm(i), widths[i], heights[i]) for i in plan.sheet(number)]
+        assert boxes
+        for box in boxes:
+            assert box[0] >= -1e-6 and box[1] >= -1e-6
+            assert box[2] <= PAGE_WIDTH + 1e-6 and box[3] <= PAGE_HEIGHT + 1e-6
+        for j, box in enumerate(boxes):
+            assert not any(overlaps(box, other) for other in boxes[j + 1:])
+
+
+def test_packed_stickers_keep_their_size_unless_they_do_not_fit():
+    widths, heights = [100, 2000, 150], [50, 3000, 100]
+    plan = plan_layout(widths, heights, packing=True)
+    sizes = []
+    for i, (w, h) in enumerate(zip(widths, heights)):
+        left, bottom, right, top = placed_box(plan.ctm(i), w, h)
+        # Stickers can be turned, so only their sides are compared
+        sizes.append(sorted((right - left, top - bottom)))
+    assert sizes[0] == pytest.approx([50, 100])
+    assert sizes[2] == pytest.approx([100, 150])
+    assert sizes[1][0] < 2000 and sizes[1][1] <= PAGE_HEIGHT + 1e-6
+
+
+def test_packed_part_planned_from_its_first_page_matches_whole_plan():
+    rng = random.Random(7)
+    widths = [rng.uniform(30, 600) for _ in range(50)]
+    heights = [rng.uniform(30, 600) for _ in range(50)]
+    whole = plan_layout(widths, heights, packing=True)
+    first = whole.sheet(2).start
+    part = plan_layout(widths[first:], heights[first:], packing=True, start=first)
+    assert np.allclose(whole.matrices[first:], part.matrices)
+    assert list(whole.sheets[first:] - whole.sheets[first]) == list(part.sheets)
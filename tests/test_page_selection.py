@@ -0,0 +1,60 @@
+import pytest
+
+from app.PageSelection import PageSelection, parse_file
+from app.main import UnprocessableArgumentsError, parse_files, selected_pages
+
+
+@pytest.mark.parametrize('pages, count, expected', [
+    ('1', 5, [0]),
+    ('2-4', 5, [1, 2, 3]),
+    ('3-', 5, [2, 3, 4]),
+    ('-2', 5, [0, 1]),
+    ('1-:2', 6, [0, 2, 4]),
+    ('2-:2', 6, [1, 3, 5]),
+    ('1-5:3', 6, [0, 3]),
+    ('5,1-2,5', 5, [4, 0, 1, 4]),
+    (' 1 , 3 ', 5, [0, 2]),
+    ('-', 3, [0, 1, 2]),
+    ('-:2', 5, [0, 2, 4]),
+])
+def test_selected_indexes(pages, count, expected):
+    assert PageSelection('a.pdf', pages).indexes(count) == expected
+
+
+@pytest.mark.parametrize('pages', ['', '0', '3-2', 'a', '1-2-3', '1:0', '1,,2', ':2'])
+def test_invalid_selection(pages):
+    with pytest.raises(ValueError):
+        PageSelection('a.pdf', pages)
+
+
+def test_pages_beyond_the_end():
+    with pytest.raises(IndexError):
+        PageSelection('a.pdf', '2-7').indexes(5)
+    with pytest.raises(UnprocessableArgumentsError):
+        selected_pages(PageSelection('a.pdf', '6'), 5)
+
+
+def test_selection_is_a_path():
+    selection = PageSelection('dir/a.pdf', '1-2')
+    assert str(selection) == 'dir/a.pdf[1-2]'
+    assert selection.__fspath__() == 'dir/a.pdf'
+    assert selection == PageSelection('dir/a.pdf', ' 1-2')
+    assert selection != PageSelection('dir/a.pdf', '1,2')
+
+
+def test_parse_file(tmp_path):
+    selection = parse_file('a.pdf[1-20,45,100-]')
+    assert isinstance(selection, PageSelection)
+    assert selection.path.name == 'a.pdf' and selection.pages == '1-20,45,100-'
+    assert parse_file('a.pdf') == 'a.pdf'
+    # Existing files are taken as they are, even if they look like a selection
+    existing = tmp_path / 'b.pdf[1]'
+    existing.touch()
+    assert parse_file(str(existing)) == str(existing)
+
+
+def test_parse_files_collects_all_errors():
+    with pytest.raises(UnprocessableArgumentsError) as error:
+        parse_files(['a.pdf[0]', 'b.pdf', 'c.pdf[x]'])
+    assert [name for name, _ in error.value.unprocessable_arguments] == ['a.pdf[0]', 'c.pdf[x]']
+    assert selected_pages('b.pdf', 3) == range(3)
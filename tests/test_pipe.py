@@ -0,0 +1,33 @@
+import io
+
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import DecodedStreamObject, NameObject
+
+from app.pipe import split_documents
+
+
+def document(pages: int, attachment: bytes | None = None) -> bytes:
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(100, 100)
+    if attachment is not None:
+        # Uncompressed stream, as an attachment can be
+        embedded = DecodedStreamObject()
+        embedded.set_data(attachment)
+        writer._root_object[NameObject('/Attachment')] = writer._add_object(embedded)
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+def test_concatenated_documents_are_split():
+    documents = [document(1), document(2), document(3)]
+    split = list(split_documents(io.BytesIO(b'\n'.join(documents)), chunk_size=100))
+    assert [len(PdfReader(io.BytesIO(d)).pages) for d in split] == [1, 2, 3]
+
+
+def test_embedded_documents_do_not_split_the_one_they_are_in():
+    outer = document(2, attachment=document(1) + document(1))
+    split = list(split_documents(io.BytesIO(outer + document(3)), chunk_size=100))
+    assert [len(PdfReader(io.BytesIO(d)).pages) for d in split] == [2, 3]
+    assert split[0] == outer
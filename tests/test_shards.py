@@ -0,0 +1,85 @@
+import json
+import os
+from functools import partial
+
+import pytest
+
+from app.main import compose_stickers
+from app.shards import shard_path, shards_manifest_path
+from tests.conftest import compose, texts
+
+compose_sharded = partial(compose, shard_sheets=3)
+
+
+def shards(output) -> list:
+    return sorted(output.parent.glob(f'{output.stem}-*{output.suffix}'))
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_shards_hold_the_whole_job(corpus, tmp_path, workers):
+    output = tmp_path / 'stickers.pdf'
+    metrics = compose_sharded(corpus, output, workers=workers)
+    paths = shards(output)
+    # 60 stickers are 10 sheets of 6, in shards of 3 sheets
+    assert [p.name for p in paths] == [shard_path(output, n).name for n in range(1, 5)]
+    assert metrics.counters['sheets'] == 10 and metrics.counters['reused_sheets'] == 0
+
+    expected = tmp_path / 'expected.pdf'
+    compose_stickers(corpus, expected)
+    assert texts(*paths) == texts(expected)
+
+
+def test_finished_job_is_not_composed_again(corpus, tmp_path):
+    output = tmp_path / 'stickers.pdf'
+    compose_sharded(corpus, output)
+    written = {p: p.stat().st_mtime_ns for p in shards(output)}
+
+    metrics = compose_sharded(corpus, output)
+    assert metrics.counters['reused_sheets'] == metrics.counters['sheets'] == 10
+    assert metrics.counters['bytes_written'] == 0
+    assert {p: p.stat().st_mtime_ns for p in shards(output)} == written
+
+
+def test_interrupted_job_composes_only_unfinished_shards(corpus, tmp_path):
+    output = tmp_path / 'stickers.pdf'
+    compose_sharded(corpus, output)
+    composed = texts(*shards(output))
+    # One shard is missing and another one is cut off, as if the job was killed while writing them
+    shard_path(output, 2).unlink()
+    with open(shard_path(output, 4), 'r+b') as fp:
+        fp.truncate(100)
+
+    metrics = compose_sharded(corpus, output)
+    # Shards 2 and 4 hold 3 and 1 sheets
+    assert metrics.counters['reused_sheets'] == 6
+    assert texts(*shards(output)) == composed
+    manifest = json.loads(shards_manifest_path(output).read_text())
+    assert all(shard['bytes'] == (output.parent / shard['file']).stat().st_size for shard in manifest['shards'])
+
+
+def test_shard_rewritten_with_the_same_size_is_composed_again(corpus, tmp_path):
+    output = tmp_path / 'stickers.pdf'
+    compose_sharded(corpus, output)
+    composed = texts(*shards(output))
+    path = shard_path(output, 3)
+    size, mtime = path.stat().st_size, path.stat().st_mtime_ns
+    path.write_bytes(b'\0' * size)
+    os.utime(path, ns=(mtime + 10 ** 9, mtime + 10 ** 9))
+
+    metrics = compose_sharded(corpus, output)
+    assert metrics.counters['reused_sheets'] == 7
+    assert texts(*shards(output)) == composed
+
+
+def test_changed_job_replaces_all_shards(corpus, tmp_path):
+    output = tmp_path / 'stickers.pdf'
+    compose_sharded(corpus, output)
+
+    metrics = compose_sharded(corpus, output, shard_sheets=5)
+    assert metrics.counters['reused_sheets'] == 0
+    # Shards of the previous run beyond the new ones are removed
+    assert [p.name for p in shards(output)] == [shard_path(output, n).name for n in range(1, 3)]
+
+    expected = tmp_path / 'expected.pdf'
+    compose_stickers(corpus, expected)
+    assert texts(*shards(output)) == texts(expected)
@@ -0,0 +1,156 @@
+import queue
+import threading
+import tkinter as tk
+from tkinter import font
+from pathlib import Path
+from typing import Callable, Iterable
+
+
+class FileListView(tk.Frame):
+    """
+    Scrollable list of files with the number of pages of each one.
+
+    Only rows that fit in the window exist as canvas items, they are reused to show
+    whatever part of the list is scrolled to, so the size of the list doesn't matter.
+    Files are only appended or cleared, nothing is re-rendered for that.
+
+    Numbers of pages are counted with count_pages in a background thread by chunks
+    of files and shown as soon as they are known.
+    """
+    # Number of files to count pages of at once
+    CHUNK = 200
+    # Space for the number of pages in the beginning of a row
+    PAGES_WIDTH = 60
+
+    def __init__(self, master, count_pages: Callable[[list[Path]], list[int | None]], **kwargs):
+        """
+        :param master: parent widget
+        :param count_pages: function that takes a list of files and returns numbers of their pages,
+        None for files that can't be read. Called from a background thread
+        """
+        super().__init__(master, **kwargs)
+        self.count_pages = count_pages
+        self.files: list[Path] = []
+        self.pages: list[int | None | str] = []
+        # First visible row
+        self.top = 0
+        self.row_height = font.nametofont('TkDefaultFont').metrics('linespace') + 4
+        self.rows: list[tuple[int, int]] = []
+
+        self.canvas = tk.Canvas(master=self, highlightthickness=0, background='white')
+        self.scrollbar = tk.Scrollbar(master=self, orient=tk.VERTICAL, command=self.yview)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.canvas.bind('<Configure>', lambda e: self.render())
+        for widget in (self.canvas, self.scrollbar):
+            widget.bind('<MouseWheel>', lambda e: self.yview('scroll', -1 if e.delta > 0 else 1, 'units'))
+            widget.bind('<Button-4>', lambda e: self.yview('scroll', -1, 'units'))
+            widget.bind('<Button-5>', lambda e: self.yview('scroll', 1, 'units'))
+
+        # Chunks of files to count pages of, and the counted ones back to the UI thread.
+        # Every chunk is marked with the generation of the list, counts for cleared lists are dropped
+        self.generation = 0
+        self.pending = queue.Queue()
+        self.counted = queue.Queue()
+        threading.Thread(target=self._count, daemon=True).start()
+        self.after(100, self._poll)
+
+    @property
+    def visible_rows(self) -> int:
+        return max(self.canvas.winfo_height() // self.row_height, 1)
+
+    def append(self, files: Iterable[Path]) -> None:
+        """
+        Adds files to the end of the list and starts counting their pages
+        """
+        start = len(self.files)
+        self.files += files
+        self.pages += ['...'] * (len(self.files) - start)
+        for first in range(start, len(self.files), self.CHUNK):
+            self.pending.put((self.generation, first, self.files[first:first + self.CHUNK]))
+        self.render()
+
+    def clear(self) -> None:
+        self.generation += 1
+        self.files = []
+        self.pages = []
+        self.top = 0
+        self.render()
+
+    def yview(self, action: str, value, units: str | None = None) -> None:
+        """
+        Scrolls the list. Takes the same arguments Scrollbar gives to its command
+        """
+        if action == 'moveto':
+            self.top = round(float(value) * len(self.files))
+        elif action == 'scroll':
+            self.top += int(value) * (self.visible_rows if units == 'pages' else 1)
+        self.render()
+
+    def render(self) -> None:
+        """
+        Shows the files that fit in the window starting from the top one
+        """
+        visible = self.visible_rows
+        self.top = max(min(self.top, len(self.files) - visible), 0)
+
+        # Rows are created once for the height of the window
+        while len(self.rows) < visible + 1:
+            y = len(self.rows) * self.row_height + 2
+            self.rows.append((
+                self.canvas.create_text(self.PAGES_WIDTH - 10, y, anchor='ne', font='TkDefaultFont'),
+                self.canvas.create_text(self.PAGES_WIDTH, y, anchor='nw', font='TkDefaultFont'),
+            ))
+        for i, (pages_item, file_item) in enumerate(self.rows):
+            index = self.top + i
+            if index < len(self.files):
+                pages = self.pages[index]
+                self.canvas.itemconfigure(pages_item, text='?' if pages is None else str(pages))
+                self.canvas.itemconfigure(file_item, text=str(self.files[index]))
+            else:
+                self.canvas.itemconfigure(pages_item, text='')
+                self.canvas.itemconfigure(file_item, text='')
+
+        if self.files:
+            self.scrollbar.set(self.top / len(self.files), min((self.top + visible) / len(self.files), 1))
+        else:
+            self.scrollbar.set(0, 1)
+
+    def _count(self) -> None:
+        """
+        Background thread. Counts pages of pending files
+        """
+        while True:
+            generation, first, files = self.pending.get()
+            if generation != self.generation:
+                continue
+            try:
+                counts = self.count_pages(files)
+            except Exception:
+                # One missing or broken file fails the chunk, so files are counted one by one
+                # and only the failing ones are left without a number
+                counts = [self._count_file(f) for f in files]
+            self.counted.put((generation, first, counts))
+
+    def _count_file(self, file: Path) -> int | None:
+        try:
+            return self.count_pages([file])[0]
+        except Exception:
+            return None
+
+    def _poll(self) -> None:
+        """
+        Shows counted pages, if any of them are visible
+        """
+        changed = False
+        while True:
+            try:
+                generation, first, counts = self.counted.get_nowait()
+            except queue.Empty:
+                break
+            if generation == self.generation:
+                self.pages[first:first + len(counts)] = counts
+                changed = changed or first < self.top + self.visible_rows and first + len(counts) > self.top
+        if changed:
+            self.render()
+        self.after(100, self._poll)
@@ -0,0 +1,230 @@
+import queue
+import threading
+import tkinter as tk
+from pathlib import Path
+from typing import Callable, Iterable
+
+from app.main import UnprocessableArgumentsError, metadata_boxes, plan_layout
+
+
+def sticker_boxes(plan, number: int) -> list[tuple[float, float, float, float, int]]:
+    """
+    Where stickers of a sheet end up, without touching their content.
+
+    :param plan: LayoutPlan of the job
+    :param number: number of the sheet
+    :return: list of (left, bottom, width, height, rotation) of every sticker on the sheet in points
+    """
+    import numpy as np
+
+    stickers = plan.sheet(number)
+    part = slice(stickers.start, stickers.stop)
+    rotations = plan.rotations[part]
+    swap = (rotations == 90) | (rotations == 270)
+    widths = np.where(swap, plan.heights[part], plan.widths[part]) * plan.scales_x[part]
+    heights = np.where(swap, plan.widths[part], plan.heights[part]) * plan.scales_y[part]
+    return list(zip(plan.x[part].tolist(), plan.y[part].tolist(), widths.tolist(), heights.tolist(),
+                    rotations.tolist()))
+
+
+class LayoutPreview(tk.Frame):
+    """
+    Sheets of the job drawn from sizes of pages only: outlines of sheets, placed stickers
+    with a mark on the side the top of every sticker goes to, and the number of sheets.
+
+    Sizes of pages are read with read_metadata in a background thread by chunks of files,
+    and the preview is updated as soon as they are known. The whole job is planned at once
+    with array operations, but only sheets that fit in the window are drawn,
+    so the size of the job doesn't matter.
+    """
+    # Number of files to read sizes of at once
+    CHUNK = 200
+    # Space around and between sheets
+    GAP = 10
+    # Stickers smaller than that in pixels are drawn without the mark of their top
+    MARK_SIZE = 6
+
+    def __init__(self, master, read_metadata: Callable[[list[Path]], list[dict]], **kwargs):
+        """
+        :param master: parent widget
+        :param read_metadata: function that takes a list of files and returns their metadata
+        (see app.MetadataCache.read_metadata). Called from a background thread
+        """
+        super().__init__(master, **kwargs)
+        self.read_metadata = read_metadata
+        self.files: list[Path] = []
+        # Metadata of files, None till it's read
+        self.metadata: list[dict | None] = []
+        # Number of leading files with known metadata. Only they are planned, to keep the order of stickers
+        self.known = 0
+        self.unreadable = 0
+        self.boxes = {'widths': [], 'heights': [], 'lefts': [], 'bottoms': [], 'rotations': []}
+        self.layout: dict | None = None
+        self.plan = None
+        self.error = None
+        # First visible sheet
+        self.first = 0
+
+        self.label = tk.Label(master=self, anchor='w')
+        self.canvas = tk.Canvas(master=self, highlightthickness=0, background='gray75')
+        self.scrollbar = tk.Scrollbar(master=self, orient=tk.HORIZONTAL, command=self.xview)
+        self.label.pack(side=tk.TOP, fill=tk.X)
+        self.scrollbar.pack(side=tk.BOTTOM, fill=tk.X)
+        self.canvas.pack(fill=tk.BOTH, expand=True)
+        self.canvas.bind('<Configure>', lambda e: self.render())
+        for widget in (self.canvas, self.scrollbar):
+            widget.bind('<MouseWheel>', lambda e: self.xview('scroll', -1 if e.delta > 0 else 1, 'units'))
+            widget.bind('<Button-4>', lambda e: self.xview('scroll', -1, 'units'))
+            widget.bind('<Button-5>', lambda e: self.xview('scroll', 1, 'units'))
+
+        # Chunks of files to read, and the read ones back to the UI thread.
+        # Every chunk is marked with the generation of the list, chunks of cleared lists are dropped
+        self.generation = 0
+        self.pending = queue.Queue()
+        self.read = queue.Queue()
+        threading.Thread(target=self._read, daemon=True).start()
+        self.after(100, self._poll)
+
+    @property
+    def sheets_count(self) -> int:
+        return self.plan.sheets_count if self.plan is not None else 0
+
+    def append(self, files: Iterable[Path]) -> None:
+        """
+        Adds files to the end of the job and starts reading sizes of their pages
+        """
+        start = len(self.files)
+        self.files += files
+        self.metadata += [None] * (len(self.files) - start)
+        for first in range(start, len(self.files), self.CHUNK):
+            self.pending.put((self.generation, first, self.files[first:first + self.CHUNK]))
+        self.update_plan()
+
+    def clear(self) -> None:
+        self.generation += 1
+        self.files = []
+        self.metadata = []
+        self.known = 0
+        self.unreadable = 0
+        self.boxes = {k: [] for k in self.boxes}
+        self.first = 0
+        self.update_plan()
+
+    def set_layout(self, layout: dict | None) -> None:
+        """
+        :param layout: layout parameters of plan_layout, None if they can't be read from the controls
+        """
+        self.layout = layout
+        self.update_plan()
+
+    def update_plan(self) -> None:
+        self.plan = None
+        self.error = None
+        if self.layout is None:
+            self.error = 'Layout parameters should be integers'
+        else:
+            try:
+                self.plan = plan_layout(**self.boxes, **self.layout)
+            except UnprocessableArgumentsError as e:
+                self.error = '; '.join(f'{name}: {why}' for name, why in e.unprocessable_arguments)
+        self.render()
+
+    def xview(self, action: str, value, units: str | None = None) -> None:
+        """
+        Scrolls the sheets. Takes the same arguments Scrollbar gives to its command
+        """
+        if action == 'moveto':
+            self.first = round(float(value) * self.sheets_count)
+        elif action == 'scroll':
+            self.first += int(value) * (self._visible_sheets()[0] if units == 'pages' else 1)
+        self.render()
+
+    def _visible_sheets(self) -> tuple[int, float]:
+        """
+        :return: number of sheets that fit in the window and the scale they are drawn with
+        """
+        width, height = self.canvas.winfo_width(), self.canvas.winfo_height()
+        page_width, page_height = self.plan.page_width, self.plan.page_height
+        scale = max(min((height - 2 * self.GAP) / page_height, (width - 2 * self.GAP) / page_width), 0.01)
+        return max(int((width - self.GAP) // (page_width * scale + self.GAP)), 1), scale
+
+    def render(self) -> None:
+        """
+        Draws the sheets that fit in the window starting from the first visible one
+        """
+        self.canvas.delete('all')
+        if self.plan is None:
+            self.label.config(text=self.error or '')
+            self.scrollbar.set(0, 1)
+            return
+
+        text = f'{self.sheets_count} sheets, {len(self.plan)} stickers'
+        if self.known < len(self.files):
+            text += f', reading files {self.known} / {len(self.files)}'
+        if self.unreadable:
+            text += f', {self.unreadable} files can\'t be read'
+        self.label.config(text=text)
+        if not self.sheets_count:
+            self.scrollbar.set(0, 1)
+            return
+
+        visible, scale = self._visible_sheets()
+        self.first = max(min(self.first, self.sheets_count - visible), 0)
+        page_width, page_height = self.plan.page_width * scale, self.plan.page_height * scale
+        for i, number in enumerate(range(self.first, min(self.first + visible, self.sheets_count))):
+            left = self.GAP + i * (page_width + self.GAP)
+            top = self.GAP
+            self.canvas.create_rectangle(left, top, left + page_width, top + page_height, fill='white', outline='')
+            for x, y, width, height, rotation in sticker_boxes(self.plan, number):
+                # Origin of a page is its left bottom corner
+                x0, y1 = left + x * scale, top + page_height - y * scale
+                x1, y0 = x0 + width * scale, y1 - height * scale
+                self.canvas.create_rectangle(x0, y0, x1, y1, outline='steel blue')
+                if x1 - x0 < self.MARK_SIZE or y1 - y0 < self.MARK_SIZE:
+                    continue
+                # Stickers are rotated clockwise, so their top goes to the right side, the bottom and the left one
+                mark = {0: (x0, y0, x1, y0), 90: (x1, y0, x1, y1), 180: (x0, y1, x1, y1), 270: (x0, y0, x0, y1)}
+                self.canvas.create_line(*mark[rotation], fill='orange red', width=2)
+            self.canvas.create_text(left + 3, top + 2, anchor='nw', text=str(number + 1), font='TkSmallCaptionFont')
+        self.scrollbar.set(self.first / self.sheets_count, min((self.first + visible) / self.sheets_count, 1))
+
+    def _read(self) -> None:
+        """
+        Background thread. Reads sizes of pages of pending files
+        """
+        while True:
+            generation, first, files = self.pending.get()
+            if generation != self.generation:
+                continue
+            try:
+                metadata = self.read_metadata(files)
+            except Exception as e:
+                metadata = [{'pages': 0, 'error': str(e)}] * len(files)
+            self.read.put((generation, first, metadata))
+
+    def _poll(self) -> None:
+        """
+        Plans the job again with files whose sizes became known
+        """
+        known = self.known
+        while True:
+            try:
+                generation, first, metadata = self.read.get_nowait()
+            except queue.Empty:
+                break
+            if generation == self.generation:
+                self.metadata[first:first + len(metadata)] = metadata
+        while self.known < len(self.files) and self.metadata[self.known] is not None:
+            m = self.metadata[self.known]
+            try:
+                if m['error']:
+                    raise UnprocessableArgumentsError([(str(self.files[self.known]), m['error']), ])
+                # Only selected pages of the file are used
+                for key, values in metadata_boxes([m], [self.files[self.known]]).items():
+                    self.boxes[key] += values
+            except UnprocessableArgumentsError:
+                self.unreadable += 1
+            self.known += 1
+        if self.known != known:
+            self.update_plan()
+        self.after(100, self._poll)
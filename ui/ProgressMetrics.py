@@ -0,0 +1,30 @@
+import queue
+import threading
+
+from app.Metrics import Metrics
+
+
+class CompositionCancelled(Exception):
+    pass
+
+
+class ProgressMetrics(Metrics):
+    """
+    Metrics that report progress of composition running in a background thread
+    and stop it as soon as it's cancelled.
+
+    Progress is put in the queue as ('progress', sheets done, sheets planned),
+    the UI thread is expected to take it from there.
+    """
+    def __init__(self, events: queue.Queue, cancelled: threading.Event):
+        super().__init__()
+        self.events = events
+        self.cancelled = cancelled
+
+    def count(self, name: str, value: int = 1) -> None:
+        super().count(name, value)
+        # Pages are counted for every placed sticker, so the job stops right away
+        if self.cancelled.is_set():
+            raise CompositionCancelled()
+        if name in ('sheets', 'planned_sheets'):
+            self.events.put(('progress', self.counters['sheets'], self.counters['planned_sheets']))
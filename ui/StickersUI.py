@@ -1,21 +1,23 @@
-import os
+import queue
+import threading
 import tkinter as tk
 from pathlib import Path
 from tkinter import ttk, filedialog, messagebox
 from typing import Iterable
 
-from pypdf import PaperSize
-
-from app.main import compose_stickers, UnprocessableArgumentsError
-
-PAPER_SIZES = [s for s in dir(PaperSize) if not s.startswith('__')]
+from app.main import compose_stickers, scan_directory, selected_pages, UnprocessableArgumentsError, PAPER_SIZES
+from app.MetadataCache import default_cache, read_metadata
+from app.PageSelection import PageSelection
+from .FileListView import FileListView
+from .LayoutPreview import LayoutPreview
+from .ProgressMetrics import ProgressMetrics, CompositionCancelled
 
 
 class StickersUI:
     def __init__(self, keeper):
         self.root = tk.Tk()
         self.root.title('Sticker stacker')
-        self.root.minsize(width=600, height=300)
+        self.root.minsize(width=600, height=500)
         self.root.eval('tk::PlaceWindow . center')
 
         # State variables:
@@ -25,7 +27,12 @@ class StickersUI:
         self.browse_mode = tk.IntVar()
         self.keep_ratio = tk.BooleanVar(value=True)
         self.fill = tk.BooleanVar(value=False)
+        self.recursive = tk.BooleanVar(value=False)
         self.sticker_margin = tk.IntVar(value=0)
+        self.packing = tk.BooleanVar(value=False)
+        self.max_scale = tk.IntVar(value=100)
+        # Pages of files to use, like 1-20,45,100-. All pages if empty
+        self.pages = tk.StringVar(value='')
         # This list needed to pick right function based on browse_mode state.
         # Values of radio buttons correspond to indexes in this list.
         self.browse_functions = [self.browse_directory, self.browse_files]
@@ -33,12 +40,20 @@ class StickersUI:
         self.initial_browse_files_dir = Path()
         self.initial_save_dir = Path()
         self._file_list = []
+        # Files are checked and planned without being parsed again if they are not changed
+        self.cache = default_cache()
+        # Composition running in background: its events for the UI thread and a way to stop it
+        self.events = queue.Queue()
+        self.cancelled = threading.Event()
+        self.worker = None
 
         # Frames:
         # Main frames
         self.frm_radios = tk.Frame(master=self.root, padx=1, pady=5)
         self.frm_buttons = tk.Frame(master=self.root, padx=10, pady=5)
-        self.frm_file_list = tk.Frame(master=self.root, height=100, padx=10, pady=5, bd=1, relief=tk.SUNKEN)
+        self.frm_progress = tk.Frame(master=self.root, padx=10, pady=5)
+        self.frm_preview = tk.Frame(master=self.root, height=200, padx=10, pady=5)
+        self.frm_file_list = tk.Frame(master=self.root, height=100, padx=10, pady=5)
         # Frames of layout settings
         self.frm_layout = tk.Frame(master=self.root, padx=10, pady=10)
         self.frm_grid = tk.Frame(master=self.frm_layout)
@@ -50,13 +65,14 @@ class StickersUI:
         self.frm_options.pack(fill=tk.X)
         self.frm_radios.pack(fill=tk.X)
         self.frm_buttons.pack(fill=tk.X)
+        self.frm_preview.pack(fill=tk.BOTH, expand=True)
         self.frm_file_list.pack(fill=tk.BOTH, expand=True)
         self.frm_grid.pack(side=tk.LEFT)
         self.frm_paper_size.pack(side=tk.RIGHT, fill=tk.BOTH, pady=2)
 
         # Layout parameters:
         self.cbx_paper_size = ttk.Combobox(master=self.frm_paper_size,
-                                           values=PAPER_SIZES,
+                                           values=list(PAPER_SIZES),
                                            width=5,
                                            textvariable=self.paper_size, )
         self.sbx_stickers_in_width = tk.Spinbox(master=self.frm_grid, from_=1, to=40, width=5,
@@ -65,6 +81,8 @@ class StickersUI:
                                                  textvariable=self.stickers_in_height)
         self.sbx_sticker_margin = tk.Spinbox(master=self.frm_grid, from_=-100, to=100, width=5,
                                              textvariable=self.sticker_margin)
+        self.sbx_max_scale = tk.Spinbox(master=self.frm_grid, from_=1, to=1000, width=5,
+                                        textvariable=self.max_scale)
 
         self.sbx_stickers_in_width.grid(column=0, row=0)
         tk.Label(master=self.frm_grid, text='stickers across the page').grid(column=1, row=0, sticky='w', padx=3)
@@ -73,7 +91,11 @@ class StickersUI:
         tk.Label(master=self.frm_grid, text='stickers down the page').grid(column=1, row=1, sticky='w', padx=3)
 
         self.sbx_sticker_margin.grid(column=0, row=2)
-        tk.Label(master=self.frm_grid, text='Margins around the stickers in mm:').grid(column=1, row=2, sticky='w', padx=3)
+        tk.Label(master=self.frm_grid, text='Margins around the stickers in mm:').grid(column=1, row=2, sticky='w',
+                                                                                      padx=3)
+
+        self.sbx_max_scale.grid(column=0, row=3)
+        tk.Label(master=self.frm_grid, text='Scale of packed stickers in %').grid(column=1, row=3, sticky='w', padx=3)
 
         self.cbx_paper_size.grid(column=1, row=0)
         tk.Label(master=self.frm_paper_size, text='Pape size:').grid(column=0, row=0, padx=3)
@@ -84,8 +106,22 @@ class StickersUI:
         self.cbt_keep_ratio = tk.Checkbutton(master=self.frm_options, text='Rotate to keep original ratio',
                                              variable=self.keep_ratio)
 
+        self.cbt_packing = tk.Checkbutton(master=self.frm_options, text='Pack stickers at their own size',
+                                          variable=self.packing)
+
+        self.cbt_recursive = tk.Checkbutton(master=self.frm_options, text='Include subdirectories',
+                                            variable=self.recursive)
+
         self.cbt_fill.pack(side=tk.TOP, anchor=tk.W)
         self.cbt_keep_ratio.pack(side=tk.TOP, anchor=tk.W)
+        self.cbt_packing.pack(side=tk.TOP, anchor=tk.W)
+        self.cbt_recursive.pack(side=tk.TOP, anchor=tk.W)
+
+        self.frm_pages = tk.Frame(master=self.frm_options)
+        tk.Label(master=self.frm_pages, text='Pages of added files (e.g. 1-20,45,100-):').pack(side=tk.LEFT)
+        self.ent_pages = tk.Entry(master=self.frm_pages, width=20, textvariable=self.pages)
+        self.ent_pages.pack(side=tk.LEFT, padx=3)
+        self.frm_pages.pack(side=tk.TOP, anchor=tk.W)
 
         # Radios:
         self.rbn_browse_dir = tk.Radiobutton(master=self.frm_radios,
@@ -107,6 +143,28 @@ class StickersUI:
         self.btn_clear.pack(side=tk.LEFT, padx=4)
         self.btn_save.pack(side=tk.RIGHT)
 
+        # List of selected files
+        self.lst_files = FileListView(master=self.frm_file_list, count_pages=self.count_pages, bd=1, relief=tk.SUNKEN)
+        self.lst_files.pack(fill=tk.BOTH, expand=True)
+
+        # Preview of sheets, redrawn whenever layout parameters change
+        self.cnv_preview = LayoutPreview(master=self.frm_preview, read_metadata=self.read_metadata,
+                                         bd=1, relief=tk.SUNKEN)
+        self.cnv_preview.pack(fill=tk.BOTH, expand=True)
+        for variable in (self.paper_size, self.stickers_in_width, self.stickers_in_height, self.sticker_margin,
+                         self.fill, self.keep_ratio, self.packing, self.max_scale):
+            variable.trace_add('write', lambda *args: self.update_preview())
+        self.update_preview()
+
+        # Progress of composition. Shown only while it's running
+        self.pbr_progress = ttk.Progressbar(master=self.frm_progress, mode='determinate')
+        self.lbl_progress = tk.Label(master=self.frm_progress, width=20, anchor='e')
+        self.btn_cancel = tk.Button(master=self.frm_progress, text='Cancel', command=self.cancel)
+        self.pbr_progress.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.lbl_progress.pack(side=tk.LEFT, padx=4)
+        self.btn_cancel.pack(side=tk.RIGHT)
+        self.root.protocol('WM_DELETE_WINDOW', self.close)
+
         # Set preferences to keep between runs
         # Pass attribute names to method
         if keeper:
@@ -119,7 +177,10 @@ class StickersUI:
                     'browse_mode',
                     'fill',
                     'keep_ratio',
+                    'recursive',
                     'sticker_margin',
+                    'packing',
+                    'max_scale',
                     'initial_browse_dir',
                     'initial_browse_files_dir',
                     'initial_save_dir',
@@ -137,21 +198,77 @@ class StickersUI:
     @file_list.setter
     def file_list(self, value) -> None:
         """
-        Whenever file_list is setted, this function re-renders the list of selected files in the window
-        and manages the state of the buttons accordingly
+        Whenever file_list is setted, this function updates the list of selected files in the window
+        and manages the state of the buttons accordingly. Files appended to the current list
+        are just added to the shown list
         :param value: new list to set
         """
-        self._file_list = value
-        for w in self.frm_file_list.winfo_children():
-            w.destroy()
-        if self._file_list:
-            self.btn_clear.config(state=tk.ACTIVE)
-            self.btn_save.config(state=tk.ACTIVE)
-            for i, f in enumerate(self._file_list):
-                tk.Label(master=self.frm_file_list, text=str(f.resolve())).grid(column=0, row=i, sticky='nw')
+        self._file_list = list(value)
+        shown = self.lst_files.files
+        if len(self._file_list) < len(shown) or self._file_list[:len(shown)] != shown:
+            self.lst_files.clear()
+            self.cnv_preview.clear()
+        self.lst_files.append(self._file_list[len(self.lst_files.files):])
+        self.cnv_preview.append(self._file_list[len(self.cnv_preview.files):])
+        state = tk.ACTIVE if self._file_list else tk.DISABLED
+        self.btn_clear.config(state=state)
+        self.btn_save.config(state=state)
+
+    def count_pages(self, files: list[Path]) -> list[int | None]:
+        """
+        Numbers of used pages of files, None for files that can't be read or don't have
+        selected pages. Runs in a background thread
+        :param files: list of files
+        """
+        if self.cache is not None:
+            counts = [None if m['error'] else m['pages'] for m in self.cache.get_many(files)]
         else:
-            self.btn_clear.config(state=tk.DISABLED)
-            self.btn_save.config(state=tk.DISABLED)
+            from app.SourceReader import SourceReader
+
+            counts = []
+            for f in files:
+                try:
+                    counts.append(SourceReader(f).pages_count)
+                except Exception:
+                    counts.append(None)
+        for i, (f, count) in enumerate(zip(files, counts)):
+            try:
+                counts[i] = None if count is None else len(selected_pages(f, count))
+            except UnprocessableArgumentsError:
+                counts[i] = None
+        return counts
+
+    def read_metadata(self, files: list[Path]) -> list[dict]:
+        """
+        Sizes and rotations of pages of files, see app.MetadataCache.read_metadata. Runs in a background thread
+        :param files: list of files
+        """
+        if self.cache is not None:
+            return self.cache.get_many(files)
+        return [read_metadata(f) for f in files]
+
+    def layout(self) -> dict:
+        """
+        Layout parameters of compose_stickers chosen in the window
+        :raise tk.TclError: if a number can't be read from its spinbox
+        """
+        return {
+            'stickers_in_width': self.stickers_in_width.get(),
+            'stickers_in_height': self.stickers_in_height.get(),
+            'paper_format': self.paper_size.get(),
+            'sticker_margin': self.sticker_margin.get(),
+            'keep_ratio': self.keep_ratio.get(),
+            'fill': self.fill.get(),
+            'packing': self.packing.get(),
+            'max_scale': self.max_scale.get(),
+        }
+
+    def update_preview(self) -> None:
+        try:
+            layout = self.layout()
+        except tk.TclError:
+            layout = None
+        self.cnv_preview.set_layout(layout)
 
     def browse_files(self) -> Iterable[Path]:
         """
@@ -171,20 +288,31 @@ class StickersUI:
 
     def browse_directory(self) -> Iterable[Path]:
         """
-        Get a list of .pdf files contained in a directory selected with directory dialog window
-        :return: list of Paht objects of these files
+        Get a list of .pdf files contained in a directory selected with directory dialog window,
+        and in its subdirectories if chosen so
+        :return: list of Paht objects of these files in natural order
         """
         dir_name = tk.filedialog.askdirectory(initialdir=self.initial_browse_dir)
         if not dir_name:
             return []
         self.initial_browse_dir = Path(dir_name)
-        return [self.initial_browse_dir / f for f in os.listdir(dir_name) if f.endswith(('.pdf', '.PDF',))]
+        return scan_directory(dir_name, recursive=self.recursive.get())
 
     def browse(self) -> None:
         """
-        Append a list of files received from the browse function picked based on browse_mode state
+        Append a list of files received from the browse function picked based on browse_mode state,
+        with the chosen pages of them if any
         """
-        self.file_list += self.browse_functions[self.browse_mode.get()]()
+        pages = self.pages.get().strip()
+        try:
+            if pages:
+                # Checked before files are picked, so nothing is added with wrong pages
+                PageSelection('', pages)
+        except ValueError as e:
+            messagebox.showerror(message=f'Pages {pages} can\'t be used: {e}')
+            return
+        files = self.browse_functions[self.browse_mode.get()]()
+        self.file_list += [PageSelection(f, pages) for f in files] if pages else files
 
     def clear(self) -> None:
         self.file_list = []
@@ -199,21 +327,104 @@ class StickersUI:
             path_to_save = Path(file_to_save)
             # Keep chosen directory to save it in preferences
             self.initial_save_dir = path_to_save.parent
-            kwargs = {
-                'stickers_in_width': self.stickers_in_width.get(),
-                'stickers_in_height': self.stickers_in_height.get(),
-                'paper_format': self.paper_size.get(),
-                'sticker_margin': self.sticker_margin.get(),
-                'keep_ratio': self.keep_ratio.get(),
-                'fill': self.fill.get(),
-            }
+            self.start(path_to_save, self.layout())
+
+    def start(self, path_to_save: Path, kwargs: dict) -> None:
+        """
+        Runs composition in a background thread and shows its progress till it's done
+        :param path_to_save: file to write
+        :param kwargs: layout parameters of compose_stickers
+        """
+        self.cancelled.clear()
+        metrics = ProgressMetrics(self.events, self.cancelled)
+        self.worker = threading.Thread(
+            target=self.compose,
+            args=(list(self.file_list), path_to_save, metrics, kwargs),
+            daemon=True,
+        )
+        for button in (self.btn_browse, self.btn_clear, self.btn_save):
+            button.config(state=tk.DISABLED)
+        self.pbr_progress.config(mode='indeterminate', value=0)
+        self.pbr_progress.start()
+        self.lbl_progress.config(text='Preparing...')
+        self.btn_cancel.config(state=tk.ACTIVE)
+        self.frm_progress.pack(fill=tk.X, after=self.frm_buttons)
+        self.worker.start()
+        self.root.after(100, self.poll)
+
+    def compose(self, files: list[Path], path_to_save: Path, metrics: ProgressMetrics, kwargs: dict) -> None:
+        """
+        Background thread. Composes stickers and puts the outcome in the events queue,
+        as Tk can be used from its own thread only
+        """
+        try:
+            compose_stickers(files, path_to_save, metrics=metrics, cache=self.cache, **kwargs)
+        except CompositionCancelled:
+            self.events.put(('cancelled',))
+        except UnprocessableArgumentsError as e:
+            self.events.put(('error', str(e)))
+        except Exception as e:
+            self.events.put(('error', f'{type(e).__name__}: {e}'))
+        else:
+            self.events.put(('done',))
+
+    def poll(self) -> None:
+        """
+        Takes events of running composition from the queue and shows them
+        """
+        while True:
             try:
-                compose_stickers(self.file_list, path_to_save, **kwargs)
-            except UnprocessableArgumentsError as e:
-                messagebox.showerror(message=str(e))
-            # Save used preferences
-            if self.keeper:
-                self.keeper.save()
+                event, *args = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if event == 'progress':
+                self.show_progress(*args)
+                continue
+            self.finish()
+            if event == 'error':
+                messagebox.showerror(message=args[0])
+            return
+        self.root.after(100, self.poll)
+
+    def show_progress(self, done: int, total: int) -> None:
+        if not total:
+            self.lbl_progress.config(text=f'{done} sheets')
+            return
+        if str(self.pbr_progress.cget('mode')) != 'determinate':
+            self.pbr_progress.stop()
+            self.pbr_progress.config(mode='determinate', maximum=total)
+        self.pbr_progress.config(value=done)
+        self.lbl_progress.config(text=f'{done} / {total} sheets' if done < total else 'Writing...')
+
+    def finish(self) -> None:
+        self.worker = None
+        self.pbr_progress.stop()
+        self.frm_progress.pack_forget()
+        self.btn_browse.config(state=tk.ACTIVE)
+        # Other buttons depend on the list of files
+        state = tk.ACTIVE if self.file_list else tk.DISABLED
+        self.btn_clear.config(state=state)
+        self.btn_save.config(state=state)
+        # Save used preferences
+        if self.keeper:
+            self.keeper.save()
+
+    def cancel(self) -> None:
+        """
+        Asks running composition to stop. It's stopped at the next sticker, nothing is written
+        """
+        self.cancelled.set()
+        self.btn_cancel.config(state=tk.DISABLED)
+        self.lbl_progress.config(text='Cancelling...')
+
+    def close(self) -> None:
+        """
+        Stops running composition, so it doesn't leave partially written file, and closes the window
+        """
+        if self.worker is not None:
+            self.cancelled.set()
+            self.worker.join()
+        self.root.destroy()
 
     def run(self) -> None:
         """